@@ -11,7 +11,7 @@ import os
 import json
 from pathlib import Path
 from typing import Dict, List, Any, Tuple
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -60,6 +60,29 @@ class AgentRun:
     metrics: Dict[str, Any]
     accuracy_score: float = 0.0
 
+    # Prompt cache tokens, included in input_tokens
+    cache_read_tokens: int = 0
+    cache_creation_tokens: int = 0
+
+    # Tool call metrics (runs recorded before `tool_calls` was added have none)
+    tool_calls_count: int = 0
+    tool_time_seconds: float = 0.0
+    tool_errors: int = 0
+    tool_output_tokens: int = 0
+    tool_calls: List[Dict[str, Any]] = field(default_factory=list)
+
+    # Per step latencies of the intent agent, to its first streamed chunk
+    # (streaming only) and to its first tool start
+    avg_ttft_seconds: float = 0.0
+    avg_first_tool_start_seconds: float = 0.0
+
+    # Context size per step, and the history budget of the intent agent
+    # (0 for the fixed window)
+    avg_context_tokens: float = 0.0
+    max_context_tokens: int = 0
+    history_max_tokens: int = 0
+    avg_history_tokens: float = 0.0
+
     @classmethod
     def from_json(cls, filepath: Path, agent_type: str) -> 'AgentRun':
         """Load agent run data from JSON file"""
@@ -81,6 +104,14 @@ class AgentRun:
         else:
             total_tokens = input_tokens = output_tokens = 0
 
+        # Prompt cache usage, summed by the intent agent, or part of the
+        # token totals of the simple agent
+        cache_tokens = data.get('cache_tokens')
+        if cache_tokens is None and primary_model:
+            cache_tokens = tokens_data[primary_model].get('input_token_details', {})
+        cache_read_tokens = (cache_tokens or {}).get('cache_read', 0) or 0
+        cache_creation_tokens = (cache_tokens or {}).get('cache_creation', 0) or 0
+
         # Get cost data
         costs_data = data.get('costs', {})
         total_cost = 0.0
@@ -104,6 +135,15 @@ class AgentRun:
         filtered_latencies = [lat['elapsed_seconds'] for lat in latencies if lat.get('elapsed_seconds', 0) >= 0.1]
         avg_time_per_step = sum(filtered_latencies) / len(filtered_latencies) if filtered_latencies else 0
 
+        context_tokens = [t for t in data.get('tokens_used_approx', []) if t and t > 0]
+        history_tokens = [t for t in data.get('history_tokens_approx', []) if t is not None]
+
+        ttfts = [lat['ttft_seconds'] for lat in latencies if lat.get('ttft_seconds') is not None]
+        first_tool_starts = [lat['first_tool_start_seconds'] for lat in latencies if lat.get('first_tool_start_seconds') is not None]
+
+        # One record per tool call, see `ToolCallRecord` in src/instrumentation.py
+        tool_calls = data.get('tool_calls', [])
+
         # Calculate other derived metrics
         avg_tokens_per_step = total_tokens / total_messages if total_messages > 0 else 0
         cost_per_step = total_cost / total_messages if total_messages > 0 else 0
@@ -123,7 +163,20 @@ class AgentRun:
             cost_per_step=cost_per_step,
             is_success=is_success,
             metrics=metrics,
-            accuracy_score=accuracy_score
+            accuracy_score=accuracy_score,
+            cache_read_tokens=cache_read_tokens,
+            cache_creation_tokens=cache_creation_tokens,
+            tool_calls_count=len(tool_calls),
+            tool_time_seconds=sum(call.get('wall_seconds', 0.0) for call in tool_calls),
+            tool_errors=sum(1 for call in tool_calls if call.get('error')),
+            tool_output_tokens=sum(call.get('output_tokens_approx', 0) for call in tool_calls),
+            tool_calls=tool_calls,
+            avg_ttft_seconds=sum(ttfts) / len(ttfts) if ttfts else 0.0,
+            avg_first_tool_start_seconds=sum(first_tool_starts) / len(first_tool_starts) if first_tool_starts else 0.0,
+            avg_context_tokens=sum(context_tokens) / len(context_tokens) if context_tokens else 0.0,
+            max_context_tokens=max(context_tokens, default=0),
+            history_max_tokens=data.get('history_max_tokens', 0) or 0,
+            avg_history_tokens=sum(history_tokens) / len(history_tokens) if history_tokens else 0.0
         )
 
 
@@ -221,7 +274,10 @@ def load_all_runs(outputs_dir: str = "outputs") -> List[AgentRun]:
         agent_types = {
             'simple-raw': 'simple-raw',
             'simple-summarization': 'simple-summarization',
-            'intent': 'intent'
+            'intent': 'intent',
+            'intent-cached': 'intent-cached',
+            'intent-streaming': 'intent-streaming',
+            'intent-cached-streaming': 'intent-cached-streaming'
         }
 
         for agent_type, suffix in agent_types.items():
@@ -247,6 +303,44 @@ def load_all_runs(outputs_dir: str = "outputs") -> List[AgentRun]:
     return runs
 
 
+def tool_calls_frame(runs: List[AgentRun]) -> pd.DataFrame:
+    """One row per tool call of every run"""
+    records = [
+        {
+            'run_id': run.run_id,
+            'agent_type': run.agent_type,
+            'model_name': run.model_name,
+            **call
+        }
+        for run in runs
+        for call in run.tool_calls
+    ]
+
+    return pd.DataFrame(records)
+
+
+def summarize_tool_calls(calls: pd.DataFrame) -> pd.DataFrame:
+    """Latency, errors, cache hits and output size per agent type and tool"""
+    calls = calls.assign(
+        has_error=calls['error'].notna(),
+        # Tools that don't use a cache leave it empty
+        cache_hit=calls['cache_hit'].astype('float')
+    )
+
+    summary = calls.groupby(['agent_type', 'tool']).agg(
+        calls=('tool', 'size'),
+        avg_wall_seconds=('wall_seconds', 'mean'),
+        p95_wall_seconds=('wall_seconds', lambda x: x.quantile(0.95)),
+        total_wall_seconds=('wall_seconds', 'sum'),
+        avg_cpu_seconds=('cpu_seconds', 'mean'),
+        error_rate=('has_error', 'mean'),
+        cache_hit_rate=('cache_hit', 'mean'),
+        avg_output_tokens=('output_tokens_approx', 'mean')
+    ).round(4)
+
+    return summary
+
+
 def generate_visualizations(runs: List[AgentRun], output_dir: str = "analysis_output"):
     """Generate all visualization charts"""
     os.makedirs(output_dir, exist_ok=True)
@@ -452,6 +546,9 @@ def generate_visualizations(runs: List[AgentRun], output_dir: str = "analysis_ou
     markers = {'anthropic-claude-sonnet-4.5': 'o', 'openai-gpt-4.1-mini': 's'}
     agent_colors = {
         'intent': '#E74C3C',
+        'intent-cached': '#9B59B6',
+        'intent-streaming': '#E67E22',
+        'intent-cached-streaming': '#D35400',
         'simple-raw': '#3498DB',
         'simple-summarization': '#2ECC71'
     }
@@ -627,7 +724,7 @@ def export_csvs(runs: List[AgentRun], output_dir: str = "analysis_output"):
     """Export CSV files with detailed metrics"""
     os.makedirs(output_dir, exist_ok=True)
 
-    df = pd.DataFrame([asdict(run) for run in runs])
+    df = pd.DataFrame([asdict(run) for run in runs]).drop(columns=['tool_calls'])
 
     # Add calculated metrics
     df['tokens_per_second'] = df['total_tokens'] / df['total_time_seconds']
@@ -644,6 +741,7 @@ def export_csvs(runs: List[AgentRun], output_dir: str = "analysis_output"):
         'total_tokens': ['mean', 'std'],
         'avg_tokens_per_step': ['mean', 'std'],
         'avg_time_per_step': ['mean', 'std'],
+        'avg_first_tool_start_seconds': ['mean', 'std'],
         'cost_per_step': ['mean', 'std'],
         'tokens_per_second': ['mean', 'std'],
         'is_success': ['sum', 'count'],
@@ -697,6 +795,16 @@ def export_csvs(runs: List[AgentRun], output_dir: str = "analysis_output"):
         field_summary.to_csv(f"{output_dir}/field_accuracy_summary.csv")
         print(f"Exported: {output_dir}/field_accuracy_summary.csv")
 
+    # 5. Tool calls, one row per call and summarized per tool
+    calls = tool_calls_frame(runs)
+
+    if not calls.empty:
+        calls.to_csv(f"{output_dir}/tool_calls.csv", index=False)
+        print(f"Exported: {output_dir}/tool_calls.csv")
+
+        summarize_tool_calls(calls).to_csv(f"{output_dir}/tool_summary.csv")
+        print(f"Exported: {output_dir}/tool_summary.csv")
+
 
 def generate_summary_report(runs: List[AgentRun], output_dir: str = "analysis_output"):
     """Generate a markdown summary report optimized for GitHub"""
@@ -841,6 +949,22 @@ def generate_summary_report(runs: List[AgentRun], output_dir: str = "analysis_ou
         report.append(f"| `{agent}` | `{short_model}` | {latency_data.loc[(agent, model), 'mean']:.2f}s | ±{latency_data.loc[(agent, model), 'std']:.2f}s |\n")
     report.append("\n")
 
+    calls = tool_calls_frame(runs)
+
+    if not calls.empty:
+        report.append("### Tool Calls\n\n")
+        report.append("Time spent in each tool, as opposed to waiting on the LLM (wall time, summed over concurrent calls).\n\n")
+
+        tool_summary = summarize_tool_calls(calls)
+        report.append("| Agent Type | Tool | Calls | Avg Wall | P95 Wall | Avg CPU | Error Rate | Cache Hit Rate | Avg Output Tokens |\n")
+        report.append("|------------|------|-------|----------|----------|---------|------------|----------------|-------------------|\n")
+        for (agent, tool_name), row in tool_summary.iterrows():
+            cache_hit_rate = f"{row['cache_hit_rate']:.1%}" if pd.notna(row['cache_hit_rate']) else "-"
+            report.append(f"| `{agent}` | `{tool_name}` | {int(row['calls'])} | {row['avg_wall_seconds']:.3f}s | ")
+            report.append(f"{row['p95_wall_seconds']:.3f}s | {row['avg_cpu_seconds']:.3f}s | {row['error_rate']:.1%} | ")
+            report.append(f"{cache_hit_rate} | {row['avg_output_tokens']:.0f} |\n")
+        report.append("\n")
+
     report.append("### Context Growth Over Steps\n\n")
     report.append("![Context Growth](context_growth.png)\n\n")
     report.append("This chart shows how context (total tokens) grows with the number of steps for each agent type, "
@@ -864,6 +988,29 @@ def generate_summary_report(runs: List[AgentRun], output_dir: str = "analysis_ou
             report.append(f"| `{agent}` | `{short_model}` | {accuracy_data.loc[(agent, model), 'mean']:.2%} | ±{accuracy_data.loc[(agent, model), 'std']:.2%} |\n")
         report.append("\n")
 
+    report.append("### Context Size vs Accuracy\n\n")
+    report.append("Tokens sent per step next to the outcome, per history budget of the intent agent "
+                  "(`window` is the fixed window of the first and last steps).\n\n")
+    context_data = df.assign(
+        history=df['history_max_tokens'].map(lambda t: f"{t:,} tokens" if t > 0 else "window")
+    ).groupby(['agent_type', 'model_name', 'history']).agg(
+        runs=('is_success', 'count'),
+        success_rate=('is_success', 'mean'),
+        accuracy=('accuracy_score', 'mean'),
+        avg_context=('avg_context_tokens', 'mean'),
+        max_context=('max_context_tokens', 'max'),
+        avg_history=('avg_history_tokens', 'mean'),
+    )
+    report.append("| Agent Type | Model | History | Runs | Avg Context Tokens | Max Context Tokens | Avg History Tokens | Success Rate | Accuracy |\n")
+    report.append("|------------|-------|---------|------|--------------------|--------------------|--------------------|--------------|----------|\n")
+    for (agent, model, history), row in context_data.iterrows():
+        short_model = model.replace('anthropic-', '').replace('openai-', '')
+        history = history if agent.startswith('intent') else "-"
+        avg_history = f"{row['avg_history']:.0f}" if row['avg_history'] > 0 else "-"
+        report.append(f"| `{agent}` | `{short_model}` | {history} | {int(row['runs'])} | {row['avg_context']:.0f} | ")
+        report.append(f"{int(row['max_context'])} | {avg_history} | {row['success_rate']:.1%} | {row['accuracy']:.2%} |\n")
+    report.append("\n")
+
     # Field-level accuracy analysis
     report.append("### Field-Level Accuracy Analysis\n\n")
 
@@ -930,6 +1077,12 @@ def generate_summary_report(runs: List[AgentRun], output_dir: str = "analysis_ou
             report.append(f"- **Cost per Step:** ${successful['cost_per_step'].mean():.4f}\n")
             report.append(f"- **Time per Step:** {successful['avg_time_per_step'].mean():.2f}s\n")
 
+            if successful['avg_first_tool_start_seconds'].sum() > 0:
+                report.append(f"- **Time to First Tool Start:** {successful['avg_first_tool_start_seconds'].mean():.2f}s\n")
+
+            if successful['avg_ttft_seconds'].sum() > 0:
+                report.append(f"- **Time to First Token:** {successful['avg_ttft_seconds'].mean():.2f}s\n")
+
             if successful['accuracy_score'].sum() > 0:
                 report.append(f"- **Average Accuracy:** {successful['accuracy_score'].mean():.2%}\n")
 
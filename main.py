@@ -12,10 +12,14 @@ import aiofiles
 from src.agents.prompts import USER_PROMPT
 from src.agents.simple import simple # noqa: F401
 from src.agents.intent import intent # noqa: F401
-from src.tools import CONTENT_DIR, RUN_ID
+from src.budget import Budget
+from src.tools import CONTENT_DIR, RUN_ID, close_session
 
 
 async def cleanup():
+    # The run database is removed below, so the session must not keep it open
+    close_session()
+
     if os.path.exists(CONTENT_DIR):
         shutil.rmtree(CONTENT_DIR, ignore_errors=True)
         print(f"Removed existing content directory at: {CONTENT_DIR}")
@@ -57,6 +61,13 @@ async def main():
     # user_prompt = "Just the total rides in januray"
     user_prompt = USER_PROMPT
 
+    # Limits of each run, the agents wrap up at 80% of any of them
+    budget = Budget(
+        max_tokens=2_000_000,
+        max_cost=5.0,
+        max_seconds=30 * 60,
+    )
+
     metrics_path = os.path.join(
         CONTENT_DIR,
         "efficiency_metrics.json"
@@ -74,7 +85,8 @@ async def main():
         final_path = await simple(
             model_name=model_name,
             use_summarization=False,
-            user_prompt=user_prompt
+            user_prompt=user_prompt,
+            budget=budget,
         )
 
         await copy_outcome_to_final(
@@ -91,7 +103,25 @@ async def main():
         final_path = await simple(
             model_name=model_name,
             use_summarization=True,
-            user_prompt=user_prompt
+            user_prompt=user_prompt,
+            budget=budget,
+        )
+
+        await copy_outcome_to_final(
+            final_path,
+            metrics_path,
+        )
+
+    except Exception as e:
+        print(f"Error: {e}\n{traceback.format_exc()}")
+
+    try:
+        await cleanup()
+
+        final_path = await intent(
+            model_name=model_name,
+            user_prompt=user_prompt,
+            budget=budget,
         )
 
         await copy_outcome_to_final(
@@ -105,9 +135,12 @@ async def main():
     try:
         await cleanup()
 
+        # Same agent with a static prompt prefix, to compare prompt caching
         final_path = await intent(
             model_name=model_name,
-            user_prompt=user_prompt
+            user_prompt=user_prompt,
+            prompt_layout="cached",
+            budget=budget,
         )
 
         await copy_outcome_to_final(
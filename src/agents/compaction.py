@@ -0,0 +1,192 @@
+import math
+from typing import Literal
+
+from pydantic import BaseModel
+
+from src.agents.intent_prompts import format_history_xml, step_xml
+from src.instrumentation import CHARS_PER_TOKEN
+
+
+StepLevel = Literal["full", "summary", "compact", "collapsed"]
+
+# Weight of a step relative to the next one
+RECENCY_DECAY = 0.85
+
+# Intents whose results outlive the step
+FILE_INTENTS = ("WriteFileSchema", "UpdateFileSchema")
+SQL_INTENT = "ExecuteSQLSchema"
+
+# Legacy fixed window, used when there is no token budget
+WINDOW = {"trucate_after": 15, "keep_start": 5, "keep_end": 3}
+
+
+class CompactedHistory(BaseModel):
+    """The history block of the prompt, and how it was packed."""
+    xml: str
+    tokens: int
+    max_tokens: int
+    levels: dict[StepLevel, int] = {}
+
+
+def approx_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def score_step(step, step_index: int, total_steps: int) -> float:
+    """
+    How much a step is worth keeping in full: recent steps, and steps that
+    wrote files or computed exact SQL results, score higher. Failed steps
+    count half, their error is still kept in the compact form.
+    """
+    score = RECENCY_DECAY ** (total_steps - step_index)
+
+    for intent in step.intents:
+        if intent.status != "completed":
+            continue
+
+        if intent.type in FILE_INTENTS:
+            score += 1.0
+
+        elif intent.type == SQL_INTENT and intent.output is not None and getattr(intent.args, "mode", "exact") == "exact":
+            score += 0.5
+
+    if step.status == "failed":
+        score /= 2
+
+    return score
+
+
+def format_compact_step_xml(step, step_index: int) -> str:
+    """A step reduced to its intents, their `memory` and `next_task` fields and errors."""
+    lines = [f'<task_{step_index} status="{step.status}" compacted="true">']
+
+    for intent in step.intents:
+        status = f" [{intent.status}]" if intent.status != "completed" else ""
+        lines.append(f"- {intent.type}{status}")
+
+        if intent.memory:
+            lines.append(f"  Memory: {intent.memory}")
+
+        if intent.next_task:
+            lines.append(f"  Next task: {intent.next_task}")
+
+        if intent.error_message:
+            lines.append(f"  Error: {intent.error_message.splitlines()[0][:200]}")
+
+    if not step.intents:
+        lines.append("No intents executed in this step.")
+
+    lines.append(f"</task_{step_index}>")
+
+    return "\n".join(lines)
+
+
+def compact_step_xml(step, step_index: int) -> str:
+    """`format_compact_step_xml`, memoized on the step like `step_xml`."""
+    cache: dict | None = getattr(step, "_xml", None)
+
+    if cache is None:
+        return format_compact_step_xml(step, step_index)
+
+    key = (step_index, "compact")
+    xml = cache.get(key)
+
+    if xml is None:
+        xml = cache[key] = format_compact_step_xml(step, step_index)
+
+    return xml
+
+
+def _has_memory(step) -> bool:
+    return any(intent.memory for intent in step.intents)
+
+
+def collapsed_xml(step_indexes: list[int]) -> str:
+    return f"<task_collapsed>Steps {', '.join(map(str, step_indexes))} collapsed ({len(step_indexes)} steps, use ClarificationIntent to see them)</task_collapsed>"
+
+
+def compact_history(agent, max_tokens: int) -> CompactedHistory:
+    """
+    Pack the history of `agent` into about `max_tokens` tokens. The latest
+    step keeps its full output, every other step starts compacted (see
+    `format_compact_step_xml`) and the best scored ones are expanded to
+    their usual truncated form while they fit. When even the compacted
+    steps don't fit, the lowest scored ones are collapsed, steps without
+    memory first. Without a budget (`max_tokens <= 0`) the legacy fixed
+    window of `format_history_xml` is used.
+    """
+    if max_tokens <= 0 or not agent.steps:
+        xml = format_history_xml(agent, **WINDOW)
+        return CompactedHistory(xml=xml, tokens=approx_tokens(xml), max_tokens=max_tokens)
+
+    total = len(agent.steps)
+
+    levels: dict[int, StepLevel] = {}
+    xmls: dict[tuple[int, StepLevel], str] = {}
+
+    def cost(i: int, level: StepLevel) -> int:
+        if level == "collapsed":
+            return 0
+
+        if (i, level) not in xmls:
+            step = agent.steps[i - 1]
+
+            if level == "compact":
+                xmls[(i, level)] = compact_step_xml(step, i)
+
+            else:
+                xmls[(i, level)] = step_xml(step, i, show_full_output=level == "full")
+
+        return approx_tokens(xmls[(i, level)])
+
+    # The latest step is the one the model reacts to
+    levels[total] = "full" if cost(total, "full") <= max_tokens else "summary"
+
+    for i in range(1, total):
+        levels[i] = "compact"
+
+    used = sum(cost(i, level) for i, level in levels.items())
+
+    scores = {i: score_step(agent.steps[i - 1], i, total) for i in range(1, total)}
+
+    collapsed: list[int] = []
+
+    if used > max_tokens:
+        for i in sorted(scores, key=lambda i: (_has_memory(agent.steps[i - 1]), scores[i])):
+            marker = approx_tokens(collapsed_xml(collapsed)) if collapsed else 0
+
+            collapsed.append(i)
+            levels[i] = "collapsed"
+
+            used += approx_tokens(collapsed_xml(collapsed)) - marker - cost(i, "compact")
+
+            if used <= max_tokens:
+                break
+
+        collapsed.sort()
+
+    for i in sorted(scores, key=lambda i: -scores[i]):
+        if levels[i] != "compact":
+            continue
+
+        extra = cost(i, "summary") - cost(i, "compact")
+
+        if used + extra <= max_tokens:
+            levels[i] = "summary"
+            used += extra
+
+    # One marker for every collapsed step, before the steps that are kept
+    parts = [collapsed_xml(collapsed)] if collapsed else []
+
+    for i in range(1, total + 1):
+        if levels[i] != "collapsed":
+            parts.append(xmls[(i, levels[i])])
+
+    xml = "\n\n".join(parts)
+
+    counts: dict[StepLevel, int] = {}
+
+    for level in levels.values():
+        counts[level] = counts.get(level, 0) + 1
+
+    return CompactedHistory(xml=xml, tokens=approx_tokens(xml), max_tokens=max_tokens, levels=counts)
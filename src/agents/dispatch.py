@@ -0,0 +1,127 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable
+
+from pydantic import BaseModel
+from sqlglot import exp
+
+from src.result_cache import REMOTE_PATH_MARKER, is_read_only, parse_statements, referenced_sources
+
+
+# Resource every file touches, taken by intents that list or may write any file
+ALL_FILES = "files"
+
+
+class Access(BaseModel):
+    """Resources an intent reads (shared) and mutates (exclusive)."""
+    shared: set[str] = set()
+    exclusive: set[str] = set()
+
+    @property
+    def resources(self) -> set[str]:
+        return self.shared | self.exclusive
+
+
+def _overlaps(a: set[str], b: set[str]) -> bool:
+    if a & b:
+        return True
+
+    # `files` covers every single `file:<name>`
+    return (
+        ALL_FILES in a and any(r.startswith("file:") for r in b)
+    ) or (
+        ALL_FILES in b and any(r.startswith("file:") for r in a)
+    )
+
+
+def file_resource(path: str) -> str:
+    """
+    `file:<name>` for a file tool argument or a path read by SQL, by file
+    name as SQL paths carry the content directory and tool arguments don't.
+    Globs may read any file.
+    """
+    if any(c in path for c in "*?["):
+        return ALL_FILES
+
+    return f"file:{os.path.basename(path)}"
+
+
+def sql_files(statements: list[exp.Expression]) -> set[str]:
+    """File resources read by `statements`."""
+    return {
+        file_resource(path)
+        for statement in statements
+        for path in referenced_sources(statement)[0]
+        if REMOTE_PATH_MARKER not in path
+    }
+
+
+def conflicts(a: Access, b: Access) -> bool:
+    return _overlaps(a.exclusive, b.resources) or _overlaps(b.exclusive, a.resources)
+
+
+def intent_access(intent_type: str, args: dict[str, Any]) -> Access:
+    """
+    Resources touched by the intent of `intent_type`, used to only run
+    intents concurrently when they are independent.
+    """
+    filename = args.get("filename")
+
+    if intent_type == "ListFilesSchema":
+        return Access(shared={ALL_FILES})
+
+    if intent_type == "ReadFileSchema":
+        return Access(shared={file_resource(filename or "")})
+
+    if intent_type in ("WriteFileSchema", "UpdateFileSchema"):
+        return Access(exclusive={file_resource(filename or "")})
+
+    if intent_type == "ValidateSQLSchema":
+        return Access(shared={"sql"})
+
+    if intent_type == "ExecuteSQLSchema":
+        statements = parse_statements(args.get("sql") or "")
+
+        if statements and is_read_only(statements):
+            # Files written by other intents of the batch, e.g. `read_csv('.../x.csv')`
+            return Access(shared={"sql"} | sql_files(statements))
+
+        # Writes can create tables later queries read, or `COPY` to files
+        return Access(exclusive={"sql", ALL_FILES})
+
+    return Access()
+
+
+class IntentDispatcher:
+    """
+    Runs intents concurrently, bounded by `max_concurrency`. An intent
+    waits for every previously submitted intent it conflicts with, so
+    dependent intents still run in the order the model returned them.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._submitted: list[tuple[Access, asyncio.Task]] = []
+
+    def submit(self, access: Access, run: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        depends_on = [
+            task
+            for _access, task in self._submitted
+            if conflicts(_access, access)
+        ]
+
+        async def _run():
+            if depends_on:
+                await asyncio.gather(*depends_on, return_exceptions=True)
+
+            async with self._semaphore:
+                return await run()
+
+        task = asyncio.create_task(_run())
+        self._submitted.append((access, task))
+
+        return task
+
+    async def results(self) -> list[Any]:
+        """Results of every submitted intent, in submission order."""
+        return await asyncio.gather(*[task for _, task in self._submitted])
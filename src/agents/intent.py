@@ -1,20 +1,32 @@
 from datetime import datetime, timezone
-from json import dumps
-from typing import Annotated, Any, Literal
+from functools import partial
+from json import JSONDecodeError, dumps, loads
+from typing import Annotated, Any, Callable, Literal
 import aiofiles
 from langchain.tools import BaseTool
-from langchain_core.messages import HumanMessage, SystemMessage, UsageMetadata
+from langchain_core.messages import AIMessageChunk, BaseMessage, HumanMessage, SystemMessage, ToolCall, UsageMetadata
+from langchain_core.messages.tool import tool_call as create_tool_call
 from langchain_core.messages.utils import count_tokens_approximately
-from pydantic import BaseModel, Field, create_model
-from src.agents.intent_prompts import build_dynamic_system_prompt
+from pydantic import BaseModel, Field, PrivateAttr, create_model
+from src.agents.compaction import compact_history
+from src.agents.dispatch import Access, IntentDispatcher, intent_access
+from src.agents.intent_prompts import (
+    build_dynamic_system_prompt,
+    build_static_system_prompt,
+    cached_layout_messages,
+    format_tools_xml,
+)
 from src.agents.prompts import USER_PROMPT
-from src.cost import UsagePrice, compute_cost, sum_prices, sum_tokens
+from src.budget import Budget, BudgetController
+from src.config import INTENT_HISTORY_MAX_TOKENS, INTENT_MAX_CONCURRENCY, INTENT_PROMPT_LAYOUT, INTENT_STREAMING
+from src.cost import UsagePrice, sum_prices, sum_tokens
 from src.llm import new_llm
 from src.models import MODELS, FinalResponse
-from src.tools import RUN_ID, get_tools
+from src.tools import PREFETCH, RUN_ID, close_docs, close_prefetch, close_session, get_tools, start_run, tool_calls, tools_stats
 
 
 Status = Literal["pending", "completed", "failed"]
+PromptLayout = Literal["dynamic", "cached"]
 
 
 class NoOpArgs(BaseModel):
@@ -71,12 +83,28 @@ class AgentHistoryStep(Timing):
     tokens_used_approx: int
     tokens_used: UsageMetadata | None = None
 
+    # Size of the history in the "dynamic" prompt of the step
+    history_tokens_approx: int | None = None
+
+    # Prompt tokens read from / written to the provider's prompt cache
+    cache_read_tokens: int = 0
+    cache_creation_tokens: int = 0
+
     cost: UsagePrice | None = None
 
+    # From the start of the step, to the first streamed chunk of the
+    # response (streaming only) and to the first intent started
+    ttft_seconds: float | None = None
+    first_tool_start_seconds: float | None = None
+
     status: Status = "pending"
 
     intents: list[StepIntent] = []
 
+    # Rendered XML by (step index, full output or "compact"), see `step_xml`.
+    # Steps are only rendered once appended to the history, after which they
+    # don't change
+    _xml: dict[tuple[int, bool | str], str] = PrivateAttr(default_factory=dict)
 
 
 
@@ -143,6 +171,9 @@ class AgentHistory(Timing):
     model_name: str
 
     user_prompt: str
+    prompt_layout: PromptLayout = "dynamic"
+    streaming: bool = False
+    history_max_tokens: int = 0
 
     steps: list[AgentHistoryStep] = []
     final_response: FinalResponse | None = None
@@ -150,7 +181,7 @@ class AgentHistory(Timing):
     current_messages: list[str] = []
 
 
-async def persist_agent(agent: AgentHistory):
+async def persist_agent(agent: AgentHistory, budget: BudgetController | None = None):
     _data = {
         "run_id": RUN_ID,
         "total_messages": len(agent.steps),
@@ -176,12 +207,21 @@ async def persist_agent(agent: AgentHistory):
         "final_output": agent.final_response.model_dump() if agent.final_response else None,
         "summarization_used": False,
         "agent_type": "intent",
+        "prompt_layout": agent.prompt_layout,
+        "streaming": agent.streaming,
+        "history_max_tokens": agent.history_max_tokens,
+        "cache_tokens": {
+            "cache_read": sum(step.cache_read_tokens for step in agent.steps),
+            "cache_creation": sum(step.cache_creation_tokens for step in agent.steps),
+        },
         "latencies": [
             {
                 "iteration": idx + 1,
                 "start": step.started_at.isoformat(),
                 "end": step.ended_at.isoformat() if step.ended_at else None,
-                "elapsed_seconds": step.elapsed_seconds
+                "elapsed_seconds": step.elapsed_seconds,
+                "ttft_seconds": step.ttft_seconds,
+                "first_tool_start_seconds": step.first_tool_start_seconds,
             }
             for idx, step in enumerate(agent.steps)
         ],
@@ -192,14 +232,23 @@ async def persist_agent(agent: AgentHistory):
             step.tokens_used_approx
             for step in agent.steps
         ],
+        "history_tokens_approx": [
+            step.history_tokens_approx
+            for step in agent.steps
+        ],
         "agent_steps": [
             step.model_dump()
             for step in agent.steps
         ],
+        "tools_stats": tools_stats(),
+        "tool_calls": tool_calls(),
+        "budget": budget.summary() if budget else None,
     }
 
     _model_name_norm = agent.model_name.replace("/", "-").replace(" ", "_")
-    _final_path = f"outputs/{agent.run_id}/{_model_name_norm}-intent.json"
+    _layout_suffix = "-cached" if agent.prompt_layout == "cached" else ""
+    _streaming_suffix = "-streaming" if agent.streaming else ""
+    _final_path = f"outputs/{agent.run_id}/{_model_name_norm}-intent{_layout_suffix}{_streaming_suffix}.json"
 
     async with aiofiles.open(_final_path, "w") as f:
         await f.write(dumps(_data, indent=2))
@@ -208,13 +257,232 @@ async def persist_agent(agent: AgentHistory):
     return _final_path
 
 
+class ProcessedIntent(BaseModel):
+    intent: StepIntent
+
+    # Message for the model on the next iteration, if any
+    message: str | None = None
+    final_response: FinalResponse | None = None
+
+
+def tool_call_access(tool_call: ToolCall) -> Access:
+    intent_args = tool_call["args"].get("intent_args")
+
+    return intent_access(
+        tool_call["name"].split("_Intent")[0],
+        intent_args if isinstance(intent_args, dict) else {},
+    )
+
+
+async def process_tool_call(
+    agent: AgentHistory,
+    tool_call: ToolCall,
+    tools_by_name: dict[str, BaseTool],
+) -> ProcessedIntent:
+    try:
+        intent_type = tool_call["name"].split("_Intent")[0]
+        intent_args = tool_call["args"]
+
+        raw_intent = BaseIntent.model_validate({
+            "reasoning": intent_args.get("reasoning", ""),
+            "previous_step_analysis": intent_args.get("previous_step_analysis", ""),
+            "next_task": intent_args.get("next_task", None),
+            "memory": intent_args.get("memory", None),
+        })
+
+        intent_args = intent_args.get("intent_args", {})
+
+        print(f"Processing intent of type: {intent_type}")
+
+        args: BaseModel | None = None
+        output: str | BaseModel | None = None
+        status: Status = "completed"
+
+        message: str | None = None
+        final_response: FinalResponse | None = None
+
+        if intent_type in tools_by_name:
+            _tool = tools_by_name[intent_type]
+
+            print(f"Executing tool for intent type: {intent_type}")
+
+            args = _tool.input_schema.model_validate(intent_args)
+            output = await _tool.arun(intent_args)
+
+            message = f"Tool '{intent_type}' executed with output:\n{output}"
+
+        elif intent_type == "ClarificationIntent":
+            print("Processing ClarificationIntent")
+
+            args = ClarificationIntent.model_validate(intent_args)
+            output = None
+
+            if args.step_index - 1 < 0 or args.step_index - 1 >= len(agent.steps):
+                raise ValueError(f"Invalid step index for clarification: {args.step_index}")
+
+            step_output = agent.steps[args.step_index - 1].intents
+
+            step_output_str = ""
+
+            for intent in step_output:
+                step_output_str += f"- Intent Type: {intent.type}\n"
+                step_output_str += f"  Args: {intent.args.model_dump_json()}\n"
+                step_output_str += f"  Output: {intent.output}\n"
+                step_output_str += f"  Status: {intent.status}\n"
+                if intent.error_message:
+                    step_output_str += f"  Error Message: {intent.error_message}\n"
+
+            message = f"Here are the details of step {args.step_index} that require clarification:\n{step_output_str}"
+
+        elif intent_type == "FinalResponseIntent":
+            print("Processing FinalResponseIntent, preparing to exit.")
+
+            args = FinalResponseIntent.model_validate(intent_args)
+            output = None
+
+            final_response = args.response
+
+        else:
+            raise ValueError(f"Unhandled intent type: {intent_type}")
+
+        intent = StepIntent(
+            type=intent_type,
+            args=args,
+            output=output,
+            status=status,
+            reasoning=raw_intent.reasoning,
+            previous_step_analysis=raw_intent.previous_step_analysis,
+            memory=raw_intent.memory,
+            next_task=raw_intent.next_task,
+        )
+
+        return ProcessedIntent(
+            intent=intent,
+            message=message,
+            final_response=final_response,
+        )
+
+    except Exception as e:
+        print(f"Exception during intent processing\n{tool_call}\nError:\n{str(e)}")
+
+        intent = StepIntent(
+            reasoning="",
+            previous_step_analysis="",
+            type=tool_call["name"],
+            args=NoOpArgs(),
+            output=None,
+            status="failed",
+            error_message=f"Exception during intent processing: {str(e)}"
+        )
+
+        return ProcessedIntent(intent=intent)
+
+
+def add_results(agent: AgentHistory, step: AgentHistoryStep, results: list[ProcessedIntent]) -> bool:
+    """Add processed intents to the step, True when one is the final response."""
+    done = False
+
+    # Results come back in the order the model returned the intents
+    for processed in results:
+        step.intents.append(processed.intent)
+
+        if processed.message is not None:
+            agent.current_messages.append(processed.message)
+
+        if processed.final_response is not None:
+            agent.final_response = processed.final_response
+            done = True
+
+    return done
+
+
+async def astream_intents(
+    llm: Any,
+    msgs: list[BaseMessage],
+    on_tool_call: Callable[[ToolCall], None],
+) -> tuple[AIMessageChunk, float | None]:
+    """
+    Stream the response of `llm`, calling `on_tool_call` with each tool
+    call as soon as its arguments are complete, in the order the model
+    returns them. Calls whose arguments never parse are skipped, as they
+    are by `ainvoke`. Returns the whole response and the time to its first
+    content or tool call chunk.
+    """
+    started = datetime.now(timezone.utc)
+    ttft: float | None = None
+
+    resp: AIMessageChunk | None = None
+
+    # Tool call chunks merged by index, in the order they started
+    calls: dict[int, dict[str, str]] = {}
+    next_call = 0
+
+    def flush(final: bool = False):
+        nonlocal next_call
+
+        indexes = list(calls)
+
+        while next_call < len(indexes):
+            call = calls[indexes[next_call]]
+            raw_args = call["args"].strip()
+
+            # Arguments are a JSON object, complete once it is closed
+            if not raw_args.endswith("}") and not (final and not raw_args):
+                return
+
+            try:
+                args = loads(raw_args) if raw_args else {}
+
+            except JSONDecodeError:
+                if not final:
+                    return
+
+                args = None
+
+            if isinstance(args, dict):
+                on_tool_call(create_tool_call(name=call["name"], args=args, id=call["id"] or None))
+
+            next_call += 1
+
+    async for chunk in llm.astream(msgs, stream_usage=True):
+        resp = chunk if resp is None else resp + chunk
+
+        if ttft is None and (chunk.content or chunk.tool_call_chunks):
+            ttft = (datetime.now(timezone.utc) - started).total_seconds()
+
+        for tool_chunk in chunk.tool_call_chunks:
+            call = calls.setdefault(tool_chunk["index"] or 0, {"name": "", "id": "", "args": ""})
+
+            call["name"] += tool_chunk["name"] or ""
+            call["id"] += tool_chunk["id"] or ""
+            call["args"] += tool_chunk["args"] or ""
+
+        if chunk.tool_call_chunks:
+            flush()
+
+    if resp is None:
+        raise ValueError("Empty response streamed by the model")
+
+    flush(final=True)
+
+    return resp, ttft
+
+
 MAX_ITS = 100
 
 async def intent(
     user_prompt: str = USER_PROMPT,
-    model_name: str | None = None
+    model_name: str | None = None,
+    prompt_layout: PromptLayout = INTENT_PROMPT_LAYOUT,  # type: ignore
+    budget: Budget | None = None,
+    streaming: bool = INTENT_STREAMING,
+    history_max_tokens: int = INTENT_HISTORY_MAX_TOKENS,
 ):
-    print("Starting intent-based agent")
+    print(f"Starting intent-based agent with the {prompt_layout} prompt layout{' (streaming)' if streaming else ''}")
+
+    start_run()
+
+    _budget = BudgetController(budget or Budget.from_config())
 
     _model_name = model_name or MODELS["ant-haiku"]
     llm = new_llm(_model_name)
@@ -224,10 +492,13 @@ async def intent(
         model_name=_model_name,
         started_at=datetime.now(timezone.utc),
         user_prompt=user_prompt,
+        prompt_layout=prompt_layout,
+        streaming=streaming,
+        history_max_tokens=history_max_tokens,
     )
 
     _default_tools = get_tools()
-    _default_tool_names = [t.input_schema.__name__ for t in _default_tools]
+    _tools_by_name = {t.input_schema.__name__: t for t in _default_tools}
 
     it = 0
     should_exit = False  # Flag to signal completion
@@ -245,6 +516,9 @@ async def intent(
             )
         )
 
+    _tools_xml = format_tools_xml(_llm_tools)
+    _static_prompt = build_static_system_prompt(_tools_xml, user_prompt)
+
     llm = llm.bind_tools(
         tools=_llm_tools,
         strict=True,
@@ -257,6 +531,10 @@ async def intent(
             print(f"Reached maximum iterations of {MAX_ITS}, exiting.")
             break
 
+        # The history so far is persisted below, as for any other exit
+        if _budget.should_stop():
+            break
+
         start_it = datetime.now(timezone.utc)
         it += 1
 
@@ -266,14 +544,28 @@ async def intent(
             tokens_used_approx=0,
         )
 
-        system_prompt = build_dynamic_system_prompt(
-            agent=agent,
-            tools=_llm_tools,
-            user_prompt=user_prompt
-        )
+        if prompt_layout == "cached":
+            # Static system prompt and one message per step, so every step
+            # extends the prefix of the previous one
+            prefix = cached_layout_messages(agent, _static_prompt, _model_name)
+
+        else:
+            history = compact_history(agent, history_max_tokens)
+            step.history_tokens_approx = history.tokens
+
+            if history.levels.get("compact") or history.levels.get("collapsed"):
+                print(f"History packed into ~{history.tokens}/{history.max_tokens} tokens: {history.levels}")
+
+            system_prompt = build_dynamic_system_prompt(
+                history_xml=history.xml,
+                tools_xml=_tools_xml,
+                user_prompt=user_prompt
+            )
+
+            prefix = [SystemMessage(content=system_prompt)]
 
         msgs = [
-            SystemMessage(content=system_prompt),
+            *prefix,
             *[
                 HumanMessage(content=msg)
                 for msg in agent.current_messages
@@ -283,25 +575,60 @@ async def intent(
             )
         ]
 
+        dispatcher = IntentDispatcher(INTENT_MAX_CONCURRENCY)
 
-        try:
-            resp = await llm.ainvoke(
-                input=msgs
+        def dispatch(tool_call: ToolCall, step: AgentHistoryStep = step, dispatcher: IntentDispatcher = dispatcher):
+            if step.first_tool_start_seconds is None:
+                step.first_tool_start_seconds = (datetime.now(timezone.utc) - step.started_at).total_seconds()
+
+            dispatcher.submit(
+                tool_call_access(tool_call),
+                partial(process_tool_call, agent, tool_call, _tools_by_name),
             )
 
+        # Warms what the next intents likely need while the model answers
+        PREFETCH.start(
+            texts=agent.current_messages,
+            sqls=[
+                intent.args.sql
+                for intent in (agent.steps[-1].intents if agent.steps else [])
+                if isinstance(getattr(intent.args, "sql", None), str)
+            ],
+        )
+
+        try:
+            if streaming:
+                # Intents start running while the rest of the response streams
+                resp, step.ttft_seconds = await astream_intents(llm, msgs, dispatch)
+
+            else:
+                resp = await llm.ainvoke(
+                    input=msgs
+                )
+
         except Exception as e:
             print(f"Exception during LLM invocation: {str(e)}")
 
             step.status = "failed"
 
+            # Intents already streamed still run, their outputs are kept
+            should_exit = add_results(agent, step, await dispatcher.results())
+
             step.ended_at = datetime.now(timezone.utc)
             step.elapsed_seconds = (step.ended_at - step.started_at).total_seconds()
 
             agent.current_messages.append(f"Error: Exception during LLM invocation:\n{str(e)}")
             agent.steps.append(step)
 
+            if should_exit:
+                break
+
             continue
 
+        finally:
+            PREFETCH.stop()
+
+        # Messages of intents started while streaming are only added below
         agent.current_messages = []
 
         end_it = datetime.now(timezone.utc)
@@ -327,124 +654,38 @@ async def intent(
 
             continue
 
-        for tool_call in resp.tool_calls:
-            try:
-                intent_type = tool_call["name"].split("_Intent")[0]
-                intent_args = tool_call["args"]
-
-                raw_intent = BaseIntent.model_validate({
-                    "reasoning": intent_args.get("reasoning", ""),
-                    "previous_step_analysis": intent_args.get("previous_step_analysis", ""),
-                    "next_task": intent_args.get("next_task", None),
-                    "memory": intent_args.get("memory", None),
-                })
-
-                intent_args = intent_args.get("intent_args", {})
+        if not streaming:
+            for tool_call in resp.tool_calls:
+                dispatch(tool_call)
 
-                print(f"Processing intent of type: {intent_type}")
+        # Signal that we should exit the main loop
+        should_exit = add_results(agent, step, await dispatcher.results())
 
-                args: BaseModel | None = None
-                output: str | BaseModel | None = None
-                status: Status = "completed"
-
-                if intent_type in _default_tool_names:
-                    _tool: BaseTool | None = None
-
-                    for t in _default_tools:
-                        if t.input_schema.__name__ == intent_type:
-                            _tool = t
-                            break
-
-                    if _tool is None:
-                        raise ValueError(f"Could not find tool for intent type: {intent_type}")
-
-                    print(f"Executing tool for intent type: {intent_type}")
-
-                    args = _tool.input_schema.model_validate(intent_args)
-                    output = await _tool.arun(intent_args)
-
-                    agent.current_messages.append(f"Tool '{intent_type}' executed with output:\n{output}")
-
-                elif intent_type == "ClarificationIntent":
-                    print("Processing ClarificationIntent")
-
-                    args = ClarificationIntent.model_validate(intent_args)
-                    output = None
-
-                    if args.step_index - 1 < 0 or args.step_index - 1 >= len(agent.steps):
-                        raise ValueError(f"Invalid step index for clarification: {args.step_index}")
-
-                    step_output = agent.steps[args.step_index - 1].intents
-
-                    step_output_str = ""
-
-                    for intent in step_output:
-                        step_output_str += f"- Intent Type: {intent.type}\n"
-                        step_output_str += f"  Args: {intent.args.model_dump_json()}\n"
-                        step_output_str += f"  Output: {intent.output}\n"
-                        step_output_str += f"  Status: {intent.status}\n"
-                        if intent.error_message:
-                            step_output_str += f"  Error Message: {intent.error_message}\n"
-
-                    agent.current_messages.append(
-                        f"Here are the details of step {args.step_index} that require clarification:\n{step_output_str}"
-                    )
-
-                elif intent_type == "FinalResponseIntent":
-                    print("Processing FinalResponseIntent, preparing to exit.")
-
-                    args = FinalResponseIntent.model_validate(intent_args)
-                    output = None
-
-                    agent.final_response = args.response
-
-                    # Signal that we should exit the main loop
-                    should_exit = True
-
-                else:
-                    raise ValueError(f"Unhandled intent type: {intent_type}")
-
-                intent = StepIntent(
-                    type=intent_type,
-                    args=args,
-                    output=output,
-                    status=status,
-                    reasoning=raw_intent.reasoning,
-                    previous_step_analysis=raw_intent.previous_step_analysis,
-                    memory=raw_intent.memory,
-                    next_task=raw_intent.next_task,
-                )
-
-                step.intents.append(intent)
+        step.tokens_used_approx = estimated_tokens
+        step.tokens_used = resp.usage_metadata
 
-            except Exception as e:
-                print(f"Exception during intent processing\n{tool_call}\nError:\n{str(e)}")
+        if resp.usage_metadata is not None:
+            cache_details = resp.usage_metadata.get("input_token_details", {})
 
-                intent = StepIntent(
-                    reasoning="",
-                    previous_step_analysis="",
-                    type=tool_call["name"],
-                    args=NoOpArgs(),
-                    output=None,
-                    status="failed",
-                    error_message=f"Exception during intent processing: {str(e)}"
-                )
+            step.cache_read_tokens = cache_details.get("cache_read") or 0
+            step.cache_creation_tokens = cache_details.get("cache_creation") or 0
 
-                step.intents.append(intent)
+            print(f"Prompt cache: {step.cache_read_tokens} tokens read, {step.cache_creation_tokens} written")
 
-        step.tokens_used_approx = estimated_tokens
-        step.tokens_used = resp.usage_metadata
+            # Priced from the provider's counts, which include the cached tokens
+            step.cost = await _budget.add_usage(_model_name, resp.usage_metadata)
 
-        output_tokens = count_tokens_approximately([resp])
+        else:
+            output_tokens = count_tokens_approximately([resp])
 
-        step.cost = await compute_cost(
-            _model_name,
-            {
-                "input_tokens": estimated_tokens,
-                "output_tokens": output_tokens,
-                "total_tokens": estimated_tokens,
-            }
-        )
+            step.cost = await _budget.add_usage(
+                _model_name,
+                {
+                    "input_tokens": estimated_tokens,
+                    "output_tokens": output_tokens,
+                    "total_tokens": estimated_tokens,
+                }
+            )
 
         step.status = "failed" if any(
             intent.status == "failed"
@@ -459,7 +700,14 @@ async def intent(
         if should_exit or agent.final_response is not None:
             break
 
+        if _budget.should_wrap_up():
+            agent.current_messages.append(_budget.wrap_up_message())
+
     agent.ended_at = datetime.now(timezone.utc)
     agent.elapsed_seconds = (agent.ended_at - agent.started_at).total_seconds()
 
-    return await persist_agent(agent)
+    await close_prefetch()
+    close_session()
+    await close_docs()
+
+    return await persist_agent(agent, _budget)
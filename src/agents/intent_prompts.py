@@ -1,6 +1,9 @@
 from typing import Any
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 from pydantic import BaseModel
 
+from src.tools import TRIPS_TABLE
+
 
 def truncate(output: str | Any | None, max_lines: int = 3) -> str:
     """Truncate output to first few lines with indicator for full version."""
@@ -86,6 +89,25 @@ def format_step_xml(step, step_index: int, show_full_output: bool = False) -> st
     return '\n'.join(xml_lines)
 
 
+def step_xml(step, step_index: int, show_full_output: bool = False) -> str:
+    """
+    `format_step_xml`, memoized on the step (`AgentHistoryStep._xml`), as
+    steps don't change once they are in the history.
+    """
+    cache: dict[tuple[int, bool], str] | None = getattr(step, "_xml", None)
+
+    if cache is None:
+        return format_step_xml(step, step_index, show_full_output=show_full_output)
+
+    key = (step_index, show_full_output)
+    xml = cache.get(key)
+
+    if xml is None:
+        xml = cache[key] = format_step_xml(step, step_index, show_full_output=show_full_output)
+
+    return xml
+
+
 def format_history_xml(agent, trucate_after: int = 20, keep_start: int = 5, keep_end: int = 10) -> str:
     """
     Format agent history as XML with compression.
@@ -99,12 +121,11 @@ def format_history_xml(agent, trucate_after: int = 20, keep_start: int = 5, keep
     if total_steps <= trucate_after:
         # Show all steps
         for i, step in enumerate(agent.steps, start=1):
-            is_most_recent = (i == total_steps)
-            xml_parts.append(format_step_xml(step, i, show_full_output=False))
+            xml_parts.append(step_xml(step, i, show_full_output=False))
 
     else:
         for i in range(keep_start):
-            xml_parts.append(format_step_xml(agent.steps[i], i + 1, show_full_output=False))
+            xml_parts.append(step_xml(agent.steps[i], i + 1, show_full_output=False))
 
         # Collapsed indicator
         collapsed_count = total_steps - (keep_start + keep_end)
@@ -115,27 +136,68 @@ def format_history_xml(agent, trucate_after: int = 20, keep_start: int = 5, keep
         for i in range(total_steps - keep_end, total_steps):
             step_index = i + 1
             is_most_recent = (step_index == total_steps)
-            xml_parts.append(format_step_xml(agent.steps[i], step_index, show_full_output=is_most_recent))
+            xml_parts.append(step_xml(agent.steps[i], step_index, show_full_output=is_most_recent))
 
     return '\n\n'.join(xml_parts)
 
 
-def build_dynamic_system_prompt(agent, tools: list[type[BaseModel]], user_prompt: str) -> str:
-    """Build complete dynamic system prompt with current agent state."""
-    # Format history
-    history_xml = format_history_xml(
-        agent,
-        trucate_after=15,
-        keep_start=5,
-        keep_end=3
-    )
-
+def format_tools_xml(tools: list[type[BaseModel]]) -> str:
+    """The <available_intents> block, it only changes with the tools so it is built once per run."""
     tools_list_str = ""
 
     for t in tools:
         tools_list_str += f"<{t.__name__}>\n{t.__doc__ or 'No description available.'}\n</{t.__name__}>\n"
 
-    # Build complete prompt
+    return tools_list_str
+
+
+def build_dynamic_system_prompt(history_xml: str, tools_xml: str, user_prompt: str) -> str:
+    """
+    Build complete dynamic system prompt with current agent state, from the
+    history packed by `compact_history` and the tools block of `format_tools_xml`.
+    """
+    return _system_prompt(history_xml, tools_xml, user_prompt)
+
+
+CACHED_HISTORY_NOTE = "The tasks completed so far follow this prompt as messages, oldest first."
+
+# Providers that only cache prompts up to explicit `cache_control` markers,
+# the others (e.g. OpenAI) cache the longest reused prefix on their own
+CACHE_CONTROL_PROVIDERS = ("anthropic/", "google/")
+
+
+def build_static_system_prompt(tools_xml: str, user_prompt: str) -> str:
+    """
+    System prompt of the "cached" layout: the same on every step, the
+    history follows it as messages (see `cached_layout_messages`).
+    """
+    return _system_prompt(CACHED_HISTORY_NOTE, tools_xml, user_prompt)
+
+
+def _text(text: str, cache_control: bool) -> str | list[str | dict]:
+    if not cache_control:
+        return text
+
+    return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+
+
+def cached_layout_messages(agent, system_prompt: str, model_name: str) -> list[BaseMessage]:
+    """
+    The stable prefix of the "cached" layout: the static system prompt and
+    one message per step, rendered once so the prefix only grows. Cache
+    markers go on the system prompt and on the latest step.
+    """
+    markers = model_name.startswith(CACHE_CONTROL_PROVIDERS)
+
+    msgs: list[BaseMessage] = [SystemMessage(content=_text(system_prompt, markers))]
+
+    for i, step in enumerate(agent.steps, start=1):
+        msgs.append(HumanMessage(content=_text(step_xml(step, i), markers and i == len(agent.steps))))
+
+    return msgs
+
+
+def _system_prompt(history_xml: str, tools_xml: str, user_prompt: str) -> str:
     prompt = f"""<role>
 Autonomous agent for NYC taxi data analysis. Complete assigned tasks by performing actions using available intents.
 
@@ -153,7 +215,7 @@ All actions recorded as structured intents for tracking and debugging.
 <available_intents>
 Use the following intents to perform actions:
 
-{tools_list_str}
+{tools_xml}
 </available_intents>
 
 <core_principles>
@@ -167,8 +229,12 @@ Use the following intents to perform actions:
 - Explore data systematically (list files, understand schema, validate assumptions)
 - Document findings incrementally (create intermediate files)
 - Always validate SQL before executing complex queries
-- Use DuckDB documentation when uncertain about functions/features
+- Use DuckDB documentation when uncertain about functions/features (SearchDocsSchema first, ReadDocsSchema only for full pages)
+- All monthly trip parquet files are pre-registered as the `{TRIPS_TABLE}` view (plus `source_month` DATE, `pickup_hour` and `distance_bracket` columns) - query it instead of globbing files, and filter on `source_month` to only read the months needed
 - Created SQL tables persist across queries - leverage this
+- Large SQL results are saved as `result_N` views (and files), with only a preview returned - query them instead of re-running the query or copying the result into files
+- ExecuteSQLSchema takes `"mode": "approx"` to explore quickly over a sample (approximate counts/sums with an error bound) - use the default `"exact"` mode for every number that ends up in a deliverable
+- Long outputs are condensed (tables to column stats and first/last rows, docs pages to a section outline) with a handle like `[output_3]` - use ExpandOutputSchema with the handle and a row/line range to read only the part needed, and ReadFileSchema `start_line`/`end_line` for long files
 - Use ClarificationIntent to see previous outputs when needed
 
 **File Management**:
@@ -196,7 +262,8 @@ The valid format for an intent is as following:
     // Note that it's called "intent_args"
     "intent_args": {{
         // Arguments specific to the intent schema, e.g. for ExecuteSQLSchema:
-        "sql": "<your SQL query here>"
+        "sql": "<your SQL query here>",
+        "mode": "exact"
     }},
     "reasoning": "<brief reasoning for choosing this intent>",
     "previous_step_analysis": "<analysis of previous step outputs relevant to this intent>",
@@ -210,8 +277,8 @@ So you should specially focus on choosing the correct intent schema and providin
 Example:
 ```
 [
-  {{ "type": "ListFilesSchema_Intent", "intent_args": {{ "filter": "" }}, "reasoning": "Start by listing all available files to understand the dataset.", "previous_step_analysis": "No previous steps.", "memory": "", "next_task": "Identify relevant files for taxi trip data." }},
-  {{ "type": "ExecuteSQLSchema_Intent", "intent_args": {{ "sql": "SELECT COUNT(*) FROM trips" }}, "reasoning": "Count total number of trips to get an overview of the dataset.", "previous_step_analysis": "Listed files and identified 'trips.parquet' as the main data file.", "memory": "trips.parquet contains NYC taxi trip records.", "next_task": "Analyze trip counts by day." }}
+  {{ "type": "ListFilesSchema_Intent", "intent_args": {{ "filter": "", "detail": false }}, "reasoning": "Start by listing all available files to understand the dataset.", "previous_step_analysis": "No previous steps.", "memory": "", "next_task": "Identify relevant files for taxi trip data." }},
+  {{ "type": "ExecuteSQLSchema_Intent", "intent_args": {{ "sql": "SELECT COUNT(*) FROM trips", "mode": "approx" }}, "reasoning": "Estimate the total number of trips to get an overview of the dataset.", "previous_step_analysis": "Listed files and identified 'trips.parquet' as the main data file.", "memory": "trips.parquet contains NYC taxi trip records.", "next_task": "Analyze trip counts by day." }}
 ]
 ```
 </output_format>
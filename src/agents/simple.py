@@ -6,27 +6,35 @@ from langchain_core.messages import HumanMessage, UsageMetadata
 from langchain_core.callbacks import UsageMetadataCallbackHandler
 from langchain.agents.structured_output import ToolStrategy
 from langchain.agents.middleware import SummarizationMiddleware
-from langchain_core.messages.utils import count_tokens_approximately
 
 
 from src.agents.prompts import USER_PROMPT
 from src.agents.simple_prompts import CUSTOM_SUMMARY_PREFIX, CUSTOM_SUMMARY_PROMPT, SYSTEM_PROMPT
+from src.budget import Budget, BudgetController, BudgetMiddleware
+from src.config import TOKEN_COUNTER, TOKEN_COUNTER_ENCODING
 from src.cost import compute_cost
 from src.llm import new_llm
 from src.models import MODELS, FinalResponse
-from src.tools import RUN_ID, get_tools
+from src.prefetch import PrefetchMiddleware
+from src.tokens import TokenAccountant
+from src.tools import PREFETCH, RUN_ID, close_docs, close_prefetch, close_session, get_tools, start_run, tool_calls, tools_stats
 
 
 async def simple(
     user_prompt: str = USER_PROMPT,
     use_summarization: bool = False, 
-    model_name: str | None = None
+    model_name: str | None = None,
+    budget: Budget | None = None,
 ):
     print(f"Starting simple agent with summarization={use_summarization}")
 
+    start_run()
+
     _model_name = model_name or MODELS["ant-haiku"]
     llm = new_llm(_model_name)
 
+    _budget = BudgetController(budget or Budget.from_config())
+
     agent = create_agent(
         model=llm,
         tools=get_tools(),
@@ -34,6 +42,9 @@ async def simple(
         response_format=ToolStrategy(FinalResponse),
         debug=False,
         middleware=[
+            BudgetMiddleware(_budget, _model_name),
+            PrefetchMiddleware(PREFETCH),
+        ] + ([
             SummarizationMiddleware(
                 model=new_llm("openai/gpt-4o-mini"),
                 max_tokens_before_summary=12000,
@@ -41,7 +52,7 @@ async def simple(
                 summary_prompt=CUSTOM_SUMMARY_PROMPT,
                 summary_prefix=CUSTOM_SUMMARY_PREFIX,
             )
-        ] if use_summarization else [],
+        ] if use_summarization else []),
     )
 
     output: FinalResponse | None = None
@@ -52,6 +63,9 @@ async def simple(
     latencies: list[dict[str, str | float]] = []
     tokens_used: list[int] = []
 
+    # Only counts the messages added to the state since the last chunk
+    accountant = TokenAccountant(TOKEN_COUNTER, TOKEN_COUNTER_ENCODING)  # type: ignore
+
     msg_count = 0
 
     chunk = None
@@ -92,7 +106,7 @@ async def simple(
             start = _now
 
             try:
-                estimated_tokens = count_tokens_approximately(chunk["messages"])
+                estimated_tokens = accountant.count(chunk["messages"])
 
             except Exception as e:
                 print(f"Error estimating tokens: {e}")
@@ -123,6 +137,10 @@ async def simple(
 
     _end_time = datetime.now(timezone.utc)
 
+    await close_prefetch()
+    close_session()
+    await close_docs()
+
     if output:
         print("\nFinal Response:")
         print(output.model_dump_json(indent=2))
@@ -154,6 +172,10 @@ async def simple(
         "end_time": _end_time.isoformat(),
         "total_time_seconds": (_end_time - _start_time).total_seconds(),
         "tokens_used_approx": tokens_used,
+        "token_counter": accountant.counter,
+        "tools_stats": tools_stats(),
+        "tool_calls": tool_calls(),
+        "budget": _budget.summary(),
     }
 
     _model_name_norm = _model_name.replace("/", "-").replace(" ", "_")
@@ -0,0 +1,229 @@
+import math
+from typing import Literal
+
+import duckdb
+import sqlglot
+from pydantic import BaseModel
+from sqlglot import exp
+
+from src.rollups import output_name
+
+
+SampleMethod = Literal["bernoulli", "system"]
+
+# Hidden column counting the sampled rows behind every result row
+SAMPLE_ROWS_COLUMN = "__sample_rows"
+
+# `seed` for REPEATABLE, so the same query samples the same rows
+SAMPLE_SEED = 42
+
+# Temporary table aggregated approximate results are computed into
+APPROX_TABLE = "__approx_result"
+
+# Rows kept or dropped together by "system" sampling (DuckDB's vector size)
+SYSTEM_SAMPLE_ROWS = 2048
+
+# z-score of the reported error bounds
+CONFIDENCE_Z = 1.96
+
+QUANTILE_FUNCTIONS = {"median", "quantile", "quantile_cont", "quantile_disc"}
+
+
+class NotApproximable(Exception):
+    pass
+
+
+class ApproxQuery(BaseModel):
+    """A query rewritten to run over a sample, with what is needed to annotate it."""
+    sql: str
+    percent: float
+    method: SampleMethod
+    table: str
+    sampled: bool
+    # Whether the result rows are aggregates, with the hidden sample count
+    aggregated: bool
+
+
+def _quantile(node: exp.Expression) -> exp.Expression | None:
+    """`median(x)` / `quantile_cont(x, q)` -> `approx_quantile(x, q)`."""
+    if isinstance(node, exp.Median):
+        return exp.Anonymous(this="approx_quantile", expressions=[node.this.copy(), exp.Literal.number(0.5)])
+
+    if isinstance(node, (exp.PercentileCont, exp.PercentileDisc, exp.Quantile)):
+        if node.expression is None:
+            return None
+
+        return exp.Anonymous(this="approx_quantile", expressions=[node.this.copy(), node.expression.copy()])
+
+    if isinstance(node, exp.Anonymous) and node.name.lower() in QUANTILE_FUNCTIONS:
+        args = node.expressions
+
+        if node.name.lower() == "median" and len(args) == 1:
+            return exp.Anonymous(this="approx_quantile", expressions=[args[0].copy(), exp.Literal.number(0.5)])
+
+        if len(args) == 2:
+            return exp.Anonymous(this="approx_quantile", expressions=[args[0].copy(), args[1].copy()])
+
+    return None
+
+
+def _is_distinct_count(node: exp.Expression) -> bool:
+    return isinstance(node, exp.Count) and isinstance(node.this, exp.Distinct)
+
+
+def rewrite_approx(sql: str, percent: float, method: SampleMethod = "system") -> ApproxQuery:
+    """
+    Rewrite `sql` to read a `percent`% sample of its table, with counts and
+    sums scaled back up and exact quantiles replaced by their approximate
+    versions. Distinct counts don't scale from a sample: queries whose only
+    aggregates are distinct counts and quantiles read every row with
+    HyperLogLog instead. Only single-table selects are rewritten, raises
+    `NotApproximable` otherwise.
+
+    "system" keeps or drops whole vectors of rows, so most of the work on
+    the dropped rows is skipped, "bernoulli" decides row by row.
+    """
+    try:
+        statements = sqlglot.parse(sql, read="duckdb")
+
+    except sqlglot.errors.SqlglotError:
+        raise NotApproximable("the query could not be parsed")
+
+    if len(statements) != 1 or not isinstance(statements[0], exp.Select):
+        raise NotApproximable("only a single SELECT can be approximated")
+
+    select: exp.Select = statements[0]
+
+    source = select.args.get("from_") or select.args.get("from")
+
+    if not isinstance(source, exp.From) or not isinstance(source.this, exp.Table):
+        raise NotApproximable("only queries reading a single table or file can be approximated")
+
+    for arg in ("joins", "laterals", "with", "with_", "sample"):
+        if select.args.get(arg):
+            raise NotApproximable("joins, CTEs and samples can't be approximated")
+
+    if any(node is not select for node in select.find_all(exp.Select, exp.Subquery, exp.Window)):
+        raise NotApproximable("subqueries and window functions can't be approximated")
+
+    # Scaling `COUNT(*) FILTER (WHERE ...)` would wrap the filter clause
+    # instead of the aggregate it belongs to
+    if select.find(exp.Filter) is not None:
+        raise NotApproximable("aggregates with a FILTER clause can't be approximated")
+
+    table = source.this
+    aggregated = select.find(exp.AggFunc) is not None or bool(select.args.get("group"))
+
+    # Distinct counts don't scale from a sample, they use HyperLogLog over
+    # all the rows instead, which the other aggregates shouldn't silently pay for
+    aggregates = list(select.find_all(exp.AggFunc))
+    distinct_counts = [node for node in aggregates if _is_distinct_count(node)]
+    sampled = not distinct_counts
+
+    if distinct_counts and any(
+        not _is_distinct_count(node) and _quantile(node) is None
+        for node in aggregates
+    ):
+        raise NotApproximable("distinct counts can't be approximated together with other aggregates")
+
+    factor = 100.0 / percent
+
+    def transform(node: exp.Expression) -> exp.Expression:
+        if _is_distinct_count(node):
+            distinct: exp.Distinct = node.this  # type: ignore
+
+            if len(distinct.expressions) != 1:
+                raise NotApproximable("multi-column distinct counts can't be approximated")
+
+            return exp.Anonymous(this="approx_count_distinct", expressions=[distinct.expressions[0].copy()])
+
+        quantile = _quantile(node)
+
+        if quantile is not None:
+            return quantile
+
+        if sampled and isinstance(node, exp.Count):
+            return sqlglot.parse_one(
+                f"CAST(round({node.sql(dialect='duckdb')} * {factor}) AS BIGINT)",
+                read="duckdb",
+            )
+
+        if sampled and isinstance(node, exp.Sum):
+            return sqlglot.parse_one(f"({node.sql(dialect='duckdb')} * {factor})", read="duckdb")
+
+        return node
+
+    rewritten = select.copy()
+
+    # Keep the output column names of the original query
+    for expression in list(rewritten.expressions):
+        if not isinstance(expression, (exp.Alias, exp.Column, exp.Star)):
+            expression.replace(exp.alias_(expression.copy(), output_name(expression), quoted=True))
+
+    rewritten = rewritten.transform(transform)
+
+    if sampled:
+        rewritten_table = (rewritten.args.get("from_") or rewritten.args.get("from")).this  # type: ignore
+
+        rewritten_table.set("sample", exp.TableSample(
+            method=exp.var(method.upper()),
+            percent=exp.Literal.number(percent),
+            seed=exp.Literal.number(SAMPLE_SEED),
+        ))
+
+        if aggregated:
+            rewritten = rewritten.select(
+                exp.alias_(exp.Count(this=exp.Star()), SAMPLE_ROWS_COLUMN, quoted=True),
+                copy=False,
+            )
+
+    return ApproxQuery(
+        sql=rewritten.sql(dialect="duckdb"),
+        percent=percent,
+        method=method,
+        table=table.sql(dialect="duckdb"),
+        sampled=sampled,
+        aggregated=aggregated,
+    )
+
+
+def error_bound(percent: float, sample_units: int) -> float:
+    """95% relative error, in %, of a count estimated from `sample_units` sampled rows or vectors."""
+    fraction = percent / 100.0
+    return CONFIDENCE_Z * math.sqrt((1 - fraction) / max(sample_units, 1)) * 100
+
+
+def materialize(
+    con: duckdb.DuckDBPyConnection,
+    approx: ApproxQuery,
+) -> tuple[duckdb.DuckDBPyRelation | None, str]:
+    """
+    Open `approx` on `con` and describe how approximate it is. Aggregated
+    results go through a temporary table first, private to the cursor, so
+    the shown rows and the error bound come from the same sample.
+    """
+    if not approx.sampled:
+        return con.sql(approx.sql), "Approximate result: distinct counts are estimated with HyperLogLog (typically within ±2%)."
+
+    if not approx.aggregated:
+        return con.sql(approx.sql), f"Approximate result: rows are a random ~{approx.percent:g}% sample of {approx.table}."
+
+    con.execute(f"CREATE OR REPLACE TEMP TABLE {APPROX_TABLE} AS {approx.sql}")
+
+    min_rows = con.execute(f'SELECT min("{SAMPLE_ROWS_COLUMN}") FROM {APPROX_TABLE}').fetchone()[0]  # type: ignore
+
+    rel = con.sql(f'SELECT * EXCLUDE ("{SAMPLE_ROWS_COLUMN}") FROM {APPROX_TABLE}')
+
+    if min_rows is None:
+        return rel, f"Approximate result from a ~{approx.percent:g}% sample of {approx.table}, in which no rows matched."
+
+    # "system" keeps or drops whole vectors, so they are the sampled units
+    sample_units = min_rows if approx.method == "bernoulli" else -(-min_rows // SYSTEM_SAMPLE_ROWS)
+
+    return rel, (
+        f"Approximate result from a ~{approx.percent:g}% sample of {approx.table}: counts are scaled up"
+        f" x{100 / approx.percent:g} and within ±{error_bound(approx.percent, sample_units):.1f}% (95% confidence,"
+        f" the smallest group had {min_rows} sampled rows), sums are scaled up too with a wider error for skewed"
+        " values, averages and quantiles are estimates and min/max only cover the sample. Use the exact mode"
+        " for final numbers."
+    )
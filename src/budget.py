@@ -0,0 +1,173 @@
+import time
+from typing import Any, Literal
+
+from langchain.agents.middleware import AgentMiddleware, AgentState, hook_config
+from langchain_core.messages import AIMessage, HumanMessage, UsageMetadata
+from pydantic import BaseModel
+
+from src.config import RUN_BUDGET_SOFT_RATIO, RUN_MAX_COST_USD, RUN_MAX_SECONDS, RUN_MAX_TOKENS
+from src.cost import UsagePrice, compute_cost
+
+
+BudgetStatus = Literal["ok", "soft", "hard"]
+
+
+class Budget(BaseModel):
+    """
+    Limits of one agent run, None for no limit. Reaching `soft_ratio` of
+    any of them asks the agent to wrap up, reaching one of them stops it.
+    """
+    max_tokens: int | None = None
+    max_cost: float | None = None  # in USD
+    max_seconds: float | None = None
+    soft_ratio: float = 0.8
+
+    @classmethod
+    def from_config(cls) -> "Budget":
+        return cls(
+            max_tokens=RUN_MAX_TOKENS or None,
+            max_cost=RUN_MAX_COST_USD or None,
+            max_seconds=RUN_MAX_SECONDS or None,
+            soft_ratio=RUN_BUDGET_SOFT_RATIO,
+        )
+
+
+class BudgetController:
+    """
+    Tracks the tokens and spend of a run as the LLM responses come in (from
+    their `usage_metadata`), and its wall time, against a `Budget`.
+    """
+
+    def __init__(self, budget: Budget):
+        self.budget = budget
+
+        self.calls = 0
+        self.tokens = 0
+        self.cost = 0.0
+
+        self.wrap_up_signalled = False
+        self.stop_reason: str | None = None
+
+        self._started = time.monotonic()
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return time.monotonic() - self._started
+
+    def _ratios(self) -> dict[str, float]:
+        ratios: dict[str, float] = {}
+
+        if self.budget.max_tokens:
+            ratios["tokens"] = self.tokens / self.budget.max_tokens
+
+        if self.budget.max_cost:
+            ratios["cost"] = self.cost / self.budget.max_cost
+
+        if self.budget.max_seconds:
+            ratios["time"] = self.elapsed_seconds / self.budget.max_seconds
+
+        return ratios
+
+    def status(self) -> BudgetStatus:
+        ratios = self._ratios()
+
+        if any(ratio >= 1 for ratio in ratios.values()):
+            return "hard"
+
+        if any(ratio >= self.budget.soft_ratio for ratio in ratios.values()):
+            return "soft"
+
+        return "ok"
+
+    async def add_usage(self, model_name: str, usage: UsageMetadata) -> UsagePrice:
+        """Account for an LLM response, returns its cost."""
+        price = await compute_cost(model_name, usage)
+
+        self.calls += 1
+        self.tokens += usage.get("total_tokens", 0)
+        self.cost += price.total_cost
+
+        return price
+
+    def should_wrap_up(self) -> bool:
+        """True once, when the run first goes over the soft threshold."""
+        if self.wrap_up_signalled or self.status() != "soft":
+            return False
+
+        self.wrap_up_signalled = True
+        print(f"Budget soft threshold reached ({self.describe()}), asking the agent to wrap up")
+
+        return True
+
+    def should_stop(self) -> bool:
+        if self.stop_reason is None and self.status() == "hard":
+            exceeded = [name for name, ratio in self._ratios().items() if ratio >= 1]
+            self.stop_reason = f"{' and '.join(exceeded)} budget exceeded ({self.describe()})"
+
+            print(f"Stopping the run: {self.stop_reason}")
+
+        return self.stop_reason is not None
+
+    def describe(self) -> str:
+        parts = [
+            f"{self.tokens:,}/{self.budget.max_tokens:,} tokens" if self.budget.max_tokens else f"{self.tokens:,} tokens",
+            f"${self.cost:.4f}/${self.budget.max_cost:.2f}" if self.budget.max_cost else f"${self.cost:.4f}",
+            f"{self.elapsed_seconds:.0f}s/{self.budget.max_seconds:.0f}s" if self.budget.max_seconds else f"{self.elapsed_seconds:.0f}s",
+        ]
+
+        return ", ".join(parts)
+
+    def wrap_up_message(self) -> str:
+        return (
+            f"Budget warning: this run has used over {self.budget.soft_ratio:.0%} of its budget ({self.describe()}) "
+            "and will be stopped when it runs out. Wrap up now: stop exploring, and return your final response "
+            "with the best results you have so far."
+        )
+
+    def summary(self) -> dict:
+        return {
+            "limits": self.budget.model_dump(),
+            "calls": self.calls,
+            "tokens": self.tokens,
+            "cost": self.cost,
+            "elapsed_seconds": self.elapsed_seconds,
+            "status": self.status(),
+            "wrap_up_signalled": self.wrap_up_signalled,
+            "stop_reason": self.stop_reason,
+        }
+
+
+class BudgetMiddleware(AgentMiddleware):
+    """
+    Enforces a `BudgetController` in a `create_agent` loop: every model
+    response is accounted for, the agent is asked to wrap up at the soft
+    threshold and the run ends before the next model call at the hard one.
+    """
+
+    def __init__(self, controller: BudgetController, model_name: str):
+        super().__init__()
+
+        self.controller = controller
+        self.model_name = model_name
+
+    @hook_config(can_jump_to=["end"])
+    async def abefore_model(self, state: AgentState, runtime: Any) -> dict[str, Any] | None:
+        if self.controller.should_stop():
+            return {
+                "jump_to": "end",
+                "messages": [AIMessage(content=f"Run stopped: {self.controller.stop_reason}.")],
+            }
+
+        if self.controller.should_wrap_up():
+            return {"messages": [HumanMessage(content=self.controller.wrap_up_message())]}
+
+        return None
+
+    async def aafter_model(self, state: AgentState, runtime: Any) -> dict[str, Any] | None:
+        message = state["messages"][-1] if state["messages"] else None
+        usage = getattr(message, "usage_metadata", None)
+
+        if usage:
+            await self.controller.add_usage(self.model_name, usage)
+
+        return None
@@ -0,0 +1,95 @@
+import glob
+import os
+
+import duckdb
+
+
+TRIPS_TABLE = "trips"
+TRIPS_FILE_PATTERN = "yellow_tripdata_*.parquet"
+
+# `yellow_tripdata_2025-03.parquet` -> DATE '2025-03-01'
+SOURCE_MONTH_SQL = (
+    "make_date("
+    "regexp_extract(filename, '(\\d{4})-(\\d{2})', 1)::INTEGER, "
+    "regexp_extract(filename, '(\\d{4})-(\\d{2})', 2)::INTEGER, "
+    "1)"
+)
+
+
+# Distance brackets used across the analyses, in miles
+DISTANCE_BRACKET_SQL = (
+    "CASE "
+    "WHEN trip_distance IS NULL THEN NULL "
+    "WHEN trip_distance <= 1 THEN '0-1mi' "
+    "WHEN trip_distance <= 2 THEN '1-2mi' "
+    "WHEN trip_distance <= 5 THEN '2-5mi' "
+    "WHEN trip_distance <= 10 THEN '5-10mi' "
+    "ELSE '10+mi' END"
+)
+
+
+def trips_files(data_dir: str) -> list[str]:
+    """The monthly trip parquet files backing the `trips` view."""
+    return sorted(
+        os.path.abspath(path)
+        for path in glob.glob(os.path.join(data_dir, TRIPS_FILE_PATTERN))
+    )
+
+
+def trips_select_sql(files: list[str]) -> str:
+    """
+    Query over all the monthly files. Columns are exposed with their stored
+    types (no casts) so filters are pushed down to the parquet row group
+    statistics, and `source_month` is derived from the filename so filters
+    on it prune whole files before they are opened. `pickup_hour` and
+    `distance_bracket` are the dimensions the rollups are built on.
+    """
+    paths = ", ".join(f"'{path}'" for path in files)
+
+    return (
+        f"SELECT * EXCLUDE (filename), "
+        f"{SOURCE_MONTH_SQL} AS source_month, "
+        f"hour(tpep_pickup_datetime) AS pickup_hour, "
+        f"{DISTANCE_BRACKET_SQL} AS distance_bracket "
+        f"FROM read_parquet([{paths}], filename = true, union_by_name = true)"
+    )
+
+
+def register_trips(con: duckdb.DuckDBPyConnection, data_dir: str, materialize: bool = False):
+    """
+    Register `trips` over the data directory, as a view or, optionally, as a
+    native table sorted by pickup time so zone maps can skip blocks.
+    """
+    files = trips_files(data_dir)
+
+    if not files:
+        print(f"No trip files found in {data_dir}, `{TRIPS_TABLE}` not registered")
+        return
+
+    select_sql = trips_select_sql(files)
+
+    try:
+        # `trips` may exist with the other kind in a reused database
+        existing = con.execute(
+            "SELECT table_type FROM information_schema.tables WHERE table_name = ?",
+            [TRIPS_TABLE],
+        ).fetchone()
+
+        if existing is not None:
+            kind = "VIEW" if existing[0] == "VIEW" else "TABLE"
+            con.execute(f"DROP {kind} {TRIPS_TABLE}")
+
+        if materialize:
+            con.execute(
+                f"CREATE TABLE {TRIPS_TABLE} AS {select_sql} "
+                "ORDER BY source_month, tpep_pickup_datetime"
+            )
+
+        else:
+            con.execute(f"CREATE VIEW {TRIPS_TABLE} AS {select_sql}")
+
+    except duckdb.Error as e:
+        print(f"Could not register `{TRIPS_TABLE}`: {e}")
+        return
+
+    print(f"Registered `{TRIPS_TABLE}` {'table' if materialize else 'view'} over {len(files)} files")
@@ -0,0 +1,299 @@
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Literal
+
+from pydantic import BaseModel
+
+from src.instrumentation import CHARS_PER_TOKEN
+from src.results import QueryResult
+
+
+OutputKind = Literal["table", "markdown", "text"]
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+
+
+class CondenseStats(BaseModel):
+    outputs: int = 0
+    condensed: int = 0
+    tokens_in: int = 0
+    tokens_out: int = 0
+    expanded: int = 0
+
+
+class StoredOutput(BaseModel):
+    """Full version of a condensed output, as lines (rows for tables)."""
+    kind: OutputKind
+    source: str
+    lines: list[str]
+    # Column names of tables, shown above expanded rows
+    header: str | None = None
+
+
+def approx_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _fit(lines: list[str], chars: int, from_end: bool = False) -> int:
+    """How many of `lines` (from the start, or the end) fit in `chars`."""
+    count = 0
+    size = 0
+
+    for line in (reversed(lines) if from_end else lines):
+        size += len(line) + 1
+
+        if size > chars:
+            break
+
+        count += 1
+
+    return count
+
+
+def outline(lines: list[str]) -> list[tuple[int, int, str]]:
+    """(first line, last line, heading) of every markdown section, 1-based."""
+    headings: list[tuple[int, str]] = []
+    in_fence = False
+
+    for number, line in enumerate(lines, start=1):
+        if FENCE_PATTERN.match(line):
+            in_fence = not in_fence
+            continue
+
+        match = None if in_fence else HEADING_PATTERN.match(line)
+
+        if match:
+            headings.append((number, f"{match.group(1)} {match.group(2)}"))
+
+    return [
+        (start, (headings[i + 1][0] - 1) if i + 1 < len(headings) else len(lines), heading)
+        for i, (start, heading) in enumerate(headings)
+    ]
+
+
+class Condenser:
+    """
+    Condenses tool outputs over `target_tokens` before they reach the agent
+    context, according to their structure: tables keep their header, column
+    statistics and head/tail rows, docs pages become an outline of their
+    sections with line ranges, and text keeps its first and last lines.
+    The full versions are kept under a handle (`output_N`, the last
+    `max_outputs` of the run) that `expand_output` reads ranges from.
+    """
+
+    def __init__(self, target_tokens: int, max_outputs: int = 256):
+        self.target_tokens = target_tokens
+        self.max_outputs = max_outputs
+
+        self.stats = CondenseStats()
+
+        self._outputs: OrderedDict[str, StoredOutput] = OrderedDict()
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.target_tokens > 0
+
+    @property
+    def target_chars(self) -> int:
+        return int(self.target_tokens * CHARS_PER_TOKEN)
+
+    def reset(self):
+        with self._lock:
+            self.stats = CondenseStats()
+            self._outputs = OrderedDict()
+            self._count = 0
+
+    def _fits(self, text: str) -> bool:
+        self.stats.outputs += 1
+        self.stats.tokens_in += approx_tokens(text)
+
+        if not self.enabled or approx_tokens(text) <= self.target_tokens:
+            self.stats.tokens_out += approx_tokens(text)
+            return True
+
+        return False
+
+    def _store(self, output: StoredOutput) -> str:
+        with self._lock:
+            self._count += 1
+            handle = f"output_{self._count}"
+
+            self._outputs[handle] = output
+
+            while len(self._outputs) > self.max_outputs:
+                self._outputs.popitem(last=False)
+
+        return handle
+
+    def _condensed(self, text: str) -> str:
+        self.stats.condensed += 1
+        self.stats.tokens_out += approx_tokens(text)
+
+        return text
+
+    def table(self, result: QueryResult, source: str = "execute_sql") -> str:
+        """`result.to_text()`, or its condensed form when over the target."""
+        text = result.to_text()
+
+        if self._fits(text) or result.shown_rows == 0:
+            return text
+
+        header = ", ".join(result.columns)
+        handle = self._store(StoredOutput(kind="table", source=source, lines=result.lines, header=header))
+
+        intro = (
+            f"[{handle}] {result.shown_rows} rows x {len(result.columns)} columns fetched, condensed to fit "
+            f"~{self.target_tokens} tokens. Use `expand_output` with handle \"{handle}\" and a row range "
+            f"(1-{result.shown_rows}) to see the omitted rows.\n"
+        )
+
+        # Results cached before the stats were computed don't have them
+        if result.stats:
+            intro += f"Column stats over the {result.shown_rows} fetched rows:\n" + "\n".join(result.stats) + "\n"
+
+        footer = ""
+
+        if result.truncated:
+            footer += "\n" + result.truncated_text("not fetched")
+
+        for note in result.notes:
+            footer += f"\nNote: {note}"
+
+        budget = max(self.target_chars - len(intro) - len(header) - len(footer), 0)
+
+        head = max(_fit(result.lines, budget // 2), 1)
+        tail = min(_fit(result.lines, budget // 2, from_end=True), result.shown_rows - head)
+
+        rows = [line[:self.target_chars] for line in result.lines[:head]]
+
+        if head + tail < result.shown_rows:
+            rows.append(f"... rows {head + 1}-{result.shown_rows - tail} omitted ...")
+
+        if tail > 0:
+            rows += result.lines[-tail:]
+
+        return self._condensed(intro + header + "\n" + "\n".join(rows) + footer)
+
+    def markdown(self, text: str, source: str) -> str:
+        """A docs page, or its outline with the start of the page when over the target."""
+        if self._fits(text):
+            return text
+
+        lines = text.splitlines()
+        sections = outline(lines)
+
+        if not sections:
+            return self.text(text, source, counted=True)
+
+        handle = self._store(StoredOutput(kind="markdown", source=source, lines=lines))
+
+        intro = (
+            f"[{handle}] {source}: {len(lines)} lines, condensed to fit ~{self.target_tokens} tokens. "
+            f"Use `expand_output` with handle \"{handle}\" and the line range of a section to read it.\n"
+            f"Outline:\n"
+        )
+
+        # The outline gets up to 2/3 of the target, the start of the page the rest
+        budget = self.target_chars * 2 // 3 - len(intro)
+        entries: list[str] = []
+
+        for start, end, heading in sections:
+            entry = f"- L{start}-{end}: {heading} (~{approx_tokens(chr(10).join(lines[start - 1:end]))} tokens)"
+
+            if len(entry) + 1 > budget:
+                entries.append(f"- ... {len(sections) - len(entries)} more sections")
+                break
+
+            entries.append(entry)
+            budget -= len(entry) + 1
+
+        body = intro + "\n".join(entries)
+
+        head = _fit(lines, max(self.target_chars - len(body), 0))
+
+        if head > 0:
+            body += f"\n\nLines 1-{head}:\n" + "\n".join(lines[:head])
+
+        return self._condensed(body)
+
+    def text(
+        self,
+        text: str,
+        source: str,
+        filename: str | None = None,
+        first_line: int = 1,
+        counted: bool = False,
+    ) -> str:
+        """
+        Plain text, or its first and last lines when over the target. Lines
+        of a file (`filename`, starting at `first_line`) are read again by
+        range with `read_file`, they don't need a handle.
+        """
+        if not counted and self._fits(text):
+            return text
+
+        lines = text.splitlines()
+        last_line = first_line + len(lines) - 1
+
+        if filename is not None:
+            how = f"Use `read_file` with `start_line`/`end_line` to read the omitted lines of '{filename}'"
+
+        else:
+            handle = self._store(StoredOutput(kind="text", source=source, lines=lines))
+            how = f"[{handle}] Use `expand_output` with handle \"{handle}\" and a line range to read the omitted lines"
+
+            # Handles count lines from 1
+            first_line, last_line = 1, len(lines)
+
+        intro = f"{how}, lines {first_line}-{last_line} condensed to fit ~{self.target_tokens} tokens.\n"
+        budget = max(self.target_chars - len(intro), 0)
+
+        head = max(_fit(lines, budget * 2 // 3), 1)
+        tail = min(_fit(lines, budget // 3, from_end=True), len(lines) - head)
+
+        body = intro + f"Lines {first_line}-{first_line + head - 1}:\n" + "\n".join(line[:self.target_chars] for line in lines[:head])
+
+        if tail > 0:
+            body += f"\n... lines {first_line + head}-{last_line - tail} omitted ...\nLines {last_line - tail + 1}-{last_line}:\n" + "\n".join(lines[-tail:])
+
+        return self._condensed(body)
+
+    def expand(self, handle: str, start_line: int, end_line: int) -> str:
+        """Lines (rows for tables) `start_line` to `end_line` of a condensed output."""
+        with self._lock:
+            output = self._outputs.get(handle.strip())
+
+        if output is None:
+            return f"Error: Unknown output handle '{handle}', it may be too old. Run the tool again to get the output."
+
+        self.stats.expanded += 1
+
+        total = len(output.lines)
+        start = max(start_line, 1)
+        end = min(end_line if end_line > 0 else total, total)
+
+        if start > end:
+            return f"Error: Empty range, {handle} has {total} {'rows' if output.kind == 'table' else 'lines'}."
+
+        # Expanded ranges are capped at the target too
+        selected = output.lines[start - 1:end]
+        shown = max(_fit(selected, self.target_chars), 1) if self.enabled else len(selected)
+        end = start + shown - 1
+
+        unit = "Rows" if output.kind == "table" else "Lines"
+        text = f"{unit} {start}-{end} of {total} of {handle} ({output.source}):\n"
+
+        if output.header is not None:
+            text += output.header + "\n"
+
+        text += "\n".join(selected[:shown])
+
+        if end < min(end_line if end_line > 0 else total, total):
+            text += f"\n... capped at ~{self.target_tokens} tokens, continue from {unit.lower()[:-1]} {end + 1}."
+
+        return text
@@ -1,3 +1,125 @@
+import os
+
 from dotenv import load_dotenv
 
 load_dotenv()
+
+
+# Ceilings for the results `execute_sql` returns to the agent, results are
+# streamed in batches of `SQL_FETCH_BATCH_ROWS` and the rest is omitted.
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "200"))
+SQL_MAX_BYTES = int(os.getenv("SQL_MAX_BYTES", "32000"))
+SQL_FETCH_BATCH_ROWS = int(os.getenv("SQL_FETCH_BATCH_ROWS", "256"))
+
+# Results with more rows than `SQL_SPILL_ROWS` are written to a file under the
+# content directory (and a view) instead, only a preview is returned. 0 disables it.
+SQL_SPILL_ROWS = int(os.getenv("SQL_SPILL_ROWS", "1000"))
+SQL_SPILL_FORMAT = os.getenv("SQL_SPILL_FORMAT", "parquet").lower()
+SQL_SPILL_PREVIEW_ROWS = int(os.getenv("SQL_SPILL_PREVIEW_ROWS", "5"))
+
+# Queries run on a dedicated thread pool and are interrupted after the timeout
+SQL_TIMEOUT_SECONDS = float(os.getenv("SQL_TIMEOUT_SECONDS", "120"))
+SQL_MAX_WORKERS = int(os.getenv("SQL_MAX_WORKERS", "4"))
+
+# What `execute_sql` does with queries whose plan is too expensive: "reject"
+# them, "limit" the ones returning too many rows without a LIMIT, or "allow"
+# them (every decision is logged in the run output either way)
+SQL_COST_POLICY = os.getenv("SQL_COST_POLICY", "limit").lower()
+SQL_GUARD_MAX_RESULT_ROWS = int(os.getenv("SQL_GUARD_MAX_RESULT_ROWS", "10000"))
+SQL_GUARD_MAX_PLAN_ROWS = int(os.getenv("SQL_GUARD_MAX_PLAN_ROWS", "100000000"))
+
+# `execute_sql` in "approx" mode reads a `SQL_APPROX_SAMPLE_PERCENT`% sample
+# ("system" per vector of rows, or the slower "bernoulli" per row, which
+# decides on every row of the scan but has tighter error bounds)
+SQL_APPROX_SAMPLE_PERCENT = float(os.getenv("SQL_APPROX_SAMPLE_PERCENT", "10"))
+SQL_APPROX_METHOD = os.getenv("SQL_APPROX_METHOD", "system").lower()
+
+# Budget the DuckDB sessions of all the runs on this machine share: each
+# active run gets an equal slice of threads, `memory_limit` and temp directory
+# (spill) space, rebalanced as runs start and finish. Runs register under
+# DUCKDB_GOVERNOR_DIR, and their memory and spill use is sampled every
+# DUCKDB_MONITOR_INTERVAL_SECONDS while queries run.
+DUCKDB_GOVERNOR_ENABLED = os.getenv("DUCKDB_GOVERNOR_ENABLED", "true").lower() == "true"
+DUCKDB_GOVERNOR_DIR = os.getenv("DUCKDB_GOVERNOR_DIR", "/tmp/agent-ctx-governor")
+DUCKDB_TOTAL_THREADS = int(os.getenv("DUCKDB_TOTAL_THREADS", str(os.cpu_count() or 1)))
+DUCKDB_TOTAL_MEMORY_BYTES = int(os.getenv(
+    "DUCKDB_TOTAL_MEMORY_BYTES",
+    # 80% of the physical memory, DuckDB's own default for a single connection
+    str(int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") * 0.8)),
+))
+DUCKDB_TOTAL_TEMP_BYTES = int(os.getenv("DUCKDB_TOTAL_TEMP_BYTES", str(32 * 1024 * 1024 * 1024)))
+DUCKDB_MONITOR_INTERVAL_SECONDS = float(os.getenv("DUCKDB_MONITOR_INTERVAL_SECONDS", "0.05"))
+
+# Local caches (SQL results, ...) shared across runs
+CACHE_DIR = os.getenv(
+    "CACHE_DIR",
+    os.path.join(os.path.dirname(__file__), "..", ".cache"),
+)
+
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "true").lower() == "true"
+SQL_CACHE_MEMORY_BYTES = int(os.getenv("SQL_CACHE_MEMORY_BYTES", str(16 * 1024 * 1024)))
+SQL_CACHE_DISK_BYTES = int(os.getenv("SQL_CACHE_DISK_BYTES", str(128 * 1024 * 1024)))
+
+# Compact, indexed copy of the prices in models.json, reused while the file
+# is unchanged (empty to disable)
+PRICING_SNAPSHOT_PATH = os.getenv("PRICING_SNAPSHOT_PATH", os.path.join(CACHE_DIR, "pricing.json"))
+
+# Load the monthly parquet files into a native `trips` table instead of a view
+TRIPS_MATERIALIZE = os.getenv("TRIPS_MATERIALIZE", "false").lower() == "true"
+
+# Pre-aggregate `trips` into rollups (under CACHE_DIR) once per dataset, and
+# answer the aggregate queries they cover from them
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "false").lower() == "true"
+
+# Independent intents returned in a single response run concurrently
+INTENT_MAX_CONCURRENCY = int(os.getenv("INTENT_MAX_CONCURRENCY", "4"))
+
+# Layout of the intent agent prompt: "dynamic" renders the (compressed)
+# history inside the system prompt, "cached" keeps the system prompt static
+# and appends one message per step after it, so providers can reuse the
+# cached prefix (with cache_control markers for the providers needing them)
+INTENT_PROMPT_LAYOUT = os.getenv("INTENT_PROMPT_LAYOUT", "dynamic").lower()
+
+# Token budget of the history in the intent agent's "dynamic" prompt: steps
+# are scored and packed to fit (see src/agents/compaction.py), 0 keeps the
+# legacy fixed window of the first 5 and last 3 steps past 15 steps
+INTENT_HISTORY_MAX_TOKENS = int(os.getenv("INTENT_HISTORY_MAX_TOKENS", "12000"))
+
+# Stream the intent agent's responses, starting each intent as soon as its
+# tool call is complete rather than once the whole response arrived
+INTENT_STREAMING = os.getenv("INTENT_STREAMING", "false").lower() == "true"
+
+# Default budget of an agent run (0 for no limit), main.py can set one per
+# run. Agents are asked to wrap up at RUN_BUDGET_SOFT_RATIO of any limit and
+# stopped when one is reached
+RUN_MAX_TOKENS = int(os.getenv("RUN_MAX_TOKENS", "0"))
+RUN_MAX_COST_USD = float(os.getenv("RUN_MAX_COST_USD", "0"))
+RUN_MAX_SECONDS = float(os.getenv("RUN_MAX_SECONDS", "0"))
+RUN_BUDGET_SOFT_RATIO = float(os.getenv("RUN_BUDGET_SOFT_RATIO", "0.8"))
+
+# Tool outputs over CONDENSE_TARGET_TOKENS are condensed by structure before
+# they reach either agent (tables to stats and head/tail rows, docs pages to an
+# outline, text to its first and last lines), 0 passes them through untouched
+CONDENSE_TARGET_TOKENS = int(os.getenv("CONDENSE_TARGET_TOKENS", "1500"))
+
+# While the agents wait on the model, warm the DuckDB session, the parquet
+# footers and the page cache of up to PREFETCH_WARM_MAX_BYTES of data files,
+# fetch up to PREFETCH_MAX_DOCS docs pages the previous step mentioned, and
+# probe (schema, row count) up to PREFETCH_MAX_TABLES tables it queried
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_WARM_MAX_BYTES = int(os.getenv("PREFETCH_WARM_MAX_BYTES", str(4 * 1024 ** 3)))
+PREFETCH_MAX_DOCS = int(os.getenv("PREFETCH_MAX_DOCS", "3"))
+PREFETCH_MAX_TABLES = int(os.getenv("PREFETCH_MAX_TABLES", "2"))
+
+# How the agent state is counted between LLM calls: "approx" (characters)
+# or "tiktoken" (exact for OpenAI models, needs tiktoken installed)
+TOKEN_COUNTER = os.getenv("TOKEN_COUNTER", "approx").lower()
+TOKEN_COUNTER_ENCODING = os.getenv("TOKEN_COUNTER_ENCODING", "o200k_base")
+
+# `read_docs` pages are cached on disk and refetched after the TTL, in offline
+# mode only cached pages are served (see `python -m src.docs snapshot`)
+DOCS_CACHE_DIR = os.getenv("DOCS_CACHE_DIR", os.path.join(CACHE_DIR, "docs"))
+DOCS_CACHE_TTL_SECONDS = float(os.getenv("DOCS_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+DOCS_OFFLINE = os.getenv("DOCS_OFFLINE", "false").lower() == "true"
+DOCS_TIMEOUT_SECONDS = float(os.getenv("DOCS_TIMEOUT_SECONDS", "30"))
+DOCS_MAX_CONNECTIONS = int(os.getenv("DOCS_MAX_CONNECTIONS", "8"))
@@ -1,10 +1,13 @@
 import os
+import threading
 import httpx
 
-from aiofiles import open as aio_open
+from json import dumps, loads
 from langchain_core.messages import UsageMetadata
 from pydantic import BaseModel
 
+from src.config import PRICING_SNAPSHOT_PATH
+
 
 PRICING_PATH = os.path.join(
     os.path.dirname(__file__),
@@ -82,35 +85,117 @@ def sum_tokens(usage_list: list[UsageMetadata]) -> UsageMetadata:
         "total_tokens": total_input_tokens + total_output_tokens,
     }
 
-async def _read_model_prices() -> ModelPrices:
-    async with aio_open(PRICING_PATH, "r") as f:
-        content = await f.read()
-        model_prices = ModelPrices.model_validate_json(content)
+class PricingRegistry:
+    """
+    Model prices from `path` (the OpenRouter models list), parsed once and
+    indexed by model id, and parsed again only when the file's mtime or
+    size change. The index is also saved as a compact snapshot, loaded
+    instead of the full list by later processes while the file is unchanged.
+    """
+
+    def __init__(self, path: str, snapshot_path: str | None = None):
+        self.path = path
+        self.snapshot_path = snapshot_path
+
+        self._prices: dict[str, ModelPricing] = {}
+        self._source: list[int] | None = None
+        self._lock = threading.Lock()
+
+    def _stat(self) -> list[int]:
+        st = os.stat(self.path)
+        return [st.st_mtime_ns, st.st_size]
+
+    def _load_snapshot(self, source: list[int]) -> dict[str, ModelPricing] | None:
+        if not self.snapshot_path:
+            return None
+
+        try:
+            with open(self.snapshot_path, "r") as f:
+                snapshot = loads(f.read())
+
+            if snapshot.get("source") != source:
+                return None
+
+            return {
+                model_id: ModelPricing(**pricing)
+                for model_id, pricing in snapshot["prices"].items()
+            }
+
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save_snapshot(self, source: list[int], prices: dict[str, ModelPricing]):
+        if not self.snapshot_path:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+
+            tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+
+            with open(tmp_path, "w") as f:
+                f.write(dumps({
+                    "source": source,
+                    "prices": {model_id: p.model_dump() for model_id, p in prices.items()},
+                }))
 
-    return model_prices
+            os.replace(tmp_path, self.snapshot_path)
+
+        except OSError as e:
+            print(f"Could not save pricing snapshot: {e}")
+
+    def _load(self, source: list[int]):
+        prices = self._load_snapshot(source)
+
+        if prices is None:
+            with open(self.path, "r") as f:
+                model_prices = ModelPrices.model_validate_json(f.read())
+
+            prices = {m.id: m.pricing for m in model_prices.data}
+            self._save_snapshot(source, prices)
+
+        self._prices = prices
+        self._source = source
+
+    def get(self, model_id: str) -> ModelPricing | None:
+        source = self._stat()
+
+        if source != self._source:
+            with self._lock:
+                if source != self._source:
+                    self._load(source)
+
+        return self._prices.get(model_id)
+
+
+PRICING = PricingRegistry(PRICING_PATH, PRICING_SNAPSHOT_PATH or None)
 
 
 async def compute_cost(model_name: str, usage: UsageMetadata, openrouter: bool = True) -> UsagePrice:
-    prices = await _read_model_prices()
     _model_name = model_name
 
-    model_price = next(
-        (m for m in prices.data if m.id == _model_name),
-        None,
-    )
+    pricing = PRICING.get(_model_name)
 
-    if model_price is None:
+    if pricing is None:
         raise ValueError(f"Unknown model for pricing: {_model_name}")
 
-    input_cost = usage["input_tokens"] * model_price.pricing.prompt
+    # `input_tokens` includes the tokens read from or written to the prompt
+    # cache, which are priced separately (at the prompt price when the model
+    # has no cache prices)
+    cache_read = usage.get("input_token_details", {}).get("cache_read") or 0
+    cache_creation = usage.get("input_token_details", {}).get("cache_creation") or 0
+
+    uncached_input_tokens = max(usage["input_tokens"] - cache_read - cache_creation, 0)
+
+    input_cost = uncached_input_tokens * pricing.prompt
 
-    input_cache_read_cost = (usage.get("input_token_details", {}).get("cache_read") or 0) * (model_price.pricing.input_cache_read or 0.0)
-    input_cache_write_cost = (usage.get("input_token_details", {}).get("cache_creation") or 0) * (model_price.pricing.input_cache_write or 0.0)
+    input_cache_read_cost = cache_read * (pricing.input_cache_read or pricing.prompt)
+    input_cache_write_cost = cache_creation * (pricing.input_cache_write or pricing.prompt)
     input_cache_total_cost = input_cache_read_cost + input_cache_write_cost
 
-    output_cost = usage["output_tokens"] * model_price.pricing.completion
+    output_cost = usage["output_tokens"] * pricing.completion
 
-    total_cost = input_cost + output_cost
+    total_cost = input_cost + input_cache_total_cost + output_cost
 
     return UsagePrice(
         input_cost=input_cost,
@@ -0,0 +1,318 @@
+import math
+import os
+import re
+import threading
+from collections import Counter
+from json import dumps, loads
+
+from pydantic import BaseModel
+
+from src.docs import DDB_SITEMAP_PATH, DocEntry, DocsCache
+
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Terms in a section's headings count as if they appeared this many times
+TITLE_WEIGHT = 3
+
+SNIPPET_CHARS = 320
+
+HEADING_PATTERN = re.compile(r"^(#{1,4})\s+(.+?)\s*#*\s*$")
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+")
+FRONT_MATTER_PATTERN = re.compile(r"\A---\n.*?\n---\n", re.DOTALL)
+
+
+def tokenize(text: str) -> list[str]:
+    """Lower cased words, `string_agg` also yields `string` and `agg`."""
+    tokens: list[str] = []
+
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+
+        if "_" in token:
+            tokens += [part for part in token.split("_") if part]
+
+    return tokens
+
+
+class Section(BaseModel):
+    path: str
+    title: str
+    text: str
+
+
+def split_sections(path: str, markdown: str) -> list[Section]:
+    """Split a page on its headings, each section titled by its heading trail."""
+    markdown = FRONT_MATTER_PATTERN.sub("", markdown)
+
+    sections: list[Section] = []
+    trail: list[tuple[int, str]] = []
+    lines: list[str] = []
+
+    def flush():
+        text = "\n".join(lines).strip()
+
+        if text or trail:
+            sections.append(Section(
+                path=path,
+                title=" > ".join(title for _, title in trail) or path,
+                text=text,
+            ))
+
+    in_code = False
+
+    for line in markdown.splitlines():
+        if line.lstrip().startswith("```"):
+            in_code = not in_code
+
+        match = None if in_code else HEADING_PATTERN.match(line)
+
+        if match is None:
+            lines.append(line)
+            continue
+
+        flush()
+        lines = []
+
+        level = len(match.group(1))
+        trail = [(_level, title) for _level, title in trail if _level < level]
+        trail.append((level, match.group(2).strip()))
+
+    flush()
+
+    return sections
+
+
+class SearchHit(BaseModel):
+    path: str
+    title: str
+    score: float
+    snippet: str
+
+
+def _snippet(text: str, terms: set[str]) -> str:
+    """The window of `text` starting at the line with the most query terms."""
+    text = text.strip()
+
+    if len(text) <= SNIPPET_CHARS:
+        return text
+
+    best, best_score, offset = 0, -1, 0
+
+    for line in text.splitlines(keepends=True):
+        score = len(terms & set(tokenize(line)))
+
+        if score > best_score:
+            best, best_score = offset, score
+
+        offset += len(line)
+
+    start = max(0, min(best, len(text) - SNIPPET_CHARS))
+    snippet = text[start:start + SNIPPET_CHARS].strip()
+
+    return ("..." if start > 0 else "") + snippet + ("..." if start + SNIPPET_CHARS < len(text) else "")
+
+
+class DocSearchIndex:
+    """
+    BM25 index over the sections of the cached documentation pages. It is
+    persisted next to the docs cache and updated when cached pages change:
+    only the pages added or changed since are tokenized, and the sections
+    of the pages that went away are removed from the postings.
+    """
+
+    def __init__(self, cache: DocsCache, index_path: str):
+        self.cache = cache
+        self.index_path = index_path
+
+        self._version: str | None = None
+        # Removed sections are left as None, so the indexes stay stable
+        self._sections: list[Section | None] = []
+        self._lengths: list[int] = []
+        self._postings: dict[str, list[tuple[int, int]]] = {}
+        # content digest -> indexes of its sections
+        self._pages: dict[str, list[int]] = {}
+        self._total_length = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _cached_pages(self) -> dict[str, DocEntry]:
+        pages: dict[str, DocEntry] = {}
+
+        # One page per content, under its final path
+        for entry in sorted(self.cache.entries(), key=lambda e: e.final_path):
+            if entry.final_path == DDB_SITEMAP_PATH or entry.digest in pages:
+                continue
+
+            pages[entry.digest] = entry
+
+        return pages
+
+    def _add(self, section: Section) -> int:
+        i = len(self._sections)
+        counts = Counter(tokenize(section.text))
+
+        for token in tokenize(section.title):
+            counts[token] += TITLE_WEIGHT
+
+        self._sections.append(section)
+        self._lengths.append(sum(counts.values()))
+        self._total_length += self._lengths[i]
+        self._count += 1
+
+        for token, count in counts.items():
+            self._postings.setdefault(token, []).append((i, count))
+
+        return i
+
+    def _remove(self, i: int):
+        section = self._sections[i]
+
+        if section is None:
+            return
+
+        for token in set(tokenize(section.text)) | set(tokenize(section.title)):
+            posting = [(j, count) for j, count in self._postings.get(token, []) if j != i]
+
+            if posting:
+                self._postings[token] = posting
+
+            else:
+                self._postings.pop(token, None)
+
+        self._sections[i] = None
+        self._total_length -= self._lengths[i]
+        self._lengths[i] = 0
+        self._count -= 1
+
+    def _update(self, version: str):
+        pages = self._cached_pages()
+
+        removed = [digest for digest in self._pages if digest not in pages]
+        added = [entry for digest, entry in pages.items() if digest not in self._pages]
+
+        for digest in removed:
+            for i in self._pages.pop(digest):
+                self._remove(i)
+
+        for entry in added:
+            content = self.cache.content(entry)
+
+            if content is not None:
+                self._pages[entry.digest] = [
+                    self._add(section)
+                    for section in split_sections(entry.final_path, content)
+                ]
+
+        self._version = version
+
+        if not added and not removed:
+            return
+
+        print(f"Docs search index: {len(added)} page(s) added, {len(removed)} removed")
+
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+
+            with open(tmp_path, "w") as f:
+                f.write(dumps({
+                    "version": version,
+                    "sections": [s.model_dump() if s is not None else None for s in self._sections],
+                    "lengths": self._lengths,
+                    "postings": self._postings,
+                    "pages": self._pages,
+                }))
+
+            os.replace(tmp_path, self.index_path)
+
+        except OSError as e:
+            print(f"Could not persist docs search index: {e}")
+
+    def _load(self) -> bool:
+        try:
+            with open(self.index_path, "r") as f:
+                data = loads(f.read())
+
+        except (OSError, ValueError):
+            return False
+
+        # Indexes persisted before pages were tracked are rebuilt
+        if "pages" not in data:
+            return False
+
+        self._version = data["version"]
+        self._sections = [Section(**s) if s is not None else None for s in data["sections"]]
+        self._lengths = data["lengths"]
+        self._postings = {
+            token: [(i, count) for i, count in posting]
+            for token, posting in data["postings"].items()
+        }
+        self._pages = data["pages"]
+        self._total_length = sum(self._lengths)
+        self._count = sum(1 for s in self._sections if s is not None)
+
+        return True
+
+    def refresh(self):
+        """Make sure the index covers the pages currently cached."""
+        with self._lock:
+            version = self.cache.version()
+
+            if version == self._version:
+                return
+
+            # The persisted index is the starting point of the update, even
+            # when other pages were cached since
+            if self._version is None and self._load() and self._version == version:
+                return
+
+            self._update(version)
+
+    @property
+    def size(self) -> int:
+        return self._count
+
+    def search(self, query: str, k: int = 5) -> list[SearchHit]:
+        self.refresh()
+
+        terms = set(tokenize(query))
+
+        if not terms or not self._count:
+            return []
+
+        n = self._count
+        average_length = self._total_length / n
+        scores: dict[int, float] = {}
+
+        for term in terms:
+            posting = self._postings.get(term)
+
+            if not posting:
+                continue
+
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+
+            for i, count in posting:
+                norm = K1 * (1 - B + B * self._lengths[i] / average_length)
+                scores[i] = scores.get(i, 0.0) + idf * count * (K1 + 1) / (count + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+        hits: list[SearchHit] = []
+
+        for i, score in ranked:
+            section = self._sections[i]
+            assert section is not None
+
+            hits.append(SearchHit(
+                path=section.path,
+                title=section.title,
+                score=round(score, 2),
+                snippet=_snippet(section.text, terms),
+            ))
+
+        return hits
@@ -0,0 +1,379 @@
+import asyncio
+import hashlib
+import os
+import time
+from json import dumps
+from urllib.parse import urlsplit
+
+import httpx
+from bs4 import BeautifulSoup, SoupStrainer
+from html_to_markdown import convert
+from pydantic import BaseModel
+
+from src.instrumentation import record_call
+
+
+DDB_BASE_URL = "https://duckdb.org"
+DDB_SITEMAP_PATH = "/sitemap"
+DDB_SITEMAP_URL = f"{DDB_BASE_URL}{DDB_SITEMAP_PATH}"
+
+
+class DocsError(Exception):
+    def __init__(self, message: str, status_code: int | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def normalize_path(path: str | None) -> str:
+    """
+    `/docs/stable/sql/introduction.html`, `https://duckdb.org/docs/stable/sql/introduction/`
+    and `docs/stable/sql/introduction` -> `/docs/stable/sql/introduction`.
+    """
+    path = "/" + urlsplit((path or "").strip()).path.lstrip("/")
+
+    if path.endswith("/index.html"):
+        path = path[:-len("index.html")]
+
+    elif path.endswith(".html"):
+        path = path[:-len(".html")]
+
+    return "/" + path.strip("/")
+
+
+def to_markdown(html: str) -> str:
+    result = convert(html)
+
+    # html-to-markdown 3 returns a result object instead of the text
+    return result if isinstance(result, str) else result.content
+
+
+def _canonical_url(html: str) -> str | None:
+    # Only the <link> tags are parsed, the canonical one is all we need
+    soup = BeautifulSoup(html, "html.parser", parse_only=SoupStrainer("link"))
+    canonical = soup.find("link", rel="canonical")
+
+    if canonical is None or not canonical.get("href"):
+        return None
+
+    return str(canonical["href"])
+
+
+def _canonical_path(html: str) -> str | None:
+    url = _canonical_url(html)
+    return normalize_path(url) if url else None
+
+
+class DocEntry(BaseModel):
+    """A documentation path, pointing to the digest of its markdown content."""
+    path: str
+    final_path: str
+    digest: str
+    fetched_at: float
+
+
+class DocsCache:
+    """
+    On-disk cache of documentation pages. Pages are stored once per content
+    digest, and every path (requested, redirected or canonical) points to it.
+    """
+
+    def __init__(self, cache_dir: str, ttl_seconds: float):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+
+    def _entry_path(self, path: str) -> str:
+        key = hashlib.sha256(path.encode()).hexdigest()
+        return os.path.join(self.cache_dir, "paths", key[:2], f"{key}.json")
+
+    def _content_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, "content", digest[:2], f"{digest}.md")
+
+    def _write(self, path: str, data: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+
+        with open(tmp_path, "w") as f:
+            f.write(data)
+
+        os.replace(tmp_path, path)
+
+    def entry(self, path: str) -> DocEntry | None:
+        try:
+            with open(self._entry_path(path), "r") as f:
+                return DocEntry.model_validate_json(f.read())
+
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, entry: DocEntry) -> bool:
+        return time.time() - entry.fetched_at < self.ttl_seconds
+
+    def content(self, entry: DocEntry) -> str | None:
+        try:
+            with open(self._content_path(entry.digest), "r") as f:
+                return f.read()
+
+        except OSError:
+            return None
+
+    def get(self, path: str, allow_stale: bool = False) -> str | None:
+        entry = self.entry(path)
+
+        if entry is None or not (allow_stale or self.is_fresh(entry)):
+            return None
+
+        return self.content(entry)
+
+    def put(self, paths: set[str], final_path: str, content: str, fetched_at: float | None = None):
+        digest = hashlib.sha256(content.encode()).hexdigest()
+
+        try:
+            content_path = self._content_path(digest)
+
+            if not os.path.exists(content_path):
+                self._write(content_path, content)
+
+            for path in paths | {final_path}:
+                entry = DocEntry(
+                    path=path,
+                    final_path=final_path,
+                    digest=digest,
+                    fetched_at=fetched_at or time.time(),
+                )
+
+                self._write(self._entry_path(path), entry.model_dump_json())
+
+        except OSError as e:
+            print(f"Could not cache docs page {final_path}: {e}")
+
+    def version(self) -> str:
+        """Changes whenever a page is cached, cheap to compute."""
+        # Entries are written with `os.replace`, which updates the mtime of
+        # their directory
+        root = os.path.join(self.cache_dir, "paths")
+        parts: list[str] = []
+
+        try:
+            for name in sorted(os.listdir(root)):
+                parts.append(f"{name}:{os.stat(os.path.join(root, name)).st_mtime_ns}")
+
+        except OSError:
+            pass
+
+        return hashlib.sha256(dumps(parts).encode()).hexdigest()
+
+    def entries(self) -> list[DocEntry]:
+        entries: list[DocEntry] = []
+
+        for root, _, filenames in os.walk(os.path.join(self.cache_dir, "paths")):
+            for filename in filenames:
+                if not filename.endswith(".json"):
+                    continue
+
+                try:
+                    with open(os.path.join(root, filename), "r") as f:
+                        entries.append(DocEntry.model_validate_json(f.read()))
+
+                except (OSError, ValueError):
+                    continue
+
+        return entries
+
+
+class DocsStats(BaseModel):
+    hits: int = 0
+    fetches: int = 0
+    stale: int = 0
+
+
+class DocsClient:
+    """
+    Reads documentation pages through the cache, with one pooled HTTP client
+    per run. Stale pages are served when the site can't be reached (or
+    `offline` is set), and concurrent reads of a page share a single fetch.
+    """
+
+    def __init__(
+        self,
+        cache: DocsCache,
+        base_url: str = DDB_BASE_URL,
+        offline: bool = False,
+        timeout_seconds: float = 30,
+        max_connections: int = 8,
+    ):
+        self.cache = cache
+        self.base_url = base_url
+        self.offline = offline
+        self.timeout_seconds = timeout_seconds
+        self.max_connections = max_connections
+
+        self.stats = DocsStats()
+
+        self._client: httpx.AsyncClient | None = None
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                follow_redirects=True,
+                timeout=self.timeout_seconds,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+        self._inflight = {}
+
+    async def read(self, path: str | None = None) -> str:
+        """Markdown of the page at `path` (the sitemap by default)."""
+        # Cached under the normalized path, but requested as given
+        url = path.strip() if path and path.strip() else DDB_SITEMAP_PATH
+        path = normalize_path(url)
+
+        content = self.cache.get(path)
+
+        if content is not None:
+            self.stats.hits += 1
+            record_call(cache_hit=True)
+            return content
+
+        record_call(cache_hit=False)
+
+        if self.offline:
+            return self._stale(path, "offline mode")
+
+        task = self._inflight.get(path)
+
+        if task is None:
+            task = asyncio.create_task(self._fetch(path, url))
+            self._inflight[path] = task
+            task.add_done_callback(lambda _: self._inflight.pop(path, None))
+
+        try:
+            return await task
+
+        except httpx.TransportError as e:
+            return self._stale(path, f"{type(e).__name__}: {e}")
+
+    def _stale(self, path: str, reason: str) -> str:
+        content = self.cache.get(path, allow_stale=True)
+
+        if content is None:
+            raise DocsError(f"Page '{path}' is not cached and can't be fetched ({reason})")
+
+        self.stats.stale += 1
+        print(f"Serving cached DuckDB docs page {path} ({reason})")
+        return content
+
+    async def _fetch(self, path: str, url: str) -> str:
+        print(f"Fetching DuckDB docs page: {url}")
+        self.stats.fetches += 1
+
+        r = await self.client.get(url)
+
+        if r.status_code >= 400:
+            raise DocsError(f"Received status code {r.status_code}", r.status_code)
+
+        final_path = normalize_path(str(r.url))
+        canonical_url = _canonical_url(r.text)
+        canonical_path = normalize_path(canonical_url) if canonical_url else None
+
+        # Only refetch when the canonical page is another page
+        if canonical_path is not None and canonical_path != final_path:
+            content = self.cache.get(canonical_path)
+
+            if content is not None:
+                self.cache.put({path}, canonical_path, content)
+                return content
+
+            print(f"Fetching canonical DuckDB docs page: {canonical_url}")
+            self.stats.fetches += 1
+
+            canonical = await self.client.get(canonical_url)
+
+            if canonical.status_code < 400:
+                r = canonical
+                final_path = canonical_path
+
+        content = to_markdown(r.text)
+        self.cache.put({path}, final_path, content)
+
+        return content
+
+
+def snapshot(cache: DocsCache, mirror_dir: str) -> int:
+    """
+    Store every HTML page of a local mirror of the docs site (e.g. made
+    with `wget --mirror`) in the cache, so `read_docs` works offline.
+    Returns the number of pages stored.
+    """
+    count = 0
+
+    # path -> canonical path, for pages whose canonical page is another one
+    aliases: dict[str, str] = {}
+
+    for root, _, filenames in os.walk(mirror_dir):
+        for filename in sorted(filenames):
+            if not filename.endswith(".html"):
+                continue
+
+            file_path = os.path.join(root, filename)
+            path = normalize_path(os.path.relpath(file_path, mirror_dir))
+
+            try:
+                with open(file_path, "r", errors="replace") as f:
+                    html = f.read()
+
+            except OSError as e:
+                print(f"Could not read {file_path}: {e}")
+                continue
+
+            cache.put(set(), path, to_markdown(html))
+            count += 1
+
+            canonical_path = _canonical_path(html)
+
+            if canonical_path is not None and canonical_path != path:
+                aliases[path] = canonical_path
+
+    # Like `read_docs`, serve the canonical page when it is in the mirror
+    for path, canonical_path in aliases.items():
+        entry = cache.entry(canonical_path)
+        content = cache.content(entry) if entry else None
+
+        if content is not None:
+            cache.put({path}, canonical_path, content)
+
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from src.config import DOCS_CACHE_DIR, DOCS_CACHE_TTL_SECONDS
+
+    parser = argparse.ArgumentParser(description="DuckDB docs cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    snapshot_parser = subparsers.add_parser(
+        "snapshot",
+        help="Pre-populate the docs cache from a local mirror of the docs site",
+    )
+    snapshot_parser.add_argument("mirror_dir")
+
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        _count = snapshot(DocsCache(DOCS_CACHE_DIR, DOCS_CACHE_TTL_SECONDS), args.mirror_dir)
+        print(f"Cached {_count} DuckDB docs pages from {args.mirror_dir} in {DOCS_CACHE_DIR}")
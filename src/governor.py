@@ -0,0 +1,345 @@
+import fcntl
+import os
+import threading
+import time
+from contextlib import contextmanager
+from json import dumps
+from typing import Callable, Iterator
+
+import duckdb
+from pydantic import BaseModel
+
+
+# Minimum slice of a run, however many runs share the budget
+MIN_MEMORY_BYTES = 256 * 1024 * 1024
+MIN_TEMP_BYTES = 1024 * 1024 * 1024
+
+# How often queries check whether runs started or finished elsewhere
+REBALANCE_INTERVAL_SECONDS = 1.0
+
+USAGE_SQL = """
+SELECT
+    (SELECT coalesce(sum(memory_usage_bytes), 0) FROM duckdb_memory()),
+    (SELECT coalesce(sum(size), 0) FROM duckdb_temporary_files())
+"""
+
+
+class ResourceShare(BaseModel):
+    """The slice of the global budget a run's DuckDB session may use."""
+    runs: int
+    threads: int
+    memory_bytes: int
+    temp_bytes: int
+
+
+class QueryUsage(BaseModel):
+    """
+    Peaks sampled while a query ran. They are database wide, so queries of
+    the run running at the same time are counted together.
+    """
+    sql: str
+    seconds: float
+    peak_memory_bytes: int
+    peak_temp_bytes: int
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+
+    except ProcessLookupError:
+        return False
+
+    except PermissionError:
+        pass
+
+    return True
+
+
+class ResourceGovernor:
+    """
+    Splits a global budget of threads, memory and temp directory space
+    between the runs active on the machine, registered as one file per
+    process under `directory`. Every run applies its share to its DuckDB
+    session on connect, and again before queries when runs started or
+    finished since. Entries of processes that died are ignored.
+
+    The memory and temp files of the database are sampled by one thread per
+    run, on its own cursor, while queries registered by `monitor` run.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        run_id: str,
+        threads: int,
+        memory_bytes: int,
+        temp_bytes: int,
+        interval_seconds: float,
+        enabled: bool = True,
+    ):
+        self.directory = directory
+        self.run_id = run_id
+        self.threads = threads
+        self.memory_bytes = memory_bytes
+        self.temp_bytes = temp_bytes
+        self.interval_seconds = interval_seconds
+        self.enabled = enabled
+
+        self.shares: list[ResourceShare] = []
+        self.queries: list[QueryUsage] = []
+
+        self._registered = False
+        self._applied: ResourceShare | None = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+        # Peaks [memory, temp, samples] of the queries running, by query
+        self._running: dict[int, list[int]] = {}
+        self._next_query = 0
+        self._wake = threading.Condition(self._lock)
+        self._sampler: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._probe: duckdb.DuckDBPyConnection | None = None
+        # The probe cursor is shared by the sampler and `monitor`
+        self._probe_lock = threading.Lock()
+
+    @property
+    def _entry_path(self) -> str:
+        return os.path.join(self.directory, f"{os.getpid()}.json")
+
+    @contextmanager
+    def _registry(self) -> Iterator[None]:
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(os.path.join(self.directory, "registry.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                yield
+
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _active_runs(self) -> int:
+        runs = 0
+
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+
+            pid = int(name.removesuffix(".json")) if name.removesuffix(".json").isdigit() else None
+
+            if pid is not None and _alive(pid):
+                runs += 1
+
+            else:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+
+                except OSError:
+                    pass
+
+        return runs
+
+    def register(self):
+        """Count this run in the budget, from now until `release`."""
+        if not self.enabled:
+            return
+
+        try:
+            with self._registry():
+                with open(self._entry_path, "w") as f:
+                    f.write(dumps({"run_id": self.run_id, "pid": os.getpid(), "started_at": time.time()}))
+
+            self._registered = True
+
+        except OSError as e:
+            print(f"Could not register run with the resource governor: {e}")
+
+        # Applied on connect, or before the next query
+        self._checked_at = 0.0
+
+    def release(self):
+        """Give this run's share back to the other runs."""
+        if not self._registered:
+            return
+
+        try:
+            with self._registry():
+                os.remove(self._entry_path)
+
+        except OSError:
+            pass
+
+        self._registered = False
+        self._applied = None
+
+    def share(self) -> ResourceShare:
+        runs = 1
+
+        if self._registered:
+            try:
+                with self._registry():
+                    runs = max(self._active_runs(), 1)
+
+            except OSError as e:
+                print(f"Could not read the resource governor registry: {e}")
+
+        return ResourceShare(
+            runs=runs,
+            threads=max(self.threads // runs, 1),
+            memory_bytes=max(self.memory_bytes // runs, MIN_MEMORY_BYTES),
+            temp_bytes=max(self.temp_bytes // runs, MIN_TEMP_BYTES),
+        )
+
+    def apply(self, con: duckdb.DuckDBPyConnection, force: bool = True):
+        """Set the run's share on the session of `con`, an `on_connect` hook."""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+
+            if not force and now - self._checked_at < REBALANCE_INTERVAL_SECONDS:
+                return
+
+            self._checked_at = now
+            share = self.share()
+
+            if not force and share == self._applied:
+                return
+
+            con.execute(f"SET GLOBAL threads = {share.threads}")
+            con.execute(f"SET GLOBAL memory_limit = '{share.memory_bytes}B'")
+            con.execute(f"SET GLOBAL max_temp_directory_size = '{share.temp_bytes}B'")
+
+            self._applied = share
+            self.shares.append(share)
+
+        print(
+            f"DuckDB resources for {share.runs} active run(s): {share.threads} threads, "
+            f"{share.memory_bytes / 1024 ** 2:.0f} MiB memory, {share.temp_bytes / 1024 ** 3:.1f} GiB temp"
+        )
+
+    def _sample(self, probe: duckdb.DuckDBPyConnection, queries: list[list[int]] | None = None):
+        """Add a sample to the peaks of `queries`, all the running ones by default."""
+        try:
+            with self._probe_lock:
+                memory, temp = probe.execute(USAGE_SQL).fetchone()  # type: ignore
+
+        except duckdb.Error:
+            return
+
+        with self._lock:
+            for peaks in queries if queries is not None else self._running.values():
+                peaks[0] = max(peaks[0], memory)
+                peaks[1] = max(peaks[1], temp)
+                peaks[2] += 1
+
+    def _poll(self, probe: duckdb.DuckDBPyConnection, stop: threading.Event):
+        while not stop.is_set():
+            with self._wake:
+                # Idle between queries
+                self._wake.wait_for(lambda: self._running or stop.is_set())
+
+            if stop.is_set():
+                return
+
+            self._sample(probe)
+            stop.wait(self.interval_seconds)
+
+    @contextmanager
+    def monitor(self, cursor: Callable[[], duckdb.DuckDBPyConnection], sql: str) -> Iterator[None]:
+        """
+        Rebalance if needed, then sample the memory and temp files of the
+        database while the wrapped query runs. The sampler is started on the
+        first query of the run, on a cursor of its own.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        with self._lock:
+            if self._sampler is None:
+                self._probe = cursor()
+                self._stop = threading.Event()
+                self._sampler = threading.Thread(
+                    target=self._poll,
+                    args=(self._probe, self._stop),
+                    name="duckdb-governor-sampler",
+                    daemon=True,
+                )
+                self._sampler.start()
+
+            probe = self._probe
+            assert probe is not None
+
+        try:
+            with self._probe_lock:
+                self.apply(probe, force=False)
+
+        except duckdb.Error as e:
+            print(f"Could not apply DuckDB resource share: {e}")
+
+        peaks = [0, 0, 0]
+
+        with self._wake:
+            query = self._next_query
+            self._next_query += 1
+            self._running[query] = peaks
+            self._wake.notify()
+
+        started = time.perf_counter()
+
+        try:
+            yield
+
+        finally:
+            with self._lock:
+                del self._running[query]
+
+            # Queries shorter than the interval may not have been sampled
+            if peaks[2] == 0:
+                self._sample(probe, [peaks])
+
+            with self._lock:
+                self.queries.append(QueryUsage(
+                    sql=sql,
+                    seconds=round(time.perf_counter() - started, 3),
+                    peak_memory_bytes=peaks[0],
+                    peak_temp_bytes=peaks[1],
+                ))
+
+    def close(self):
+        """Stop the sampler and close its cursor, before the session is closed."""
+        with self._wake:
+            sampler, probe = self._sampler, self._probe
+            self._sampler, self._probe = None, None
+
+            self._stop.set()
+            self._wake.notify_all()
+
+        if sampler is not None:
+            sampler.join()
+
+        if probe is not None:
+            probe.close()
+
+    def reset(self):
+        self.shares = []
+        self.queries = []
+
+    def summary(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "budget": {
+                "threads": self.threads,
+                "memory_bytes": self.memory_bytes,
+                "temp_bytes": self.temp_bytes,
+            },
+            "shares": [s.model_dump() for s in self.shares],
+            "peak_memory_bytes": max((q.peak_memory_bytes for q in self.queries), default=0),
+            "peak_temp_bytes": max((q.peak_temp_bytes for q in self.queries), default=0),
+            "queries": [q.model_dump() for q in self.queries],
+        }
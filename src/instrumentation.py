@@ -0,0 +1,149 @@
+import functools
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Callable
+
+from langchain_core.tools import BaseTool, StructuredTool
+from pydantic import BaseModel
+
+
+# Same ratio as langchain's `count_tokens_approximately`
+CHARS_PER_TOKEN = 4.0
+
+# Tools report failures as text rather than raising
+ERROR_PREFIX = "Error"
+
+
+class ToolCallRecord(BaseModel):
+    """
+    One tool invocation, as written to the `tool_calls` array of the run
+    output. Fields a tool doesn't report stay None.
+    """
+    index: int
+    tool: str
+    started_at: str
+    wall_seconds: float = 0.0
+    # Process CPU time, including DuckDB's threads and overlapping calls
+    cpu_seconds: float = 0.0
+    # Planner estimate of the rows read, for SQL
+    rows_scanned: int | None = None
+    rows_returned: int | None = None
+    output_bytes: int = 0
+    output_tokens_approx: int = 0
+    cache_hit: bool | None = None
+    error: str | None = None
+
+
+_current_call: ContextVar[ToolCallRecord | None] = ContextVar("current_tool_call", default=None)
+
+
+def record_call(**fields: Any):
+    """
+    Add details to the tool call being run, if any. The record lives in a
+    context variable, so it reaches executor threads started with
+    `contextvars.copy_context().run`.
+    """
+    record = _current_call.get()
+
+    if record is None:
+        return
+
+    for name, value in fields.items():
+        setattr(record, name, value)
+
+
+class ToolCallLog:
+    """Records of the tool calls of a run, in the order they started."""
+
+    def __init__(self):
+        self.records: list[ToolCallRecord] = []
+        self._lock = threading.Lock()
+
+    def _start(self, tool: str) -> ToolCallRecord:
+        with self._lock:
+            record = ToolCallRecord(
+                index=len(self.records),
+                tool=tool,
+                started_at=datetime.now(timezone.utc).isoformat(),
+            )
+            self.records.append(record)
+
+        return record
+
+    def _finish(self, record: ToolCallRecord, output: Any, wall: float, cpu: float):
+        text = output if isinstance(output, str) else str(output)
+
+        record.wall_seconds = round(wall, 4)
+        record.cpu_seconds = round(cpu, 4)
+        record.output_bytes = len(text.encode())
+        record.output_tokens_approx = round(len(text) / CHARS_PER_TOKEN)
+
+        if record.error is None and text.startswith(ERROR_PREFIX):
+            record.error = text.splitlines()[0][:200]
+
+    def instrument(self, tool: BaseTool) -> BaseTool:
+        """A copy of `tool` recording every call it runs."""
+        if not isinstance(tool, StructuredTool):
+            return tool
+
+        update: dict[str, Callable] = {}
+
+        if tool.coroutine is not None:
+            coroutine = tool.coroutine
+
+            @functools.wraps(coroutine)
+            async def arun(*args, **kwargs):
+                record = self._start(tool.name)
+                token = _current_call.set(record)
+                wall, cpu = time.perf_counter(), time.process_time()
+                output: Any = None
+
+                try:
+                    output = await coroutine(*args, **kwargs)
+                    return output
+
+                except Exception as e:
+                    record.error = f"{type(e).__name__}: {e}"[:200]
+                    raise
+
+                finally:
+                    _current_call.reset(token)
+                    self._finish(record, output or "", time.perf_counter() - wall, time.process_time() - cpu)
+
+            update["coroutine"] = arun
+
+        if tool.func is not None:
+            func = tool.func
+
+            @functools.wraps(func)
+            def run(*args, **kwargs):
+                record = self._start(tool.name)
+                token = _current_call.set(record)
+                wall, cpu = time.perf_counter(), time.process_time()
+                output: Any = None
+
+                try:
+                    output = func(*args, **kwargs)
+                    return output
+
+                except Exception as e:
+                    record.error = f"{type(e).__name__}: {e}"[:200]
+                    raise
+
+                finally:
+                    _current_call.reset(token)
+                    self._finish(record, output or "", time.perf_counter() - wall, time.process_time() - cpu)
+
+            update["func"] = run
+
+        return tool.model_copy(update=update)
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+
+    def dump(self) -> list[dict]:
+        with self._lock:
+            return [record.model_dump() for record in self.records]
@@ -0,0 +1,322 @@
+import os
+import threading
+
+import duckdb
+from pydantic import BaseModel
+
+
+NUMERIC_TYPES = (
+    "TINYINT",
+    "SMALLINT",
+    "INTEGER",
+    "BIGINT",
+    "HUGEINT",
+    "UTINYINT",
+    "USMALLINT",
+    "UINTEGER",
+    "UBIGINT",
+    "FLOAT",
+    "DOUBLE",
+    "DECIMAL",
+)
+
+TEMPORAL_TYPES = ("DATE", "TIMESTAMP")
+
+
+class ColumnMetadata(BaseModel):
+    name: str
+    type: str
+
+    min: str | None = None
+    max: str | None = None
+    null_count: int | None = None
+
+
+class FileMetadata(BaseModel):
+    """What the parquet footer tells about a file, keyed by its mtime/size."""
+    path: str
+    mtime_ns: int
+    size: int
+
+    num_rows: int
+    num_row_groups: int
+    columns: list[ColumnMetadata]
+
+    # Min/max of the first date or timestamp column
+    date_column: str | None = None
+    date_range: tuple[str, str] | None = None
+
+    def describe(self) -> str:
+        text = f"{self.num_rows} rows, {len(self.columns)} columns, {self.num_row_groups} row groups"
+
+        if self.date_range is not None:
+            text += f", {self.date_column} from {self.date_range[0]} to {self.date_range[1]}"
+
+        return text
+
+    def describe_columns(self) -> str:
+        lines = []
+
+        for column in self.columns:
+            line = f"  - {column.name} {column.type}"
+
+            if column.min is not None or column.max is not None:
+                line += f" [min: {column.min}, max: {column.max}]"
+
+            if column.null_count:
+                line += f" ({column.null_count} nulls)"
+
+            lines.append(line)
+
+        return "\n".join(lines)
+
+
+class ParquetIndexData(BaseModel):
+    files: dict[str, FileMetadata] = {}
+
+
+def _is_numeric(column_type: str) -> bool:
+    return column_type.upper().startswith(NUMERIC_TYPES)
+
+
+def _merge(current: str | None, value: str | None, column_type: str, pick) -> str | None:
+    if value is None:
+        return current
+
+    if current is None:
+        return value
+
+    if _is_numeric(column_type):
+        try:
+            return pick(current, value, key=float)
+
+        except ValueError:
+            return current
+
+    # Dates, timestamps and strings compare lexicographically
+    return pick(current, value)
+
+
+def read_footer(path: str) -> FileMetadata:
+    """Build the metadata of `path` from its footer, without reading any data page."""
+    st = os.stat(path)
+
+    con = duckdb.connect()
+
+    try:
+        num_rows, num_row_groups = con.execute(
+            "SELECT num_rows, num_row_groups FROM parquet_file_metadata(?)",
+            [path],
+        ).fetchone()  # type: ignore
+
+        types = {
+            name: column_type
+            for (name, column_type, *_) in con.execute(
+                "DESCRIBE SELECT * FROM read_parquet(?)",
+                [path],
+            ).fetchall()
+        }
+
+        stats = con.execute(
+            "SELECT path_in_schema, stats_min_value, stats_max_value, stats_null_count "
+            "FROM parquet_metadata(?) ORDER BY row_group_id",
+            [path],
+        ).fetchall()
+
+    finally:
+        con.close()
+
+    columns = {name: ColumnMetadata(name=name, type=column_type) for name, column_type in types.items()}
+
+    for name, min_value, max_value, null_count in stats:
+        column = columns.get(name)
+
+        if column is None:
+            continue
+
+        column.min = _merge(column.min, min_value, column.type, min)
+        column.max = _merge(column.max, max_value, column.type, max)
+
+        if null_count is not None:
+            column.null_count = (column.null_count or 0) + null_count
+
+    date_column = next(
+        (c for c in columns.values() if c.type.upper().startswith(TEMPORAL_TYPES)),
+        None,
+    )
+
+    return FileMetadata(
+        path=path,
+        mtime_ns=st.st_mtime_ns,
+        size=st.st_size,
+        num_rows=num_rows,
+        num_row_groups=num_row_groups,
+        columns=list(columns.values()),
+        date_column=date_column.name if date_column else None,
+        date_range=(
+            (date_column.min, date_column.max)
+            if date_column and date_column.min is not None and date_column.max is not None
+            else None
+        ),
+    )
+
+
+class ParquetIndex:
+    """
+    Footer metadata of the parquet files, cached in memory and on disk and
+    refreshed when a file's mtime or size changes.
+    """
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+
+        self._data: ParquetIndexData | None = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> ParquetIndexData:
+        if self._data is None:
+            try:
+                with open(self.index_path, "r") as f:
+                    self._data = ParquetIndexData.model_validate_json(f.read())
+
+            except (OSError, ValueError):
+                self._data = ParquetIndexData()
+
+        return self._data
+
+    def _save(self, data: ParquetIndexData):
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+
+            with open(tmp_path, "w") as f:
+                f.write(data.model_dump_json())
+
+            os.replace(tmp_path, self.index_path)
+
+        except OSError as e:
+            print(f"Could not persist parquet index: {e}")
+
+    def get(self, path: str, st: os.stat_result | None = None) -> FileMetadata | None:
+        """Metadata of the parquet file at `path`, None if it can't be read."""
+        path = os.path.abspath(path)
+
+        with self._lock:
+            data = self._load()
+
+            try:
+                st = st or os.stat(path)
+
+            except OSError:
+                return None
+
+            entry = data.files.get(path)
+
+            if entry is not None and entry.mtime_ns == st.st_mtime_ns and entry.size == st.st_size:
+                return entry
+
+            try:
+                entry = read_footer(path)
+
+            except duckdb.Error as e:
+                print(f"Could not read parquet footer of {path}: {e}")
+                return None
+
+            data.files[path] = entry
+            self._save(data)
+
+            return entry
+
+
+class DataFile(BaseModel):
+    path: str
+    rel_path: str
+    filename: str
+    size: int
+
+    metadata: FileMetadata | None = None
+
+
+class DirectoryListing:
+    """
+    Files under `root`, with the parquet footer metadata, re-walked only
+    when one of the directories or the (mtime, size) of one of the files
+    changes (or after `invalidate()`). Files overwritten in place, e.g. by a
+    `COPY ... TO` the same path, don't change the mtime of their directory.
+    """
+
+    def __init__(self, root: str, index: ParquetIndex):
+        self.root = root
+        self.index = index
+
+        self._dirs: dict[str, int] = {}
+        # path -> (mtime_ns, size), like the entries of `ParquetIndex`
+        self._stats: dict[str, tuple[int, int]] = {}
+        self._files: list[DataFile] = []
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._dirs = {}
+
+    def _is_fresh(self) -> bool:
+        if not self._dirs:
+            return False
+
+        for path, mtime_ns in self._dirs.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime_ns:
+                    return False
+
+            except OSError:
+                return False
+
+        for path, (mtime_ns, size) in self._stats.items():
+            try:
+                st = os.stat(path)
+
+            except OSError:
+                return False
+
+            if st.st_mtime_ns != mtime_ns or st.st_size != size:
+                return False
+
+        return True
+
+    def files(self) -> list[DataFile]:
+        with self._lock:
+            if self._is_fresh():
+                return self._files
+
+            dirs: dict[str, int] = {}
+            stats: dict[str, tuple[int, int]] = {}
+            files: list[DataFile] = []
+
+            for root, _, filenames in os.walk(self.root):
+                dirs[root] = os.stat(root).st_mtime_ns
+
+                for filename in sorted(filenames):
+                    path = os.path.join(root, filename)
+
+                    try:
+                        st = os.stat(path)
+
+                    except OSError:
+                        continue
+
+                    stats[path] = (st.st_mtime_ns, st.st_size)
+
+                    files.append(DataFile(
+                        path=path,
+                        rel_path=os.path.relpath(path, os.path.join(self.root, "..")),
+                        filename=filename,
+                        size=st.st_size,
+                        metadata=self.index.get(path, st) if filename.lower().endswith(".parquet") else None,
+                    ))
+
+            self._dirs = dirs
+            self._stats = stats
+            self._files = files
+
+            return files
@@ -0,0 +1,297 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Collection, Iterable
+
+import duckdb
+from langchain.agents.middleware import AgentMiddleware, AgentState
+from langchain_core.messages import AIMessage, ToolMessage
+from pydantic import BaseModel
+
+from src.docs import DocsClient, normalize_path
+from src.parquet_index import DirectoryListing
+from src.result_cache import parse_statements, referenced_sources
+from src.session import DuckDBSession, QueryHandle
+
+
+# Documentation pages mentioned in tool outputs, e.g. by `search_docs`
+DOCS_PATH_PATTERN = re.compile(r"(?:https?://duckdb\.org|(?<![\w/.]))(/docs/[\w./-]+)")
+
+# Probes cheap enough to run for every file backed table the next step may
+# query (the row count is read from the parquet footers), with the same
+# result cache keys as the agent running them
+PROBES = (
+    "DESCRIBE {table}",
+    "SELECT count(*) FROM {table}",
+)
+
+
+class PrefetchStats(BaseModel):
+    rounds: int = 0
+    # Jobs not started because the model answered first
+    skipped: int = 0
+    sessions_opened: int = 0
+    footers: int = 0
+    warmed_bytes: int = 0
+    docs_fetched: int = 0
+    probes: int = 0
+    failed: int = 0
+    busy_seconds: float = 0.0
+
+
+def tables_of(sqls: Iterable[str]) -> list[str]:
+    """Tables and views the statements of `sqls` read, in order."""
+    tables: list[str] = []
+
+    for sql in sqls:
+        for statement in parse_statements(sql) or []:
+            for table in sorted(referenced_sources(statement)[1]):
+                if table not in tables:
+                    tables.append(table)
+
+    return tables
+
+
+def docs_paths_of(texts: Iterable[str]) -> list[str]:
+    """Documentation paths mentioned in `texts`, in order."""
+    paths: list[str] = []
+
+    for text in texts:
+        for match in DOCS_PATH_PATTERN.finditer(text):
+            path = normalize_path(match.group(1).rstrip("."))
+
+            if path not in paths:
+                paths.append(path)
+
+    return paths
+
+
+class Prefetcher:
+    """
+    Uses the time the agent waits on the model to warm what the next tool
+    calls are likely to need: the DuckDB session, the parquet footers and
+    the OS page cache of the data files (once per run), the documentation
+    pages mentioned by the previous step, and cheap read-only probes
+    (schema, row count) of the tables it queried, run through `run_sql` so
+    their results land in the result cache. Only the tables of
+    `file_sources` (views over data files) are probed, as the row count of
+    other tables and views can take a full scan.
+
+    `start` is called before a model call and `stop` once it returned: jobs
+    not started by then are skipped and the running probe is interrupted,
+    so tools never wait on prefetching.
+    """
+
+    def __init__(
+        self,
+        session: DuckDBSession,
+        listing: DirectoryListing,
+        docs: DocsClient,
+        run_sql: Callable[[str, QueryHandle], Any],
+        file_sources: Callable[[], Collection[str]],
+        default_tables: list[str],
+        warm_max_bytes: int,
+        max_docs: int,
+        max_tables: int,
+        enabled: bool = True,
+    ):
+        self.session = session
+        self.listing = listing
+        self.docs = docs
+        self.run_sql = run_sql
+        self.file_sources = file_sources
+        self.default_tables = default_tables
+        self.warm_max_bytes = warm_max_bytes
+        self.max_docs = max_docs
+        self.max_tables = max_tables
+        self.enabled = enabled
+
+        self.stats = PrefetchStats()
+
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="agent-ctx-prefetch")
+        self._warmed: set[str] = set()
+        self._stop = threading.Event()
+        self._task: asyncio.Task | None = None
+        self._handle: QueryHandle | None = None
+
+    def reset(self):
+        self.stats = PrefetchStats()
+        self._warmed = set()
+
+    def start(self, texts: Iterable[str] = (), sqls: Iterable[str] = ()):
+        """
+        Prefetch in the background for the step following the one that
+        produced `texts` (tool outputs) and ran `sqls`.
+        """
+        if not self.enabled:
+            return
+
+        self.stop()
+
+        self._stop = threading.Event()
+        self._task = asyncio.create_task(self._run(list(texts), list(sqls), self._stop))
+
+    def stop(self):
+        """Don't start more jobs and interrupt the running probe."""
+        self._stop.set()
+
+        handle = self._handle
+
+        if handle is not None:
+            handle.cancel()
+
+    async def aclose(self):
+        """Stop and wait for the running jobs, before the session is closed."""
+        self.stop()
+
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, texts: list[str], sqls: list[str], stop: threading.Event):
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+
+        self.stats.rounds += 1
+
+        file_sources = self.file_sources()
+
+        tables = [
+            table
+            for table in tables_of(sqls) or self.default_tables
+            if table in file_sources
+        ][:self.max_tables]
+
+        await asyncio.gather(
+            loop.run_in_executor(self._executor, self._warm, stop),
+            loop.run_in_executor(self._executor, self._probe, tables, stop),
+            self._fetch_docs(docs_paths_of(texts)[:self.max_docs], stop),
+            return_exceptions=True,
+        )
+
+        self.stats.busy_seconds += time.perf_counter() - started
+
+    def _warm(self, stop: threading.Event):
+        if stop.is_set():
+            self.stats.skipped += 1
+            return
+
+        try:
+            if not self.session.is_open:
+                self.session.open()
+                self.stats.sessions_opened += 1
+
+            # Parquet footers are read once and kept in the index
+            files = self.listing.files()
+
+        except Exception as e:
+            print(f"Prefetch could not open the DuckDB session: {e}")
+            self.stats.failed += 1
+            return
+
+        self.stats.footers = sum(1 for file in files if file.metadata is not None)
+
+        # Only asks the kernel to read ahead, it doesn't block on the reads
+        if not hasattr(os, "posix_fadvise"):
+            return
+
+        for file in files:
+            if file.metadata is None or file.path in self._warmed:
+                continue
+
+            if self.stats.warmed_bytes + file.size > self.warm_max_bytes:
+                break
+
+            try:
+                fd = os.open(file.path, os.O_RDONLY)
+
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+
+                finally:
+                    os.close(fd)
+
+            except OSError:
+                continue
+
+            self._warmed.add(file.path)
+            self.stats.warmed_bytes += file.size
+
+    def _probe(self, tables: list[str], stop: threading.Event):
+        for table in tables:
+            for probe in PROBES:
+                # Set before checking `stop`, which interrupts it
+                self._handle = handle = QueryHandle()
+
+                if stop.is_set():
+                    self.stats.skipped += 1
+                    return
+
+                try:
+                    self.run_sql(probe.format(table=table), handle)
+                    self.stats.probes += 1
+
+                except duckdb.InterruptException:
+                    self.stats.skipped += 1
+                    return
+
+                except Exception as e:
+                    # e.g. a table dropped since, the agent will find out itself
+                    print(f"Prefetch probe on {table} failed: {e}")
+                    self.stats.failed += 1
+                    break
+
+    async def _fetch_docs(self, paths: list[str], stop: threading.Event):
+        for path in paths:
+            if stop.is_set():
+                self.stats.skipped += 1
+                return
+
+            if self.docs.cache.get(path) is not None:
+                continue
+
+            try:
+                await self.docs.read(path)
+                self.stats.docs_fetched += 1
+
+            except Exception as e:
+                print(f"Prefetch could not fetch docs page {path}: {e}")
+                self.stats.failed += 1
+
+
+class PrefetchMiddleware(AgentMiddleware):
+    """Runs a `Prefetcher` during the model calls of a `create_agent` loop."""
+
+    def __init__(self, prefetcher: Prefetcher):
+        super().__init__()
+
+        self.prefetcher = prefetcher
+
+    async def abefore_model(self, state: AgentState, runtime: Any) -> dict[str, Any] | None:
+        texts: list[str] = []
+        sqls: list[str] = []
+
+        # The tool outputs of the last step, and the SQL its calls ran
+        for message in reversed(state["messages"]):
+            if isinstance(message, ToolMessage):
+                texts.append(str(message.content))
+
+            elif isinstance(message, AIMessage):
+                sqls = [
+                    call["args"]["sql"]
+                    for call in message.tool_calls
+                    if isinstance(call["args"].get("sql"), str)
+                ]
+                break
+
+        self.prefetcher.start(texts, sqls)
+
+        return None
+
+    async def aafter_model(self, state: AgentState, runtime: Any) -> dict[str, Any] | None:
+        self.prefetcher.stop()
+
+        return None
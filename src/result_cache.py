@@ -0,0 +1,506 @@
+import glob
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from json import dumps
+from typing import Literal
+
+import sqlglot
+from pydantic import BaseModel
+from sqlglot import exp
+
+from src.results import QueryResult
+from src.spill import SpilledResult
+
+
+# Spilled results refer to a view of the session, they are only kept in memory
+CachedResult = QueryResult | SpilledResult
+
+
+# Statements whose result only depends on their inputs
+READ_ONLY_STATEMENTS = (exp.Query, exp.Describe, exp.Summarize)
+
+# Statements that only read the catalog, they are cheap and never cached
+CATALOG_STATEMENTS = (exp.Show, exp.Pragma)
+
+VOLATILE_FUNCTIONS = (
+    exp.Rand,
+    exp.Randn,
+    exp.Uuid,
+    exp.CurrentDate,
+    exp.CurrentTime,
+    exp.CurrentTimestamp,
+)
+
+VOLATILE_FUNCTION_NAMES = {
+    "now",
+    "random",
+    "setseed",
+    "nextval",
+    "currval",
+    "gen_random_uuid",
+    "get_current_time",
+    "get_current_timestamp",
+    "glob",
+}
+
+REMOTE_PATH_MARKER = "://"
+
+
+class CacheKey(BaseModel):
+    digest: str
+
+    # Only results that depend on files alone may be shared across runs
+    persistent: bool
+
+
+class CacheStats(BaseModel):
+    memory_hits: int = 0
+    disk_hits: int = 0
+    # First hits on results computed by prefetching, not counted in `hits`
+    prefetched_hits: int = 0
+    misses: int = 0
+    bypassed: int = 0
+    invalidations: int = 0
+    evictions: int = 0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    def model_dump(self, **kwargs):
+        data = super().model_dump(**kwargs)
+        data["hits"] = self.hits
+        return data
+
+
+def parse_statements(sql: str) -> list[exp.Expression] | None:
+    try:
+        return [
+            statement
+            for statement in sqlglot.parse(sql, read="duckdb")
+            if statement is not None
+        ]
+
+    except sqlglot.errors.SqlglotError:
+        return None
+
+
+def is_read_only(statements: list[exp.Expression]) -> bool:
+    return all(isinstance(s, READ_ONLY_STATEMENTS) for s in statements)
+
+
+def is_catalog_read(statements: list[exp.Expression]) -> bool:
+    return all(isinstance(s, CATALOG_STATEMENTS) for s in statements)
+
+
+def is_volatile(statement: exp.Expression) -> bool:
+    for func in statement.find_all(exp.Func):
+        if isinstance(func, VOLATILE_FUNCTIONS):
+            return True
+
+        if isinstance(func, exp.Anonymous) and func.name.lower() in VOLATILE_FUNCTION_NAMES:
+            return True
+
+    return False
+
+
+def written_tables(statement: exp.Expression) -> set[str]:
+    """Tables and views created, replaced, changed, renamed or dropped by `statement`."""
+    if isinstance(statement, READ_ONLY_STATEMENTS):
+        return set()
+
+    # `COPY trips TO 'file'` only reads it, unlike `COPY trips FROM 'file'`
+    if isinstance(statement, exp.Copy) and not statement.args.get("kind"):
+        return set()
+
+    target = statement.this
+
+    if isinstance(statement, exp.Drop):
+        tables = list(statement.args.get("tables") or [])
+
+    elif isinstance(target, exp.Expression):
+        tables = [target] if isinstance(target, exp.Table) else [target.find(exp.Table)]
+
+    else:
+        tables = []
+
+    # `ALTER TABLE t RENAME TO trips`
+    tables += [rename.this for rename in statement.find_all(exp.AlterRename)]
+
+    return {table.name.lower() for table in tables if isinstance(table, exp.Table) and table.name}
+
+
+def _file_literal(identifier: exp.Expression) -> str | None:
+    # `FROM 'data/file.parquet'` is parsed as a quoted table identifier
+    if isinstance(identifier, exp.Identifier) and identifier.quoted:
+        name = identifier.name
+
+        if "." in name or "/" in name:
+            return name
+
+    return None
+
+
+def referenced_sources(statement: exp.Expression) -> tuple[set[str], set[str]]:
+    """
+    Return the file paths/globs and the catalog tables read by `statement`.
+    CTE names are not reported as tables.
+    """
+    files: set[str] = set()
+    tables: set[str] = set()
+
+    ctes = {cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE)}
+
+    for table in statement.find_all(exp.Table):
+        source = table.this
+
+        path = _file_literal(source)
+
+        if path is not None:
+            files.add(path)
+            continue
+
+        if isinstance(source, exp.Func):
+            # Table functions, e.g. `read_parquet(['a.parquet', 'b.parquet'])`
+            for literal in source.find_all(exp.Literal):
+                if literal.is_string:
+                    files.add(literal.this)
+
+            continue
+
+        name = table.name.lower()
+
+        if name and name not in ctes:
+            tables.add(".".join(p.name.lower() for p in table.parts))
+
+    return files, tables
+
+
+def canonicalize(statement: exp.Expression) -> str:
+    """
+    Canonical SQL for `statement`: identifiers are lower cased, formatting
+    is normalized and table aliases are renamed positionally, so queries
+    that only differ in those produce the same text.
+    """
+    statement = statement.copy()
+    aliases: dict[str, str] = {}
+
+    for node in statement.find_all(exp.Table, exp.Subquery):
+        alias = node.args.get("alias")
+
+        if not isinstance(alias, exp.TableAlias) or not alias.name:
+            continue
+
+        name = alias.name.lower()
+        aliases.setdefault(name, f"_t{len(aliases)}")
+
+        alias.set("this", exp.to_identifier(aliases[name]))
+
+    for column in statement.find_all(exp.Column):
+        qualifier = column.args.get("table")
+
+        if isinstance(qualifier, exp.Identifier) and qualifier.name.lower() in aliases:
+            column.set("table", exp.to_identifier(aliases[qualifier.name.lower()]))
+
+    return statement.sql(dialect="duckdb", normalize=True)
+
+
+def output_columns(statement: exp.Expression) -> list[str]:
+    """
+    The select expressions of `statement` as they name the result columns,
+    with the case `canonicalize` loses (`AS Total` vs `AS total`).
+    """
+    if not isinstance(statement, exp.Query):
+        return []
+
+    return [
+        e.alias_or_name if isinstance(e, (exp.Alias, exp.Column)) else e.sql(dialect="duckdb")
+        for e in statement.selects
+    ]
+
+
+def fingerprint_files(patterns: set[str]) -> list[tuple[str, int, int]] | None:
+    """(path, mtime_ns, size) of every file matched by `patterns`, None for remote files."""
+    fingerprints: list[tuple[str, int, int]] = []
+
+    for pattern in sorted(patterns):
+        if REMOTE_PATH_MARKER in pattern:
+            return None
+
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            try:
+                st = os.stat(path)
+
+            except OSError:
+                continue
+
+            fingerprints.append((os.path.abspath(path), st.st_mtime_ns, st.st_size))
+
+    return fingerprints
+
+
+class ResultCache:
+    """
+    LRU cache of `execute_sql` results, in memory and on disk.
+
+    Keys combine the canonical SQL with the fingerprints of the files it
+    reads. Results that also read catalog tables stay in memory and are
+    keyed on a catalog generation, bumped by every write statement.
+    """
+
+    def __init__(self, cache_dir: str, max_memory_bytes: int, max_disk_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self.stats = CacheStats()
+
+        # Tables/views whose content only depends on files, e.g. `trips`
+        self.sources: dict[str, set[str]] = {}
+
+        # digest -> (result, size, persistent)
+        self._memory: OrderedDict[str, tuple[CachedResult, int, bool]] = OrderedDict()
+        self._memory_bytes = 0
+        self._catalog_generation = 0
+
+        # Digests of results put by prefetching and not requested since
+        self._prefetched: set[str] = set()
+
+        self._lock = threading.Lock()
+
+    @property
+    def catalog_generation(self) -> int:
+        return self._catalog_generation
+
+    def register_source(self, name: str, patterns: set[str]):
+        self.sources[name.lower()] = patterns
+
+    def sources_of(self, statements: list[exp.Expression]) -> tuple[set[str], set[str]]:
+        """
+        The files `statements` read, including the files behind registered
+        sources, and the other catalog tables they read.
+        """
+        files: set[str] = set()
+        tables: set[str] = set()
+
+        for statement in statements:
+            _files, _tables = referenced_sources(statement)
+            files |= _files
+
+            for table in _tables:
+                if table in self.sources:
+                    files |= self.sources[table]
+
+                else:
+                    tables.add(table)
+
+        return files, tables
+
+    def file_fingerprints(self, statements: list[exp.Expression]) -> list[tuple[str, int, int]] | None:
+        """`fingerprint_files` of the files `statements` read."""
+        return fingerprint_files(self.sources_of(statements)[0])
+
+    def invalidate_catalog(self):
+        """Forget every result that depends on catalog tables."""
+        with self._lock:
+            self._catalog_generation += 1
+            self.stats.invalidations += 1
+
+            for digest, (_, size, persistent) in list(self._memory.items()):
+                if not persistent:
+                    del self._memory[digest]
+                    self._memory_bytes -= size
+
+    def key(self, sql: str, salt: str = "", record: bool = True) -> CacheKey | None:
+        """
+        Cache key for `sql`, or None when it must bypass the cache. Writes
+        (and anything that can't be parsed) invalidate catalog results.
+        Without `record`, bypasses are not counted in the stats.
+        """
+        statements = parse_statements(sql)
+
+        if not statements or not is_read_only(statements):
+            if statements is None or not is_catalog_read(statements):
+                self.invalidate_catalog()
+
+            # e.g. `CREATE OR REPLACE VIEW trips`, it no longer only depends on files
+            for statement in statements or []:
+                for table in written_tables(statement):
+                    self.sources.pop(table, None)
+
+            self.stats.bypassed += record
+            return None
+
+        if any(is_volatile(statement) for statement in statements):
+            self.stats.bypassed += record
+            return None
+
+        canonical = [canonicalize(statement) for statement in statements]
+        columns = [output_columns(statement) for statement in statements]
+        files, tables = self.sources_of(statements)
+
+        fingerprints = fingerprint_files(files)
+
+        if fingerprints is None:
+            self.stats.bypassed += record
+            return None
+
+        persistent = len(tables) == 0
+
+        payload = dumps({
+            "sql": canonical,
+            "columns": columns,
+            "files": fingerprints,
+            "catalog": None if persistent else self._catalog_generation,
+            "salt": salt,
+        })
+
+        return CacheKey(
+            digest=hashlib.sha256(payload.encode()).hexdigest(),
+            persistent=persistent,
+        )
+
+    def _disk_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.json")
+
+    def get(self, key: CacheKey, record: bool = True) -> CachedResult | None:
+        """
+        The cached result for `key`. Without `record` (prefetching) nothing
+        is counted, and the first recorded hit on a result put by prefetching
+        counts as `prefetched_hits` rather than a hit.
+        """
+        with self._lock:
+            entry = self._memory.get(key.digest)
+
+            if entry is not None and isinstance(entry[0], SpilledResult) and not os.path.exists(entry[0].path):
+                # The spilled file was removed since
+                del self._memory[key.digest]
+                self._memory_bytes -= entry[1]
+                entry = None
+
+            if entry is not None:
+                self._memory.move_to_end(key.digest)
+                self._count_hit(key, "memory", record)
+                return entry[0]
+
+        if key.persistent:
+            path = self._disk_path(key.digest)
+
+            try:
+                with open(path, "r") as f:
+                    result = QueryResult.model_validate_json(f.read())
+
+                # Touch for the LRU eviction of the disk cache
+                os.utime(path)
+
+            except (OSError, ValueError):
+                result = None
+
+            if result is not None:
+                self._count_hit(key, "disk", record)
+                self._remember(key, result)
+                return result
+
+        self.stats.misses += record
+        return None
+
+    def _count_hit(self, key: CacheKey, tier: Literal["memory", "disk"], record: bool):
+        if not record:
+            return
+
+        if key.digest in self._prefetched:
+            self._prefetched.discard(key.digest)
+            self.stats.prefetched_hits += 1
+
+        elif tier == "memory":
+            self.stats.memory_hits += 1
+
+        else:
+            self.stats.disk_hits += 1
+
+    def put(self, key: CacheKey, result: CachedResult, prefetched: bool = False):
+        self._remember(key, result)
+
+        if prefetched:
+            self._prefetched.add(key.digest)
+
+        if key.persistent and isinstance(result, QueryResult):
+            self._persist(key.digest, result)
+
+    def _remember(self, key: CacheKey, result: CachedResult):
+        if isinstance(result, SpilledResult):
+            size = sum(len(line) for line in result.head + result.tail)
+
+            # Dropped with catalog results, as the view can be dropped or replaced
+            persistent = False
+
+        else:
+            size = sum(len(line) for line in result.lines) + sum(len(c) for c in result.columns)
+            persistent = key.persistent
+
+        if size > self.max_memory_bytes:
+            return
+
+        with self._lock:
+            previous = self._memory.pop(key.digest, None)
+
+            if previous is not None:
+                self._memory_bytes -= previous[1]
+
+            self._memory[key.digest] = (result, size, persistent)
+            self._memory_bytes += size
+
+            while self._memory_bytes > self.max_memory_bytes:
+                _, (_, evicted_size, _) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_size
+                self.stats.evictions += 1
+
+    def _persist(self, digest: str, result: QueryResult):
+        path = self._disk_path(digest)
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+
+            with open(tmp_path, "w") as f:
+                f.write(result.model_dump_json())
+
+            os.replace(tmp_path, path)
+            self._evict_disk()
+
+        except OSError as e:
+            print(f"Could not persist cached SQL result: {e}")
+
+    def _evict_disk(self):
+        entries: list[tuple[float, int, str]] = []
+
+        for path in glob.glob(os.path.join(self.cache_dir, "*", "*.json")):
+            try:
+                st = os.stat(path)
+
+            except OSError:
+                continue
+
+            entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+
+            try:
+                os.remove(path)
+
+            except OSError:
+                continue
+
+            total -= size
+            self.stats.evictions += 1
+
+    def reset_stats(self):
+        self.stats = CacheStats()
+        self._prefetched = set()
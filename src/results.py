@@ -0,0 +1,171 @@
+from collections import Counter
+from decimal import Decimal
+
+import duckdb
+from pydantic import BaseModel
+
+
+# Longest value shown in the column stats
+MAX_VALUE_CHARS = 40
+
+# Rows fetched at once when only counting the rest of a result
+COUNT_BATCH_ROWS = 8192
+
+
+class QueryResult(BaseModel):
+    """A bounded, already formatted, view over a query result."""
+    columns: list[str]
+    lines: list[str]
+
+    # None when the rows past the caps were not counted
+    total_rows: int | None
+    truncated: bool = False
+
+    # Shown after the result, e.g. how the query was changed before running
+    notes: list[str] = []
+
+    # One line of statistics per column over the shown rows (see `column_stats`)
+    stats: list[str] = []
+
+    @property
+    def shown_rows(self) -> int:
+        return len(self.lines)
+
+    @property
+    def omitted_rows(self) -> int | None:
+        return None if self.total_rows is None else self.total_rows - self.shown_rows
+
+    def truncated_text(self, verb: str = "omitted") -> str:
+        """The line telling how many rows past the caps are not shown."""
+        if self.total_rows is None:
+            counted = f"More rows {verb}, the total was not counted."
+
+        else:
+            counted = f"{self.omitted_rows} more rows {verb} ({self.total_rows} rows in total)."
+
+        return f"... {counted} Use LIMIT, filters or aggregations to narrow down the result."
+
+    def to_text(self) -> str:
+        if self.total_rows == 0:
+            text = "Query executed successfully, but returned no results."
+
+        else:
+            text = "\n".join([", ".join(self.columns), *self.lines])
+
+        if self.truncated:
+            text += "\n" + self.truncated_text()
+
+        for note in self.notes:
+            text += f"\nNote: {note}"
+
+        return text
+
+
+def format_row(row: tuple) -> str:
+    return ", ".join(map(str, row))
+
+
+def _short(value: str) -> str:
+    return value if len(value) <= MAX_VALUE_CHARS else value[:MAX_VALUE_CHARS] + "..."
+
+
+def column_stats(columns: list[str], rows: list[tuple]) -> list[str]:
+    """
+    One line of statistics per column of `rows`: min/max/mean for numbers,
+    distinct and most common values otherwise.
+    """
+    stats: list[str] = []
+
+    for i, column in enumerate(columns):
+        values = [row[i] for row in rows if row[i] is not None]
+        nulls = len(rows) - len(values)
+        nulls_text = f", {nulls} null" if nulls else ""
+
+        if not values:
+            stats.append(f"- {column}: all null")
+            continue
+
+        if all(isinstance(value, (int, float, Decimal)) and not isinstance(value, bool) for value in values):
+            numbers = [float(value) for value in values]
+
+            stats.append(
+                f"- {column}: min {min(numbers):g}, max {max(numbers):g}, "
+                f"mean {sum(numbers) / len(numbers):g}{nulls_text}"
+            )
+            continue
+
+        counts = Counter(str(value) for value in values)
+        common = ", ".join(f"'{_short(value)}'" for value, _ in counts.most_common(3))
+        stats.append(f"- {column}: {len(counts)} distinct (e.g. {common}){nulls_text}")
+
+    return stats
+
+
+def fetch_bounded(
+    rel: duckdb.DuckDBPyRelation,
+    max_rows: int,
+    max_bytes: int,
+    batch_rows: int = 256,
+    count_total: bool = False,
+    max_count: int | None = None,
+) -> QueryResult:
+    """
+    Stream `rel` in batches until `max_rows` rows or `max_bytes` bytes of
+    formatted output are collected. Nothing past the caps is formatted or
+    kept. With `count_total`, the rows of a truncated result are counted by
+    draining the rest of the stream (the query isn't run again), stopping
+    past `max_count` rows. Otherwise, or past `max_count`, the total is left
+    unknown (None).
+    """
+    lines: list[str] = []
+    rows: list[tuple] = []
+    size = 0
+    truncated = False
+
+    # Rows fetched from `rel`, shown or not
+    seen = 0
+
+    while not truncated:
+        batch = rel.fetchmany(batch_rows)
+
+        if not batch:
+            break
+
+        seen += len(batch)
+
+        for row in batch:
+            line = format_row(row)
+
+            if not lines and len(line) > max_bytes:
+                # Always show something, even when a single row is too wide
+                line = line[:max_bytes] + "..."
+
+            if len(lines) >= max_rows or (lines and size + len(line) + 1 > max_bytes):
+                truncated = True
+                break
+
+            lines.append(line)
+            rows.append(row)
+            size += len(line) + 1
+
+    total_rows: int | None = len(lines)
+
+    if truncated:
+        total_rows = None
+
+        while count_total and (max_count is None or seen <= max_count):
+            batch = rel.fetchmany(COUNT_BATCH_ROWS)
+
+            if not batch:
+                total_rows = seen
+                break
+
+            seen += len(batch)
+
+    return QueryResult(
+        columns=rel.columns,
+        lines=lines,
+        total_rows=total_rows,
+        truncated=truncated,
+        stats=column_stats(rel.columns, rows),
+    )
@@ -0,0 +1,409 @@
+import hashlib
+import os
+import shutil
+import threading
+from json import dumps
+
+import duckdb
+import sqlglot
+from pydantic import BaseModel
+from sqlglot import exp
+
+from src.catalog import TRIPS_TABLE
+
+
+# Bump when the cube definitions change, so existing rollups are rebuilt
+ROLLUP_VERSION = 1
+
+MEASURE_COLUMNS = [
+    "fare_amount",
+    "total_amount",
+    "trip_distance",
+    "tip_amount",
+    "passenger_count",
+]
+
+# (column, value, flag) - `column > value` is stored as the boolean `flag`
+# dimension, so the usual "fare > $2.50" / "distance <= 100mi" filters
+# can be answered from the rollups.
+THRESHOLDS = [
+    ("fare_amount", 2.5, "fare_gt_2_5"),
+    ("trip_distance", 100.0, "distance_gt_100"),
+]
+
+
+class Cube(BaseModel):
+    name: str
+    dimensions: list[str]
+    measures: list[str]
+    path: str
+    rows: int = 0
+
+
+class Manifest(BaseModel):
+    fingerprint: str
+    cubes: list[Cube]
+
+
+# Smallest first, the first cube covering a query's dimensions is used
+CUBE_DIMENSIONS = {
+    "zone_hour": ["source_month", "PULocationID", "pickup_hour", "distance_bracket"],
+    "route": ["source_month", "PULocationID", "DOLocationID", "distance_bracket"],
+}
+
+
+def dataset_fingerprint(files: list[str]) -> str:
+    parts: list[tuple[str, int, int]] = []
+
+    for path in sorted(files):
+        st = os.stat(path)
+        parts.append((os.path.basename(path), st.st_mtime_ns, st.st_size))
+
+    payload = dumps({"version": ROLLUP_VERSION, "files": parts})
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _cube_sql(dimensions: list[str], measures: list[str]) -> str:
+    columns = [
+        *dimensions,
+        *[f"{column} > {value} AS {flag}" for column, value, flag in THRESHOLDS],
+        "count(*) AS trip_count",
+    ]
+
+    for measure in measures:
+        columns += [
+            f"count({measure}) AS count_{measure}",
+            f"sum({measure}) AS sum_{measure}",
+            f"min({measure}) AS min_{measure}",
+            f"max({measure}) AS max_{measure}",
+        ]
+
+    return f"SELECT {', '.join(columns)} FROM {TRIPS_TABLE} GROUP BY ALL"
+
+
+class NotAnswerable(Exception):
+    pass
+
+
+class RollupStore:
+    """
+    Pre-aggregated cubes over `trips`, built once per dataset fingerprint,
+    and the rewriter answering qualifying aggregate queries from them.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        self.manifest: Manifest | None = None
+
+        self._lock = threading.Lock()
+
+    def ensure(self, con: duckdb.DuckDBPyConnection, files: list[str]):
+        """Load the rollups for the current data files, building them if missing."""
+        if not files:
+            return
+
+        with self._lock:
+            fingerprint = dataset_fingerprint(files)
+
+            if self.manifest is not None and self.manifest.fingerprint == fingerprint:
+                return
+
+            cube_dir = os.path.join(self.root_dir, fingerprint)
+            manifest_path = os.path.join(cube_dir, "manifest.json")
+
+            if os.path.exists(manifest_path):
+                with open(manifest_path, "r") as f:
+                    self.manifest = Manifest.model_validate_json(f.read())
+
+                return
+
+            try:
+                self.manifest = self._build(con, fingerprint, cube_dir)
+
+            except duckdb.Error as e:
+                print(f"Could not build rollups: {e}")
+                shutil.rmtree(f"{cube_dir}.tmp", ignore_errors=True)
+
+    def _build(self, con: duckdb.DuckDBPyConnection, fingerprint: str, cube_dir: str) -> Manifest:
+        print(f"Building rollups for dataset {fingerprint}")
+
+        available = {
+            name.lower()
+            for (name, *_) in con.execute(f"DESCRIBE {TRIPS_TABLE}").fetchall()
+        }
+
+        measures = [m for m in MEASURE_COLUMNS if m.lower() in available]
+
+        # Built in a temporary directory, so a partial build is never used
+        tmp_dir = f"{cube_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        cubes: list[Cube] = []
+
+        for name, dimensions in CUBE_DIMENSIONS.items():
+            path = os.path.join(cube_dir, f"{name}.parquet")
+
+            con.execute(
+                f"COPY ({_cube_sql(dimensions, measures)}) "
+                f"TO '{os.path.join(tmp_dir, f'{name}.parquet')}' (FORMAT parquet)"
+            )
+
+            rows = con.execute(
+                f"SELECT count(*) FROM '{os.path.join(tmp_dir, f'{name}.parquet')}'"
+            ).fetchone()[0]  # type: ignore
+
+            cubes.append(Cube(
+                name=name,
+                dimensions=dimensions,
+                measures=measures,
+                path=os.path.abspath(path),
+                rows=rows,
+            ))
+
+        manifest = Manifest(fingerprint=fingerprint, cubes=cubes)
+
+        with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+            f.write(manifest.model_dump_json(indent=2))
+
+        os.replace(tmp_dir, cube_dir)
+
+        print(f"Built rollups: {', '.join(f'{c.name} ({c.rows} rows)' for c in cubes)}")
+        return manifest
+
+    def rewrite(self, sql: str) -> str | None:
+        """
+        `sql` with every qualifying aggregate over `trips` reading from a
+        rollup instead, or None when nothing can be answered from them.
+        """
+        if self.manifest is None:
+            return None
+
+        try:
+            statements = sqlglot.parse(sql, read="duckdb")
+
+        except sqlglot.errors.SqlglotError:
+            return None
+
+        if len(statements) != 1 or not isinstance(statements[0], exp.Query):
+            return None
+
+        statement = statements[0]
+        rewritten = False
+
+        for select in list(statement.find_all(exp.Select)):
+            replacement = self._rewrite_select(select)
+
+            if replacement is None:
+                continue
+
+            if select is statement:
+                statement = replacement
+
+            else:
+                select.replace(replacement)
+
+            rewritten = True
+
+        return statement.sql(dialect="duckdb") if rewritten else None
+
+    def _rewrite_select(self, select: exp.Select) -> exp.Select | None:
+        source = select.args.get("from_") or select.args.get("from")
+
+        if not isinstance(source, exp.From) or not isinstance(source.this, exp.Table):
+            return None
+
+        table = source.this
+
+        if table.name.lower() != TRIPS_TABLE or table.args.get("db") or not isinstance(table.this, exp.Identifier):
+            return None
+
+        for arg in ("joins", "laterals", "with", "with_", "qualify", "windows", "distinct", "sample"):
+            if select.args.get(arg):
+                return None
+
+        # Nested queries are rewritten on their own, windows can't be
+        if any(node is not select for node in select.find_all(exp.Window, exp.Subquery, exp.Select)):
+            return None
+
+        # `AVG(x) FILTER (WHERE ...)` would become `SUM(..) / SUM(..) FILTER (WHERE ...)`,
+        # only filtering part of the rewritten aggregate
+        if select.find(exp.Filter) is not None:
+            return None
+
+        if select.find(exp.AggFunc) is None:
+            return None
+
+        assert self.manifest is not None
+
+        for cube in self.manifest.cubes:
+            try:
+                return _answer_from(select, cube)
+
+            except NotAnswerable:
+                continue
+
+        return None
+
+
+def _plain_column(node: exp.Expression) -> str | None:
+    if isinstance(node, exp.Column) and not isinstance(node.this, exp.Star):
+        return node.name.lower()
+
+    return None
+
+
+def _is_pickup_hour(node: exp.Expression) -> bool:
+    if isinstance(node, exp.Hour):
+        return _plain_column(node.this) == "tpep_pickup_datetime"
+
+    if isinstance(node, exp.Extract):
+        return node.this.name.lower() == "hour" and _plain_column(node.expression) == "tpep_pickup_datetime"
+
+    if isinstance(node, exp.Anonymous) and node.name.lower() in ("date_part", "datepart"):
+        args = node.expressions
+
+        return (
+            len(args) == 2
+            and isinstance(args[0], exp.Literal)
+            and args[0].this.lower() == "hour"
+            and _plain_column(args[1]) == "tpep_pickup_datetime"
+        )
+
+    return False
+
+
+def _threshold_flag(node: exp.Expression) -> exp.Expression | None:
+    """`fare_amount > 2.5` -> `fare_gt_2_5`, `fare_amount <= 2.5` -> `NOT fare_gt_2_5`."""
+    if not isinstance(node, (exp.GT, exp.LTE, exp.LT, exp.GTE)):
+        return None
+
+    left, right = node.this, node.expression
+    op = type(node)
+
+    # Normalize `2.5 < fare_amount` to `fare_amount > 2.5`
+    if isinstance(left, exp.Literal):
+        left, right = right, left
+        op = {exp.GT: exp.LT, exp.LT: exp.GT, exp.GTE: exp.LTE, exp.LTE: exp.GTE}[op]
+
+    column = _plain_column(left)
+
+    if column is None or not isinstance(right, exp.Literal) or right.is_string:
+        return None
+
+    for _column, value, flag in THRESHOLDS:
+        if column != _column or float(right.this) != value:
+            continue
+
+        if op is exp.GT:
+            return exp.column(flag)
+
+        if op is exp.LTE:
+            return exp.Not(this=exp.column(flag))
+
+    return None
+
+
+def _aggregate(node: exp.AggFunc, measures: set[str]) -> exp.Expression:
+    if isinstance(node, exp.Count):
+        arg = node.this
+
+        if isinstance(arg, exp.Star) or (isinstance(arg, exp.Literal) and not arg.is_string):
+            total = "trip_count"
+
+        elif _plain_column(arg) in measures:
+            total = f"count_{_plain_column(arg)}"
+
+        else:
+            raise NotAnswerable()
+
+        return sqlglot.parse_one(f"CAST(COALESCE(SUM({total}), 0) AS BIGINT)", read="duckdb")
+
+    column = _plain_column(node.this)
+
+    if column not in measures:
+        raise NotAnswerable()
+
+    if isinstance(node, exp.Sum):
+        return sqlglot.parse_one(f"SUM(sum_{column})", read="duckdb")
+
+    if isinstance(node, exp.Avg):
+        return sqlglot.parse_one(f"SUM(sum_{column}) / SUM(count_{column})", read="duckdb")
+
+    if isinstance(node, exp.Min):
+        return sqlglot.parse_one(f"MIN(min_{column})", read="duckdb")
+
+    if isinstance(node, exp.Max):
+        return sqlglot.parse_one(f"MAX(max_{column})", read="duckdb")
+
+    raise NotAnswerable()
+
+
+def output_name(node: exp.Expression) -> str:
+    """The column name DuckDB gives to an unaliased select expression."""
+    if isinstance(node, exp.Count) and isinstance(node.this, exp.Star):
+        return "count_star()"
+
+    return node.sql(dialect="duckdb", normalize_functions="lower")
+
+
+def _answer_from(select: exp.Select, cube: Cube) -> exp.Select:
+    dimensions = {d.lower(): d for d in cube.dimensions}
+    measures = {m.lower() for m in cube.measures}
+
+    aliases = {
+        e.alias.lower()
+        for e in select.expressions
+        if isinstance(e, exp.Alias)
+    }
+
+    def transform(node: exp.Expression) -> exp.Expression:
+        if isinstance(node, exp.AggFunc):
+            if isinstance(node.this, exp.Distinct) or not isinstance(node, (exp.Count, exp.Sum, exp.Avg, exp.Min, exp.Max)):
+                raise NotAnswerable()
+
+            return _aggregate(node, measures)
+
+        if _is_pickup_hour(node) and "pickup_hour" in dimensions:
+            return exp.column("pickup_hour")
+
+        flag = _threshold_flag(node)
+
+        if flag is not None:
+            return flag
+
+        if isinstance(node, exp.Column):
+            name = _plain_column(node)
+
+            if name in dimensions:
+                return exp.column(dimensions[name])
+
+            # `ORDER BY revenue` referencing a select alias
+            if name in aliases and not node.table:
+                return node
+
+            raise NotAnswerable()
+
+        if isinstance(node, exp.Star):
+            raise NotAnswerable()
+
+        return node
+
+    rewritten = select.copy()
+
+    # Keep the output column names of the original query
+    for expression in list(rewritten.expressions):
+        if not isinstance(expression, (exp.Alias, exp.Column)):
+            expression.replace(exp.alias_(expression.copy(), output_name(expression), quoted=True))
+
+    rewritten = rewritten.transform(transform)
+
+    rewritten.set(
+        "from_" if "from_" in rewritten.args else "from",
+        exp.From(this=exp.Table(this=exp.Anonymous(
+            this="read_parquet",
+            expressions=[exp.Literal.string(cube.path)],
+        ))),
+    )
+
+    return rewritten  # type: ignore
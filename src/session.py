@@ -0,0 +1,168 @@
+import atexit
+import re
+import threading
+from typing import Callable
+
+import duckdb
+
+
+# Extensions are only loaded once a query actually needs them, e.g. httpfs
+# is not required at all for the local parquet files in `data/`.
+EXTENSION_PATTERNS: dict[str, re.Pattern[str]] = {
+    "httpfs": re.compile(r"\b(?:https?|s3a?|s3n|gcs|gs|r2|hf)://", re.IGNORECASE),
+}
+
+# Caches that should survive between queries of the same run, so parquet
+# footers and remote file metadata are only read once.
+CACHE_SETTINGS = {
+    "enable_object_cache": "true",
+    "parquet_metadata_cache": "true",
+    "enable_http_metadata_cache": "true",
+}
+
+
+OnConnect = Callable[[duckdb.DuckDBPyConnection], None]
+
+
+class DuckDBSession:
+    """
+    One warm DuckDB connection per run, handing out a cursor per tool call.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        config: dict[str, str] | None = None,
+        on_connect: list[OnConnect] | None = None,
+    ):
+        self.db_path = db_path
+        self.config = config or {}
+        self.on_connect = on_connect or []
+
+        self._con: duckdb.DuckDBPyConnection | None = None
+        self._extensions: set[str] = set()
+        self._lock = threading.RLock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._con is not None
+
+    @property
+    def connection(self) -> duckdb.DuckDBPyConnection:
+        with self._lock:
+            if self._con is None:
+                self._con = self._connect()
+
+            return self._con
+
+    def open(self) -> duckdb.DuckDBPyConnection:
+        """Eagerly open the connection, running the `on_connect` hooks."""
+        return self.connection
+
+    def _connect(self) -> duckdb.DuckDBPyConnection:
+        con = duckdb.connect(self.db_path, config=self.config)
+
+        available = {
+            name
+            for (name,) in con.execute("SELECT name FROM duckdb_settings()").fetchall()
+        }
+
+        for name, value in CACHE_SETTINGS.items():
+            if name in available:
+                con.execute(f"SET GLOBAL {name} = {value}")
+
+        for hook in self.on_connect:
+            hook(con)
+
+        print(f"Opened DuckDB session on {self.db_path}")
+        return con
+
+    def ensure_extensions(self, sql: str):
+        """Install and load the extensions `sql` needs, once per session."""
+        for extension, pattern in EXTENSION_PATTERNS.items():
+            if extension in self._extensions or not pattern.search(sql):
+                continue
+
+            with self._lock:
+                if extension in self._extensions:
+                    continue
+
+                con = self.connection
+                con.install_extension(extension)
+                con.load_extension(extension)
+
+                self._extensions.add(extension)
+
+    def cursor(self, sql: str = "") -> duckdb.DuckDBPyConnection:
+        """
+        Return a new cursor on the shared database, with the extensions `sql`
+        needs already loaded. Cursors are cheap and safe to use from the
+        tool worker threads, while sharing the buffer pool and caches.
+        """
+        if sql:
+            self.ensure_extensions(sql)
+
+        return self.connection.cursor()
+
+    def close(self):
+        with self._lock:
+            if self._con is None:
+                return
+
+            try:
+                self._con.close()
+
+            finally:
+                self._con = None
+                self._extensions.clear()
+
+            print(f"Closed DuckDB session on {self.db_path}")
+
+
+class QueryHandle:
+    """
+    Lets the event loop interrupt a query running on an executor thread,
+    including one that has not reached DuckDB yet.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+
+        self._cursor: duckdb.DuckDBPyConnection | None = None
+        self._lock = threading.Lock()
+
+    def attach(self, cursor: duckdb.DuckDBPyConnection):
+        with self._lock:
+            if self.cancelled:
+                raise duckdb.InterruptException("Query cancelled before it started")
+
+            self._cursor = cursor
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+
+            if self._cursor is None:
+                return
+
+            try:
+                self._cursor.interrupt()
+
+            except duckdb.ConnectionException:
+                # The query finished and closed its cursor
+                pass
+
+
+_sessions: list[DuckDBSession] = []
+
+
+def register_session(session: DuckDBSession) -> DuckDBSession:
+    """Track `session` so it is closed when the process exits."""
+    _sessions.append(session)
+    return session
+
+
+@atexit.register
+def _close_sessions():
+    for session in _sessions:
+        session.close()
@@ -0,0 +1,133 @@
+import os
+import threading
+from typing import Literal
+
+import duckdb
+from pydantic import BaseModel
+
+from src.results import format_row
+
+
+SpillFormat = Literal["parquet", "csv"]
+
+SPILL_VIEW_PREFIX = "result_"
+
+
+class SpilledResult(BaseModel):
+    """A result too large to show, saved to a file and registered as a view."""
+    view: str
+    path: str
+    rel_path: str
+    columns: list[tuple[str, str]]
+    total_rows: int
+
+    head: list[str]
+    tail: list[str]
+
+    notes: list[str] = []
+
+    def to_text(self) -> str:
+        header = ", ".join(name for name, _ in self.columns)
+
+        text = (
+            f"Query returned {self.total_rows} rows, too many to show. The full result was saved to "
+            f"'{self.rel_path}' and registered as the `{self.view}` view, query it with SQL "
+            f"(e.g. `SELECT ... FROM {self.view} WHERE ...` or `FROM '{self.path}'`) instead of reading or rewriting it.\n"
+            f"Schema: {', '.join(f'{name} {column_type}' for name, column_type in self.columns)}\n"
+            f"First {len(self.head)} rows:\n{header}\n" + "\n".join(self.head)
+        )
+
+        if self.tail:
+            text += f"\nLast {len(self.tail)} rows:\n{header}\n" + "\n".join(self.tail)
+
+        for note in self.notes:
+            text += f"\nNote: {note}"
+
+        return text
+
+
+class SpillStore:
+    """
+    Writes large results with DuckDB itself (`COPY`, no rows go through
+    Python) under `directory`, one file and one view per result.
+    """
+
+    def __init__(self, directory: str, root_dir: str, file_format: SpillFormat, preview_rows: int):
+        self.directory = directory
+        self.root_dir = root_dir
+        self.file_format = file_format
+        self.preview_rows = preview_rows
+
+        self._lock = threading.Lock()
+
+    def _next_name(self) -> tuple[str, str]:
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+
+            i = 1
+
+            while True:
+                name = f"{SPILL_VIEW_PREFIX}{i}"
+                path = os.path.join(self.directory, f"{name}.{self.file_format}")
+
+                if not os.path.exists(path):
+                    # Reserve the name before the (slow) write
+                    open(path, "w").close()
+                    return name, path
+
+                i += 1
+
+    def spill(self, con: duckdb.DuckDBPyConnection, rel: duckdb.DuckDBPyRelation) -> SpilledResult:
+        """Write the whole of `rel` and return a preview of it."""
+        name, path = self._next_name()
+        path = os.path.abspath(path)
+
+        try:
+            if self.file_format == "csv":
+                rel.write_csv(path, header=True)
+                source = f"read_csv('{path}')"
+
+            else:
+                rel.write_parquet(path)
+                source = f"read_parquet('{path}')"
+
+        except duckdb.Error:
+            os.remove(path)
+            raise
+
+        con.execute(f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM {source}")
+
+        total_rows = con.execute(f"SELECT count(*) FROM {name}").fetchone()[0]  # type: ignore
+        columns = [
+            (column, str(column_type))
+            for (column, column_type, *_) in con.execute(f"DESCRIBE {name}").fetchall()
+        ]
+
+        # The file keeps the result order, so the row number is the position
+        rows = con.execute(
+            f"SELECT * EXCLUDE (__row) FROM (SELECT *, row_number() OVER () AS __row FROM {name}) "
+            "WHERE __row <= ? OR __row > ? ORDER BY __row",
+            [self.preview_rows, max(self.preview_rows, total_rows - self.preview_rows)],
+        ).fetchall()
+
+        lines = [format_row(row) for row in rows]
+
+        return SpilledResult(
+            view=name,
+            path=path,
+            rel_path=os.path.relpath(path, self.root_dir),
+            columns=columns,
+            total_rows=total_rows,
+            head=lines[:self.preview_rows],
+            tail=lines[self.preview_rows:],
+        )
+
+    def discard(self, con: duckdb.DuckDBPyConnection, spilled: SpilledResult):
+        """Drop a spilled result after all, when it is small enough to show."""
+        con.execute(f"DROP VIEW IF EXISTS {spilled.view}")
+
+        try:
+            os.remove(spilled.path)
+
+        except OSError:
+            pass
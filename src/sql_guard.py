@@ -0,0 +1,272 @@
+import re
+from json import loads
+from typing import Any, Literal
+
+import duckdb
+from pydantic import BaseModel
+from sqlglot import exp
+
+from src.result_cache import parse_statements
+
+
+Policy = Literal["reject", "limit", "allow"]
+Action = Literal["allow", "limit", "reject", "skip"]
+
+# Operators that end the plan with a bounded number of rows
+LIMIT_OPERATORS = {"LIMIT", "STREAMING_LIMIT", "TOP_N", "LIMIT_PERCENT"}
+
+# Operators whose output cardinality estimates are too rough to act on
+AGGREGATE_OPERATORS = {
+    "HASH_GROUP_BY",
+    "PERFECT_HASH_GROUP_BY",
+    "UNGROUPED_AGGREGATE",
+    "SIMPLE_AGGREGATE",
+    "STREAMING_WINDOW",
+}
+
+# Operators that only pass rows through, looked through to find a final LIMIT
+PASS_THROUGH_OPERATORS = {"PROJECTION", "ORDER_BY", "FILTER", "WINDOW"}
+
+CROSS_OPERATORS = {"CROSS_PRODUCT", "BLOCKWISE_NL_JOIN", "NESTED_LOOP_JOIN"}
+
+UNION_OPERATORS = {"UNION"}
+
+SCANNING_FILES_PATTERN = re.compile(r"(\d+)\s*/\s*(\d+)")
+
+
+class PlanEstimate(BaseModel):
+    """What the physical plan tells about a query before running it."""
+    result_rows: int | None = None
+    # Rows read by the scans, and the largest intermediate result
+    scan_rows: int = 0
+    plan_rows: int = 0
+    files_scanned: int | None = None
+    files_total: int | None = None
+    has_limit: bool = False
+    aggregated: bool = False
+
+
+class GuardDecision(BaseModel):
+    action: Action
+    reason: str
+    sql: str
+    estimate: PlanEstimate | None = None
+    rewritten_sql: str | None = None
+
+
+class QueryRejected(Exception):
+    def __init__(self, decision: GuardDecision):
+        super().__init__(decision.reason)
+        self.decision = decision
+
+
+def _cardinality(node: dict[str, Any]) -> int | None:
+    value = (node.get("extra_info") or {}).get("Estimated Cardinality")
+
+    try:
+        return int(value) if value is not None else None
+
+    except (TypeError, ValueError):
+        return None
+
+
+def _walk(node: dict[str, Any], estimate: PlanEstimate, rows_by_node: dict[int, int]) -> int:
+    """Fill `estimate` with the scans below `node`, returns its row estimate."""
+    children = [_walk(child, estimate, rows_by_node) for child in node.get("children", [])]
+    rows = _cardinality(node)
+
+    if rows is None and node.get("name") in CROSS_OPERATORS and children:
+        rows = 1
+
+        for child_rows in children:
+            rows *= max(child_rows, 1)
+
+    if rows is None and node.get("name") in UNION_OPERATORS:
+        rows = sum(children)
+
+    rows = rows if rows is not None else max(children, default=0)
+    rows_by_node[id(node)] = rows
+
+    if not node.get("children"):
+        estimate.scan_rows += rows
+
+        files = (node.get("extra_info") or {}).get("Scanning Files")
+        match = SCANNING_FILES_PATTERN.search(str(files)) if files else None
+
+        if match:
+            estimate.files_scanned = (estimate.files_scanned or 0) + int(match.group(1))
+            estimate.files_total = (estimate.files_total or 0) + int(match.group(2))
+
+    estimate.plan_rows = max(estimate.plan_rows, rows)
+    return rows
+
+
+def estimate_plan(plan: list[dict[str, Any]]) -> PlanEstimate:
+    estimate = PlanEstimate()
+
+    if not plan:
+        return estimate
+
+    root = plan[0]
+    rows_by_node: dict[int, int] = {}
+    _walk(root, estimate, rows_by_node)
+
+    # Follow the operators the result streams out of, down to the first
+    # one that bounds or aggregates it
+    node: dict[str, Any] | None = root
+
+    while node is not None:
+        name = node.get("name")
+        rows = rows_by_node.get(id(node))
+
+        if name in LIMIT_OPERATORS:
+            estimate.has_limit = True
+            break
+
+        if name in AGGREGATE_OPERATORS:
+            estimate.aggregated = True
+            break
+
+        if estimate.result_rows is None and rows:
+            estimate.result_rows = rows
+
+        children = node.get("children", [])
+
+        if name not in PASS_THROUGH_OPERATORS or len(children) != 1:
+            break
+
+        node = children[0]
+
+    return estimate
+
+
+def explain(con: duckdb.DuckDBPyConnection, sql: str) -> PlanEstimate:
+    rows = con.execute(f"EXPLAIN (FORMAT json) {sql}").fetchall()
+
+    plan = next(
+        (value for key, value in rows if key == "physical_plan"),
+        rows[0][1] if rows else "[]",
+    )
+
+    return estimate_plan(loads(plan))
+
+
+class SQLGuard:
+    """
+    Checks the physical plan of a query before `execute_sql` runs it. With
+    the `limit` policy, queries returning more raw rows than
+    `max_result_rows` without a LIMIT get one added. With `reject`, they are
+    refused, as are plans going over `max_plan_rows`. With `allow`, they
+    only get logged. Every decision is kept for the run output.
+    """
+
+    def __init__(self, policy: Policy, max_result_rows: int, max_plan_rows: int, limit_rows: int):
+        self.policy = policy
+        self.max_result_rows = max_result_rows
+        self.max_plan_rows = max_plan_rows
+        self.limit_rows = limit_rows
+
+        self.decisions: list[GuardDecision] = []
+
+    def _decide(self, decision: GuardDecision) -> GuardDecision:
+        self.decisions.append(decision)
+
+        if decision.action != "skip":
+            print(f"SQL guard ({self.policy}): {decision.action}, {decision.reason}")
+
+        return decision
+
+    def check(self, con: duckdb.DuckDBPyConnection, sql: str) -> GuardDecision:
+        """The decision for `sql`, raising `QueryRejected` when it is rejected."""
+        statements = parse_statements(sql)
+
+        if not statements or len(statements) != 1 or not isinstance(statements[0], exp.Query):
+            return self._decide(GuardDecision(action="skip", reason="not a single query", sql=sql))
+
+        try:
+            estimate = explain(con, sql)
+
+        except duckdb.InterruptException:
+            raise
+
+        except duckdb.Error as e:
+            # Left for the execution to report
+            return self._decide(GuardDecision(action="skip", reason=f"could not plan: {e}", sql=sql))
+
+        files = (
+            f", scanning {estimate.files_scanned}/{estimate.files_total} files"
+            if estimate.files_total is not None
+            else ""
+        )
+
+        if estimate.plan_rows > self.max_plan_rows and self.policy == "reject":
+            return self._reject(
+                f"the plan processes ~{estimate.plan_rows:,} rows (limit {self.max_plan_rows:,}){files}",
+                sql,
+                estimate,
+            )
+
+        unbounded = (
+            not estimate.has_limit
+            and not estimate.aggregated
+            and (estimate.result_rows or 0) > self.max_result_rows
+        )
+
+        if not unbounded:
+            if estimate.has_limit:
+                result = "bounded by a LIMIT"
+
+            elif estimate.aggregated:
+                result = "aggregated result"
+
+            else:
+                result = f"~{estimate.result_rows or 0:,} result rows"
+
+            return self._decide(GuardDecision(
+                action="allow",
+                reason=f"{result}{files}",
+                sql=sql,
+                estimate=estimate,
+            ))
+
+        reason = f"it returns ~{estimate.result_rows:,} rows without a LIMIT (limit {self.max_result_rows:,}){files}"
+
+        if self.policy == "reject":
+            return self._reject(reason, sql, estimate)
+
+        if self.policy == "limit":
+            query: exp.Query = statements[0]  # type: ignore
+
+            return self._decide(GuardDecision(
+                action="limit",
+                reason=reason,
+                sql=sql,
+                estimate=estimate,
+                rewritten_sql=query.limit(self.limit_rows).sql(dialect="duckdb"),
+            ))
+
+        return self._decide(GuardDecision(action="allow", reason=reason, sql=sql, estimate=estimate))
+
+    def _reject(self, reason: str, sql: str, estimate: PlanEstimate) -> GuardDecision:
+        decision = self._decide(GuardDecision(action="reject", reason=reason, sql=sql, estimate=estimate))
+        raise QueryRejected(decision)
+
+    def description(self) -> str:
+        """How the guard treats queries, for the `execute_sql` description."""
+        if self.policy == "limit":
+            return f" Queries estimated to return more than {self.max_result_rows} rows without a LIMIT get a LIMIT {self.limit_rows} added before running."
+
+        if self.policy == "reject":
+            return f" Queries estimated to return more than {self.max_result_rows} rows without a LIMIT, or to process more than {self.max_plan_rows} rows, are rejected before running."
+
+        return ""
+
+    def reset(self):
+        self.decisions = []
+
+    def summary(self) -> dict:
+        return {
+            "policy": self.policy,
+            "decisions": [d.model_dump(exclude_none=True) for d in self.decisions if d.action != "skip"],
+            "skipped": sum(1 for d in self.decisions if d.action == "skip"),
+        }
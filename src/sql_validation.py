@@ -0,0 +1,313 @@
+import difflib
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from json import dumps
+from typing import Callable
+
+import duckdb
+from pydantic import BaseModel
+from sqlglot import exp
+
+from src.instrumentation import record_call
+from src.result_cache import canonicalize, parse_statements
+from src.session import DuckDBSession, QueryHandle
+
+
+# Statements EXPLAIN can't plan, they are only parsed
+UNPLANNED_STATEMENTS = {
+    "TRANSACTION",
+    "PRAGMA",
+    "ATTACH",
+    "DETACH",
+    "LOAD",
+    "EXPLAIN",
+    # `USE`, `SET` and `RESET`
+    "SET",
+}
+
+# `PRAGMA x` is rewritten to a SELECT that EXPLAIN can't plan either
+UNPLANNED_KEYWORDS = ("PRAGMA",)
+
+ERROR_KINDS: list[tuple[type[duckdb.Error], str]] = [
+    (duckdb.ParserException, "syntax"),
+    (duckdb.CatalogException, "catalog"),
+    (duckdb.BinderException, "binder"),
+    (duckdb.IOException, "io"),
+    (duckdb.ConversionException, "type"),
+]
+
+MISSING_COLUMN_PATTERNS = [
+    re.compile(r'Referenced column "([^"]+)" not found'),
+    re.compile(r'does not have a column named "([^"]+)"'),
+]
+MISSING_TABLE_PATTERN = re.compile(r"Table with name (\S+) does not exist")
+# Scalar and table functions, including macros
+MISSING_FUNCTION_PATTERN = re.compile(r"Function with name (\S+) does not exist")
+MISSING_FILES_PATTERN = re.compile(r'No files found that match the pattern "([^"]+)"')
+
+MAX_SUGGESTIONS = 5
+
+
+class ValidationIssue(BaseModel):
+    kind: str
+    statement: int
+    message: str
+    suggestions: list[str] = []
+
+
+class ValidationResult(BaseModel):
+    issues: list[ValidationIssue] = []
+    statements: int = 0
+
+    @property
+    def valid(self) -> bool:
+        return not self.issues
+
+    def to_text(self) -> str:
+        if self.valid:
+            return f"Valid DuckDB SQL ({self.statements} statement{'s' if self.statements != 1 else ''} parsed and planned against the current database, not executed)"
+
+        text = f"Error: Invalid SQL, {len(self.issues)} issue{'s' if len(self.issues) != 1 else ''} found:\n"
+
+        for i, issue in enumerate(self.issues, start=1):
+            text += f"{i}. [{issue.kind}] statement {issue.statement}: {issue.message.strip()}\n"
+
+            if issue.suggestions:
+                text += f"   Did you mean: {', '.join(issue.suggestions)}?\n"
+
+        return text
+
+
+class ValidationStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    invalid: int = 0
+
+
+class Vocabulary(BaseModel):
+    """Names suggestions are drawn from."""
+    columns: set[str] = set()
+    tables: set[str] = set()
+    files: set[str] = set()
+
+
+def _kind(error: duckdb.Error) -> str:
+    for error_type, kind in ERROR_KINDS:
+        if isinstance(error, error_type):
+            return kind
+
+    return "error"
+
+
+def _closest(name: str, candidates: set[str]) -> list[str]:
+    by_lower = {c.lower(): c for c in candidates}
+
+    return [
+        by_lower[match]
+        for match in difflib.get_close_matches(name.lower(), list(by_lower), n=MAX_SUGGESTIONS, cutoff=0.6)
+    ]
+
+
+def _closest_files(pattern: str, files: set[str]) -> list[str]:
+    basename = pattern.rsplit("/", 1)[-1]
+    by_basename: dict[str, list[str]] = {}
+
+    # Suggest paths in the same form, absolute or relative, as the pattern
+    same_form = {path for path in files if path.startswith("/") == pattern.startswith("/")}
+
+    for path in same_form or files:
+        by_basename.setdefault(path.rsplit("/", 1)[-1].lower(), []).append(path)
+
+    return [
+        path
+        for match in difflib.get_close_matches(basename.lower(), list(by_basename), n=MAX_SUGGESTIONS, cutoff=0.5)
+        for path in sorted(by_basename[match])
+    ][:MAX_SUGGESTIONS]
+
+
+def suggestions(error: duckdb.Error, vocabulary: Vocabulary) -> list[str]:
+    """Names close to the one `error` complains about."""
+    message = str(error)
+
+    for pattern in MISSING_COLUMN_PATTERNS:
+        match = pattern.search(message)
+
+        if match:
+            return _closest(match.group(1), vocabulary.columns)
+
+    match = MISSING_TABLE_PATTERN.search(message)
+
+    if match:
+        return _closest(match.group(1).strip('"'), vocabulary.tables)
+
+    match = MISSING_FILES_PATTERN.search(message)
+
+    if match:
+        return _closest_files(match.group(1), vocabulary.files)
+
+    return []
+
+
+def _created_name(sql: str) -> str | None:
+    """Name of the table, view, macro or function `sql` creates."""
+    statements = parse_statements(sql)
+
+    if not statements or not isinstance(statements[0], exp.Create):
+        return None
+
+    # Macros and functions are a `UserDefinedFunction` named by a table
+    table = statements[0].find(exp.Table)
+    return table.name.lower() if table is not None else None
+
+
+class SQLValidator:
+    """
+    Validates SQL by parsing it with DuckDB and planning every statement
+    with EXPLAIN on the run's session, so unknown columns, tables and files
+    or type errors are caught without running the query. Results are cached
+    per canonical query until the catalog or the files it reads change.
+    """
+
+    def __init__(
+        self,
+        session: DuckDBSession,
+        vocabulary: Callable[[duckdb.DuckDBPyConnection], Vocabulary],
+        catalog_generation: Callable[[], int],
+        file_fingerprints: Callable[[list[exp.Expression]], list[tuple[str, int, int]] | None],
+        max_entries: int = 256,
+    ):
+        self.session = session
+        self.vocabulary = vocabulary
+        self.catalog_generation = catalog_generation
+        self.file_fingerprints = file_fingerprints
+        self.max_entries = max_entries
+
+        self.stats = ValidationStats()
+
+        self._cache: OrderedDict[str, ValidationResult] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, sql: str) -> str:
+        statements = parse_statements(sql)
+
+        if statements:
+            canonical = [canonicalize(statement) for statement in statements]
+
+            # A file created or rewritten since changes the result
+            files = self.file_fingerprints(statements)
+
+        else:
+            canonical = [" ".join(sql.split())]
+            files = None
+
+        payload = dumps({"sql": canonical, "catalog": self.catalog_generation(), "files": files})
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def validate(self, sql: str, handle: QueryHandle | None = None) -> ValidationResult:
+        """Blocking, `validate_sql` runs it on the SQL executor threads."""
+        key = self._key(sql)
+
+        with self._lock:
+            cached = self._cache.get(key)
+
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.stats.hits += 1
+                record_call(cache_hit=True)
+                return cached
+
+            self.stats.misses += 1
+
+        record_call(cache_hit=False)
+
+        result = self._validate(sql, handle)
+
+        with self._lock:
+            if not result.valid:
+                self.stats.invalid += 1
+
+            self._cache[key] = result
+
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+        return result
+
+    def _validate(self, sql: str, handle: QueryHandle | None) -> ValidationResult:
+        con = self.session.cursor(sql)
+
+        try:
+            if handle is not None:
+                handle.attach(con)
+
+            try:
+                statements = con.extract_statements(sql)
+
+            except duckdb.Error as e:
+                return ValidationResult(issues=[
+                    ValidationIssue(kind=_kind(e), statement=1, message=str(e)),
+                ])
+
+            result = ValidationResult(statements=len(statements))
+
+            # Objects created earlier in the script don't exist yet
+            created: set[str] = set()
+            vocabulary: Vocabulary | None = None
+
+            for i, statement in enumerate(statements, start=1):
+                query = statement.query.strip()
+
+                planned = (
+                    statement.type.name not in UNPLANNED_STATEMENTS
+                    and not query.upper().startswith(UNPLANNED_KEYWORDS)
+                )
+
+                if planned:
+                    try:
+                        con.execute(f"EXPLAIN {query}")
+
+                    except duckdb.InterruptException:
+                        raise
+
+                    except duckdb.Error as e:
+                        missing = MISSING_TABLE_PATTERN.search(str(e)) or MISSING_FUNCTION_PATTERN.search(str(e))
+
+                        if not (missing and missing.group(1).strip('"').lower() in created):
+                            vocabulary = vocabulary or self.vocabulary(con)
+
+                            result.issues.append(ValidationIssue(
+                                kind=_kind(e),
+                                statement=i,
+                                message=str(e),
+                                suggestions=suggestions(e, vocabulary),
+                            ))
+
+                name = _created_name(query)
+
+                if name is not None:
+                    created.add(name)
+
+            return result
+
+        finally:
+            con.close()
+
+
+def catalog_vocabulary(con: duckdb.DuckDBPyConnection) -> Vocabulary:
+    """Tables, views and their columns in the session's catalog."""
+    vocabulary = Vocabulary()
+
+    try:
+        for table, column in con.execute(
+            "SELECT table_name, column_name FROM information_schema.columns"
+        ).fetchall():
+            vocabulary.tables.add(table)
+            vocabulary.columns.add(column)
+
+    except duckdb.Error as e:
+        print(f"Could not read the catalog for SQL suggestions: {e}")
+
+    return vocabulary
+
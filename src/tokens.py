@@ -0,0 +1,118 @@
+import math
+from typing import Callable, Literal, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+
+TokenCounter = Literal["approx", "tiktoken"]
+
+# Same overhead per message as `count_tokens_approximately`
+EXTRA_TOKENS_PER_MESSAGE = 3
+
+
+def _message_text(message: BaseMessage) -> str:
+    if isinstance(message.content, str):
+        text = message.content
+
+    else:
+        text = "".join(
+            block if isinstance(block, str) else str(block.get("text") or repr(block))
+            for block in message.content
+        )
+
+    if isinstance(message, AIMessage) and message.tool_calls:
+        text += repr(message.tool_calls)
+
+    if isinstance(message, ToolMessage):
+        text += message.tool_call_id
+
+    return f"{message.type}{message.name or ''}{text}"
+
+
+def _tiktoken_counter(encoding_name: str) -> Callable[[BaseMessage], int] | None:
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding(encoding_name)
+
+    except Exception as e:
+        # Not installed, or the encoding couldn't be downloaded
+        print(f"Could not load tiktoken encoding '{encoding_name}', counting tokens approximately: {e}")
+        return None
+
+    def count(message: BaseMessage) -> int:
+        return len(encoding.encode(_message_text(message), disallowed_special=())) + EXTRA_TOKENS_PER_MESSAGE
+
+    return count
+
+
+class TokenAccountant:
+    """
+    Token count of a growing message list, such as the state of an agent.
+    Messages are counted once and cached by id, so each call only counts
+    the messages added since the previous one. When the list is rewritten
+    (e.g. summarization replaced old messages) the total is summed again
+    from the cache, only counting the new messages.
+
+    With `counter="tiktoken"` messages are tokenized with `encoding`
+    (tiktoken is optional), otherwise `count_tokens_approximately` is used.
+    """
+
+    def __init__(self, counter: TokenCounter = "approx", encoding: str = "o200k_base"):
+        self.counter: TokenCounter = "approx"
+        self._count: Callable[[BaseMessage], int] = lambda message: count_tokens_approximately([message])
+
+        if counter == "tiktoken":
+            tiktoken_count = _tiktoken_counter(encoding)
+
+            if tiktoken_count is not None:
+                self.counter = "tiktoken"
+                self._count = tiktoken_count
+
+        self.total = 0
+        self.counted = 0
+
+        self._by_id: dict[str, int] = {}
+        self._ids: list[str | None] = []
+
+    def _message_tokens(self, message: BaseMessage) -> int:
+        # Messages of the agent state always have an id
+        if message.id is None:
+            self.counted += 1
+            return self._count(message)
+
+        tokens = self._by_id.get(message.id)
+
+        if tokens is None:
+            tokens = self._count(message)
+            self._by_id[message.id] = tokens
+            self.counted += 1
+
+        return tokens
+
+    def count(self, messages: Sequence[BaseMessage]) -> int:
+        """Tokens of `messages`, the current state of the list."""
+        previous = len(self._ids)
+
+        appended = (
+            0 < previous <= len(messages)
+            and messages[0].id == self._ids[0]
+            and messages[previous - 1].id == self._ids[-1]
+            and self._ids[-1] is not None
+        )
+
+        if appended:
+            new = messages[previous:]
+            self.total += sum(self._message_tokens(message) for message in new)
+            self._ids.extend(message.id for message in new)
+
+        else:
+            self.total = sum(self._message_tokens(message) for message in messages)
+            self._ids = [message.id for message in messages]
+
+            # Drop the counts of messages that were removed
+            current = set(self._ids)
+            self._by_id = {id_: tokens for id_, tokens in self._by_id.items() if id_ in current}
+
+        return math.ceil(self.total)
@@ -1,23 +1,78 @@
 from datetime import datetime
-import src.config  # noqa: F401
+from src.config import (
+    CACHE_DIR,
+    CONDENSE_TARGET_TOKENS,
+    DOCS_CACHE_DIR,
+    DOCS_CACHE_TTL_SECONDS,
+    DOCS_MAX_CONNECTIONS,
+    DOCS_OFFLINE,
+    DOCS_TIMEOUT_SECONDS,
+    DUCKDB_GOVERNOR_DIR,
+    DUCKDB_GOVERNOR_ENABLED,
+    DUCKDB_MONITOR_INTERVAL_SECONDS,
+    DUCKDB_TOTAL_MEMORY_BYTES,
+    DUCKDB_TOTAL_TEMP_BYTES,
+    DUCKDB_TOTAL_THREADS,
+    PREFETCH_ENABLED,
+    PREFETCH_MAX_DOCS,
+    PREFETCH_MAX_TABLES,
+    PREFETCH_WARM_MAX_BYTES,
+    ROLLUPS_ENABLED,
+    SQL_APPROX_METHOD,
+    SQL_APPROX_SAMPLE_PERCENT,
+    SQL_CACHE_DISK_BYTES,
+    SQL_CACHE_ENABLED,
+    SQL_CACHE_MEMORY_BYTES,
+    SQL_COST_POLICY,
+    SQL_FETCH_BATCH_ROWS,
+    SQL_GUARD_MAX_PLAN_ROWS,
+    SQL_GUARD_MAX_RESULT_ROWS,
+    SQL_MAX_BYTES,
+    SQL_MAX_ROWS,
+    SQL_MAX_WORKERS,
+    SQL_SPILL_FORMAT,
+    SQL_SPILL_PREVIEW_ROWS,
+    SQL_SPILL_ROWS,
+    SQL_TIMEOUT_SECONDS,
+    TRIPS_MATERIALIZE,
+)
 
+import asyncio
+import atexit
+import contextvars
 import os
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from functools import partial
+from typing import Literal
 
 
 import httpx
 from pydantic import BaseModel
-from bs4 import BeautifulSoup
 import duckdb
 from langchain_core.language_models import BaseChatModel
-from html_to_markdown import convert
-import sqlglot
 from langchain.tools import tool
+from sqlglot import exp
+
+from src.approx import NotApproximable, materialize, rewrite_approx
+from src.catalog import TRIPS_FILE_PATTERN, TRIPS_TABLE, register_trips, trips_files
+from src.condense import Condenser
+from src.doc_search import DocSearchIndex
+from src.governor import ResourceGovernor
+from src.instrumentation import ToolCallLog, record_call
+from src.docs import DDB_BASE_URL, DocsCache, DocsClient, DocsError, DocsStats, normalize_path
+from src.parquet_index import DirectoryListing, ParquetIndex
+from src.prefetch import Prefetcher
+from src.result_cache import CacheKey, ResultCache, parse_statements
+from src.rollups import RollupStore
+from src.results import QueryResult, fetch_bounded
+from src.session import DuckDBSession, QueryHandle, register_session
+from src.spill import SpilledResult, SpillStore
+from src.sql_guard import GuardDecision, QueryRejected, SQLGuard
+from src.sql_validation import SQLValidator, ValidationStats, Vocabulary, catalog_vocabulary
 
 
-DDB_BASE_URL = "https://duckdb.org"
-DDB_SITEMAP_URL = f"{DDB_BASE_URL}/sitemap"
-
 DATA_DIR = os.path.join(
     os.path.dirname(__file__),
     "..",
@@ -34,36 +89,170 @@ RUN_ID = datetime.now().strftime("%Y%m%dT%H%M%S")
 
 print(f"Tools module initialized with RUN_ID: {RUN_ID}")
 
+ROLLUPS = RollupStore(os.path.join(CACHE_DIR, "rollups"))
+
+GOVERNOR = ResourceGovernor(
+    DUCKDB_GOVERNOR_DIR,
+    run_id=RUN_ID,
+    threads=DUCKDB_TOTAL_THREADS,
+    memory_bytes=DUCKDB_TOTAL_MEMORY_BYTES,
+    temp_bytes=DUCKDB_TOTAL_TEMP_BYTES,
+    interval_seconds=DUCKDB_MONITOR_INTERVAL_SECONDS,
+    enabled=DUCKDB_GOVERNOR_ENABLED,
+)
+
+atexit.register(GOVERNOR.release)
+
+SESSION = register_session(
+    DuckDBSession(
+        f"/tmp/agent-ctx__{RUN_ID}.db",
+        config={
+            "allow_unsigned_extensions": "true",
+            "temp_directory": f"/tmp/agent-ctx-tmp/{RUN_ID}",
+        },
+        on_connect=[
+            GOVERNOR.apply,
+            partial(register_trips, data_dir=DATA_DIR, materialize=TRIPS_MATERIALIZE),
+            *([partial(ROLLUPS.ensure, files=trips_files(DATA_DIR))] if ROLLUPS_ENABLED else []),
+        ],
+    )
+)
+
+
+RESULT_CACHE = ResultCache(
+    os.path.join(CACHE_DIR, "results"),
+    max_memory_bytes=SQL_CACHE_MEMORY_BYTES,
+    max_disk_bytes=SQL_CACHE_DISK_BYTES,
+)
+
+RESULT_CACHE.register_source(TRIPS_TABLE, set(trips_files(DATA_DIR)))
+
+DOCS_CACHE = DocsCache(DOCS_CACHE_DIR, DOCS_CACHE_TTL_SECONDS)
+
+CONDENSER = Condenser(CONDENSE_TARGET_TOKENS)
+
+DOCS = DocsClient(
+    DOCS_CACHE,
+    base_url=DDB_BASE_URL,
+    offline=DOCS_OFFLINE,
+    timeout_seconds=DOCS_TIMEOUT_SECONDS,
+    max_connections=DOCS_MAX_CONNECTIONS,
+)
+
+
+def close_session():
+    """Close the run's DuckDB session, it is reopened lazily on the next query."""
+    # Its sampler cursor first
+    GOVERNOR.close()
+    SESSION.close()
+
+    # Its share of the resources goes to the other runs
+    GOVERNOR.release()
+
+    # Tables created during the run are gone with its database, and the
+    # next connection registers `trips` anew, even if the agent replaced it
+    RESULT_CACHE.invalidate_catalog()
+    RESULT_CACHE.register_source(TRIPS_TABLE, set(trips_files(DATA_DIR)))
+
+
+async def close_docs():
+    """Close the pooled docs HTTP client, so no connection outlives the run."""
+    await DOCS.aclose()
+
+
+async def close_prefetch():
+    """Wait for the prefetching still running, before the session is closed."""
+    await PREFETCH.aclose()
+
+
+def start_run():
+    """
+    Prepare the tools layer for a new agent run: reset its counters, take
+    its share of the DuckDB resources and open the DuckDB session, which
+    registers the `trips` view upfront.
+    """
+    RESULT_CACHE.reset_stats()
+    SQL_GUARD.reset()
+    GOVERNOR.reset()
+    GOVERNOR.register()
+    TOOL_CALLS.reset()
+    PREFETCH.reset()
+    CONDENSER.reset()
+    SQL_VALIDATOR.stats = ValidationStats()
+    DOCS.stats = DocsStats()
+
+    try:
+        SESSION.open()
+
+    except duckdb.Error as e:
+        print(f"Could not open DuckDB session: {e}")
+
+
+def tools_stats() -> dict:
+    """Tools layer counters for the run output."""
+    return {
+        "sql_cache": RESULT_CACHE.stats.model_dump(),
+        "sql_validation": SQL_VALIDATOR.stats.model_dump(),
+        "sql_guard": SQL_GUARD.summary(),
+        "duckdb_resources": GOVERNOR.summary(),
+        "docs_cache": DOCS.stats.model_dump(),
+        "prefetch": PREFETCH.stats.model_dump(),
+        "condense": CONDENSER.stats.model_dump(),
+    }
+
 class ListFilesSchema(BaseModel):
     """Schema for listing files tool."""
     filter: str
+    detail: bool
+
+
+PARQUET_INDEX = ParquetIndex(os.path.join(CACHE_DIR, "parquet_index.json"))
+DATA_LISTING = DirectoryListing(DATA_DIR, PARQUET_INDEX)
+
 
 @tool(
     "list_files",
-    description="List all files available, along with their sizes, in the data directory. This will help you know what files are available to analyze (query), read directly or update. Optionally, provide a filter string to only list files that contain that string in their filename (set it as an empty string to list all files).",
+    description=f"List all files available, along with their sizes, in the data directory. Parquet files also show their row count, number of columns, row groups and date range. This will help you know what files are available to analyze (query), read directly or update. The monthly trip files are also available as the pre-registered `{TRIPS_TABLE}` DuckDB view. Optionally, provide a filter string to only list files that contain that string in their filename (set it as an empty string to list all files). Set `detail` to true to also get the schema (column names and types) and the min/max/null statistics of every column of the parquet files, read from their metadata only.",
     args_schema=ListFilesSchema
 )
-def list_files(filter: str = "") -> str:
+def list_files(filter: str = "", detail: bool = False) -> str:
     try:
         text = ""
 
-        for root, _, filenames in os.walk(DATA_DIR):
-            for filename in filenames:
-                file_path = os.path.join(root, filename)
-                rel_path = os.path.relpath(file_path, os.path.join(DATA_DIR, ".."))
-                size = os.path.getsize(file_path)
+        files = DATA_LISTING.files()
 
-                if filter and len(filter) > 0 and filter.lower() not in filename.lower():
-                    continue
+        _trips_files = [
+            f for f in files
+            if os.path.dirname(f.path) == DATA_DIR and fnmatch(f.filename, TRIPS_FILE_PATTERN)
+        ]
 
-                if any(
-                    filename.lower().endswith(_ext)
-                    for _ext in [".parquet", ".csv"]
-                ):
-                    text += f"- {rel_path} ({size} bytes) [Queriable using DuckDB]\n"
+        if _trips_files and (not filter or filter.lower() in TRIPS_TABLE):
+            _trips_rows = (
+                f", {sum(f.metadata.num_rows for f in _trips_files if f.metadata)} rows"
+                if all(f.metadata for f in _trips_files)
+                else ""
+            )
 
-                else:
-                    text += f"- {rel_path} ({size} bytes) [Readable/Updatable]\n"
+            text += f"- {TRIPS_TABLE} (view over the {len(_trips_files)} monthly trip files{_trips_rows}, with extra `source_month` DATE, `pickup_hour` and `distance_bracket` columns) [Queriable using DuckDB, e.g. `SELECT ... FROM {TRIPS_TABLE}`]\n"
+
+        for file in files:
+            if filter and len(filter) > 0 and filter.lower() not in file.filename.lower():
+                continue
+
+            if file.metadata is not None:
+                text += f"- {file.rel_path} ({file.size} bytes, {file.metadata.describe()}) [Queriable using DuckDB]\n"
+
+                if detail:
+                    text += f"{file.metadata.describe_columns()}\n"
+
+            elif any(
+                file.filename.lower().endswith(_ext)
+                for _ext in [".parquet", ".csv"]
+            ):
+                text += f"- {file.rel_path} ({file.size} bytes) [Queriable using DuckDB]\n"
+
+            else:
+                text += f"- {file.rel_path} ({file.size} bytes) [Readable/Updatable]\n"
 
         return text
 
@@ -92,6 +281,8 @@ def write_file(filename: str, content: str) -> str:
         with open(file_path, "w") as f:
             f.write(content)
 
+        DATA_LISTING.invalidate()
+
         return f"File '{filename}' written successfully."
 
     except Exception as e:
@@ -100,13 +291,15 @@ def write_file(filename: str, content: str) -> str:
 class ReadFileSchema(BaseModel):
     """Schema for reading a file tool."""
     filename: str
+    start_line: int = 0
+    end_line: int = 0
 
 @tool(
     "read_file",
-    description="Read content from a file in the data directory. Provide the filename as input.",
+    description=f"Read content from a file in the data directory. Provide the filename as input, and optionally `start_line` and `end_line` (1-based, inclusive, 0 for the start/end of the file) to only read a range of lines. Outputs over ~{CONDENSE_TARGET_TOKENS} tokens are condensed to their first and last lines.",
     args_schema=ReadFileSchema
 )
-def read_file(filename: str) -> str:
+def read_file(filename: str, start_line: int = 0, end_line: int = 0) -> str:
     try:
         os.makedirs(CONTENT_DIR, exist_ok=True)
 
@@ -118,7 +311,23 @@ def read_file(filename: str) -> str:
         with open(file_path, "r") as f:
             content = f.read()
 
-        return content
+        if start_line > 0 or end_line > 0:
+            lines = content.splitlines()
+            start = max(start_line, 1)
+            end = min(end_line if end_line > 0 else len(lines), len(lines))
+
+            if start > end:
+                return f"Error: Empty line range, '{filename}' has {len(lines)} lines."
+
+            content = "\n".join(lines[start - 1:end])
+            condensed = CONDENSER.text(content, source=f"file {filename}", filename=filename, first_line=start)
+
+            if condensed is not content:
+                return condensed
+
+            return f"Lines {start}-{end} of {len(lines)}:\n{content}"
+
+        return CONDENSER.text(content, source=f"file {filename}", filename=filename)
 
     except Exception as e:
         return f"Error: Could not read file '{filename}': {str(e)}"
@@ -156,66 +365,344 @@ def update_file(filename: str, old_str: str, new_str: str, replace_all: bool = T
         with open(file_path, "w") as f:
             f.write(updated_content)
 
+        DATA_LISTING.invalidate()
+
         return f"File '{filename}' updated successfully, replaced {'all occurrences' if replace_all else 'first occurrence'}"
 
     except Exception as e:
         return f"Error: Could not update file '{filename}': {str(e)}"
 
+SQL_EXECUTOR = ThreadPoolExecutor(
+    max_workers=SQL_MAX_WORKERS,
+    thread_name_prefix="agent-ctx-sql",
+)
+
+
+def sql_vocabulary(con: duckdb.DuckDBPyConnection) -> Vocabulary:
+    """Catalog names plus the data files and their parquet columns, for suggestions."""
+    vocabulary = catalog_vocabulary(con)
+
+    for file in DATA_LISTING.files():
+        vocabulary.files |= {file.rel_path, os.path.abspath(file.path)}
+
+        if file.metadata is not None:
+            vocabulary.columns |= {column.name for column in file.metadata.columns}
+
+    return vocabulary
+
+
+SQL_VALIDATOR = SQLValidator(
+    SESSION,
+    vocabulary=sql_vocabulary,
+    catalog_generation=lambda: RESULT_CACHE.catalog_generation,
+    file_fingerprints=RESULT_CACHE.file_fingerprints,
+)
+
+
 class ValidateSQLSchema(BaseModel):
     """Schema for validating SQL tool."""
     sql: str
 
 @tool(
     "validate_sql",
-    description="""Useful for validating DuckDB SQL syntax.""",
+    description="""Validate DuckDB SQL without running it: the SQL is parsed and planned against the current database, so syntax errors, unknown tables, columns or files and type errors are reported (with "did you mean" suggestions).""",
     args_schema=ValidateSQLSchema
 )
-def validate_sql(sql: str) -> str:
+async def validate_sql(sql: str) -> str:
+    sql = sql.replace("\\n", "\n")
+
+    handle = QueryHandle()
+    loop = asyncio.get_running_loop()
+
     try:
-        sqlglot.parse(sql, read="duckdb")
-        return "Valid DuckDB SQL"
+        result = await asyncio.wait_for(
+            loop.run_in_executor(SQL_EXECUTOR, contextvars.copy_context().run, SQL_VALIDATOR.validate, sql, handle),
+            timeout=SQL_TIMEOUT_SECONDS,
+        )
+
+    except TimeoutError:
+        handle.cancel()
+
+        return f"Error: Validation timed out after {SQL_TIMEOUT_SECONDS:g}s and was cancelled."
+
+    except duckdb.Error as e:
+        return f"Error: Could not validate SQL\n{str(e)}"
+
+    return result.to_text()
+
+SPILLS = SpillStore(
+    os.path.join(CONTENT_DIR, "results"),
+    root_dir=os.path.join(DATA_DIR, ".."),
+    file_format=SQL_SPILL_FORMAT,  # type: ignore
+    preview_rows=SQL_SPILL_PREVIEW_ROWS,
+)
+
+
+SQLMode = Literal["exact", "approx"]
 
-    except sqlglot.ParseError as e:
-        return f"Error: Invalid SQL, here's the error:\n{str(e)}"
 
 class ExecuteSQLSchema(BaseModel):
     """Schema for executing SQL tool."""
     sql: str
+    mode: SQLMode = "exact"
+
+
+SQL_GUARD = SQLGuard(
+    policy=SQL_COST_POLICY,  # type: ignore
+    max_result_rows=SQL_GUARD_MAX_RESULT_ROWS,
+    max_plan_rows=SQL_GUARD_MAX_PLAN_ROWS,
+    limit_rows=SQL_MAX_ROWS,
+)
+
+
+# Statements returning the number of rows they changed
+DML_STATEMENTS = (exp.Insert, exp.Update, exp.Delete, exp.Copy)
+
+
+def _open_relation(
+    con: duckdb.DuckDBPyConnection,
+    sql: str,
+    rollup_sql: str | None = None,
+) -> duckdb.DuckDBPyRelation | None:
+    if rollup_sql is not None:
+        try:
+            rel = con.sql(rollup_sql)
+            print(f"Answering SQL from rollups:\n{rollup_sql}")
+
+            return rel
+
+        except duckdb.Error as e:
+            print(f"Could not answer SQL from rollups, scanning instead: {e}")
+
+    statements = parse_statements(sql)
+
+    # `sql()` runs writes without returning the number of rows they changed,
+    # only `execute()` does
+    if statements and isinstance(statements[-1], DML_STATEMENTS):
+        changed = con.execute(sql).fetchone()
+
+        return con.sql(f'SELECT {int(changed[0])} AS "Count"') if changed is not None else None
+
+    # `sql()` runs every statement but the last, which is returned as a
+    # lazily streamed relation (None if it returns nothing)
+    return con.sql(sql)
+
+
+def _expected_rows(decision: GuardDecision) -> int:
+    """Rows the plan expects the query to return, 0 when it can't tell."""
+    estimate = decision.estimate
+
+    # Estimates of aggregates are too rough, and the guard's LIMIT bounds the result
+    if estimate is None or estimate.aggregated or estimate.has_limit or decision.rewritten_sql is not None:
+        return 0
+
+    return estimate.result_rows or 0
+
+
+def run_sql(
+    sql: str,
+    handle: QueryHandle | None = None,
+    mode: SQLMode = "exact",
+    prefetch: bool = False,
+) -> QueryResult | SpilledResult | None:
+    """
+    Run `sql` on a new session cursor and fetch a bounded result, going
+    through the cost guard and the result cache, or spill it to a file when
+    it has more than `SQL_SPILL_ROWS` rows. In "approx" mode, single-table
+    queries run over a sample instead (see `src.approx`). Blocking,
+    `execute_sql` runs it on the `SQL_EXECUTOR` threads. Returns None for
+    statements without results, raises `QueryRejected` when the guard
+    rejects it. Its peak memory and spill use are recorded by `GOVERNOR`.
+
+    `prefetch` runs the cheap probes of `PREFETCH` into the result cache
+    without counting them in the run's stats: they skip the guard, and the
+    cache counts the first hit on them separately.
+    """
+    notes: list[str] = []
+    approx = None
+
+    # Rewritten before the guard, which checks the SQL that actually runs
+    rollup_sql = None
+
+    if ROLLUPS_ENABLED:
+        # The rollups are loaded when the session opens
+        SESSION.open()
+        rollup_sql = ROLLUPS.rewrite(sql)
+
+    if mode == "approx":
+        if rollup_sql is not None:
+            notes.append("Exact result, answered from the precomputed rollups as fast as an approximation.")
+
+        else:
+            try:
+                approx = rewrite_approx(sql, SQL_APPROX_SAMPLE_PERCENT, SQL_APPROX_METHOD)  # type: ignore
+                print(f"Approximating SQL with:\n{approx.sql}")
+
+            except NotApproximable as e:
+                notes.append(f"Exact result, the query can't be approximated: {e}.")
+
+    # Keyed on the SQL before the guard changes it, so cache hits don't pay
+    # for planning (the guard's note is cached with the result). Computed
+    # even with the cache disabled, as it tracks catalog writes the
+    # `validate_sql` results depend on
+    key_sql = approx.sql if approx is not None else sql
+
+    def result_key() -> CacheKey | None:
+        key = RESULT_CACHE.key(
+            key_sql,
+            salt=f"{SQL_MAX_ROWS}:{SQL_MAX_BYTES}:{SQL_SPILL_ROWS}:{SQL_GUARD.policy}:{mode}",
+            record=not prefetch,
+        )
+
+        return key if SQL_CACHE_ENABLED else None
+
+    cache_key = result_key()
+
+    result = RESULT_CACHE.get(cache_key, record=not prefetch) if cache_key is not None else None
+    record_call(cache_hit=result is not None)
+
+    if result is not None:
+        print("Serving SQL result from cache")
+        record_call(rows_returned=result.total_rows)
+
+        return result.model_copy(update={"notes": result.notes + notes}) if notes else result
+
+    # Only queries that run are monitored, cache hits don't touch DuckDB
+    with GOVERNOR.monitor(SESSION.cursor, sql):
+        con = SESSION.cursor(sql)
+
+        try:
+            if handle is not None:
+                handle.attach(con)
+
+            # Part of the cached result, like the error bound of approximations
+            result_notes: list[str] = []
+
+            decision = (
+                GuardDecision(action="skip", reason="prefetch probe", sql=sql)
+                if prefetch
+                else SQL_GUARD.check(con, approx.sql if approx is not None else rollup_sql or sql)
+            )
+
+            if decision.estimate is not None:
+                record_call(rows_scanned=decision.estimate.scan_rows)
+
+            if decision.rewritten_sql is not None:
+                if approx is not None:
+                    approx = approx.model_copy(update={"sql": decision.rewritten_sql})
+
+                elif rollup_sql is not None:
+                    rollup_sql = decision.rewritten_sql
+
+                else:
+                    sql = decision.rewritten_sql
+
+                # The LIMIT is also the fetch cap, the omitted rows can't be counted
+                result_notes.append(
+                    f"LIMIT {SQL_MAX_ROWS} was added to the query, as {decision.reason}, "
+                    "so its total number of rows is unknown."
+                )
+
+            if approx is not None:
+                rel, approx_note = materialize(con, approx)
+
+            else:
+                rel, approx_note = _open_relation(con, sql, rollup_sql), None
+
+            if rel is None:
+                return None
+
+            if approx_note is not None:
+                result_notes.append(approx_note)
+
+            spilled: SpilledResult | None = None
+            catalog_changed = False
+
+            if SQL_SPILL_ROWS > 0 and _expected_rows(decision) > SQL_SPILL_ROWS:
+                # Written to a file straight away, so the query only runs once
+                spilled = SPILLS.spill(con, rel)
+                catalog_changed = True
+
+                if spilled.total_rows <= SQL_SPILL_ROWS:
+                    # The plan overestimated it, shown from the file instead
+                    result = fetch_bounded(
+                        con.sql(f"FROM {spilled.view}"),
+                        max_rows=SQL_MAX_ROWS,
+                        max_bytes=SQL_MAX_BYTES,
+                        batch_rows=SQL_FETCH_BATCH_ROWS,
+                        count_total=True,
+                    )
+
+                    SPILLS.discard(con, spilled)
+                    spilled = None
+
+            else:
+                result = fetch_bounded(
+                    rel,
+                    max_rows=SQL_MAX_ROWS,
+                    max_bytes=SQL_MAX_BYTES,
+                    batch_rows=SQL_FETCH_BATCH_ROWS,
+                    # Only up to the spill threshold, larger results are counted by spilling
+                    count_total=SQL_SPILL_ROWS > 0,
+                    max_count=SQL_SPILL_ROWS,
+                )
+
+                if SQL_SPILL_ROWS > 0 and result.truncated and result.total_rows is None:
+                    spilled = SPILLS.spill(con, rel)
+                    catalog_changed = True
+
+            if catalog_changed:
+                RESULT_CACHE.invalidate_catalog()
+
+                # Results reading catalog tables are keyed on the catalog generation
+                cache_key = result_key()
+
+            if spilled is not None:
+                print(f"Spilled {spilled.total_rows} rows to {spilled.path} as `{spilled.view}`")
+                result = spilled
+
+            result.notes = result_notes
+
+            # Repeating a spilled query reuses its view and file
+            if cache_key is not None:
+                RESULT_CACHE.put(cache_key, result, prefetched=prefetch)
+
+        finally:
+            con.close()
+
+    record_call(rows_returned=result.total_rows)
+
+    return result.model_copy(update={"notes": result.notes + notes}) if notes else result
+
 
 @tool(
     "execute_sql",
-    description="""Execute a DuckDB SQL query on an in-memory database and return the results as a string. The SQL query should be provided as input.""",
+    description=f"""Execute a DuckDB SQL query on an in-memory database and return the results as a string, starting with a header of column names. The SQL query should be provided as input. At most {SQL_MAX_ROWS} rows are returned, the rest are omitted{f" (results over {SQL_SPILL_ROWS} rows are saved to a file and a view you can query, only a preview is returned)" if SQL_SPILL_ROWS > 0 else ""}. Queries running longer than {SQL_TIMEOUT_SECONDS:g} seconds are cancelled.{SQL_GUARD.description()} Set `mode` to "approx" to explore faster: single-table queries then run over a ~{SQL_APPROX_SAMPLE_PERCENT:g}% sample, with counts and sums scaled up and an error bound in the result. Keep the default "exact" mode for the numbers you deliver.""",
     args_schema=ExecuteSQLSchema
 )
-def execute_sql(sql: str) -> str:
-    try:
-        db_path = f"/tmp/agent-ctx__{RUN_ID}.db"
-
-        con = duckdb.connect(
-            db_path,
-            config={
-                "allow_unsigned_extensions": "true",
-                "temp_directory": f"/tmp/agent-ctx-tmp/{RUN_ID}",
-            }
-        )
+async def execute_sql(sql: str, mode: SQLMode = "exact") -> str:
+    # Escape newlines in the SQL in case double \\n are passed
+    sql = sql.replace("\\n", "\n")
 
-        con.install_extension("httpfs")
-        con.load_extension("httpfs")
+    print(f"Executing SQL:\n{sql}")
 
-        # Escape newlines in the SQL in case double \\n are passed
-        sql = sql.replace("\\n", "\n")
+    handle = QueryHandle()
+    loop = asyncio.get_running_loop()
 
-        print(f"Executing SQL:\n{sql}")
+    try:
+        result = await asyncio.wait_for(
+            # With the context, so the tool call record reaches `run_sql`
+            loop.run_in_executor(SQL_EXECUTOR, contextvars.copy_context().run, run_sql, sql, handle, mode),
+            timeout=SQL_TIMEOUT_SECONDS,
+        )
 
-        result = con.execute(sql).fetchall()
-        con.close()
+    except TimeoutError:
+        handle.cancel()
 
-        if not result:
-            return "Query executed successfully, but returned no results."
+        return f"Error: Query timed out after {SQL_TIMEOUT_SECONDS:g}s and was cancelled. Consider adding a LIMIT, filtering (e.g. on `source_month` of the `{TRIPS_TABLE}` view) or aggregating to make it cheaper."
 
-        # Format the results as a string
-        result_str = "\n".join([", ".join(map(str, row)) for row in result])
-        return result_str
+    except QueryRejected as e:
+        return f"Error: Query rejected before running, as {e.decision.reason}. Add a LIMIT, filters (e.g. on `source_month` of the `{TRIPS_TABLE}` view) or aggregations to make it cheaper."
 
     except duckdb.Error as e:
         if "No files found" in str(e):
@@ -223,6 +710,15 @@ def execute_sql(sql: str) -> str:
 
         return f"Error: Could not execute SQL\n{str(e)}\nPlease, validate the SQL syntax before executing, check table and column names, and ensure the SQL is compatible with DuckDB."
 
+    if result is None:
+        return "Query executed successfully, but returned no results."
+
+    if isinstance(result, SpilledResult):
+        # Already a preview of the file the result was saved to
+        return result.to_text()
+
+    return CONDENSER.table(result)
+
 
 class ReadDocsSchema(BaseModel):
     """Schema for reading DuckDB documentation tool."""
@@ -236,36 +732,84 @@ class ReadDocsSchema(BaseModel):
 async def read_docs(
     path: str | None = None
 ) -> str:
-    async with httpx.AsyncClient(
-        base_url=DDB_BASE_URL,
-        follow_redirects=True,
-    ) as client:
-        print(f"Fetching DuckDB docs page: {path or '/sitemap'}")
-
-        r = await client.get(
-            path or "/sitemap",
-            follow_redirects=True,
-        )
+    try:
+        return CONDENSER.markdown(await DOCS.read(path), source=f"docs page {normalize_path(path or '/sitemap')}")
 
-        if r.status_code == 404:
+    except DocsError as e:
+        if e.status_code == 404:
             return "Error: Page not found (404), use the '/sitemap' to find valid pages."
 
-        if r.status_code >= 400:
-            return f"Error: Received status code {r.status_code}"
+        return f"Error: {e}"
 
-        # Check for canonical URL in HTML
-        soup = BeautifulSoup(r.text, 'html.parser')
-        canonical = soup.find('link', rel='canonical')
-        
-        if canonical and canonical.get('href'):
-            canonical_url = canonical['href']
-            r = await client.get(canonical_url) # type: ignore
+    except httpx.HTTPError as e:
+        return f"Error: Could not fetch docs page: {e}"
 
-        return convert(r.text)
 
+class SearchDocsSchema(BaseModel):
+    """Schema for searching DuckDB documentation tool."""
+    query: str
+    k: int
 
-def get_tools():
-    return [
+DOCS_SEARCH = DocSearchIndex(DOCS_CACHE, os.path.join(DOCS_CACHE_DIR, "search_index.json"))
+
+@tool(
+    "search_docs",
+    description="""Search the DuckDB documentation for a query (e.g. a function name or a feature) and return the `k` best matching sections, with their page path and a short snippet. Much cheaper than reading whole pages, use `read_docs` with the returned path only when the snippet is not enough.""",
+    args_schema=SearchDocsSchema
+)
+def search_docs(query: str, k: int = 5) -> str:
+    hits = DOCS_SEARCH.search(query, max(1, min(k, 20)))
+    record_call(rows_returned=len(hits))
+
+    if DOCS_SEARCH.size == 0:
+        return "Error: No documentation pages are cached yet, use `read_docs` to read the '/sitemap' and pages instead."
+
+    if not hits:
+        return f"No documentation sections match '{query}', try other terms or browse the '/sitemap' with `read_docs`."
+
+    text = ""
+
+    for i, hit in enumerate(hits, start=1):
+        text += f"{i}. {hit.path} - {hit.title} (score {hit.score})\n"
+        text += "\n".join(f"   {line}" for line in hit.snippet.splitlines() if line.strip()) + "\n"
+
+    return text
+
+
+PREFETCH = Prefetcher(
+    SESSION,
+    DATA_LISTING,
+    DOCS,
+    run_sql=partial(run_sql, prefetch=True),
+    file_sources=lambda: RESULT_CACHE.sources.keys(),
+    default_tables=[TRIPS_TABLE],
+    warm_max_bytes=PREFETCH_WARM_MAX_BYTES,
+    max_docs=PREFETCH_MAX_DOCS,
+    max_tables=PREFETCH_MAX_TABLES,
+    enabled=PREFETCH_ENABLED,
+)
+
+
+class ExpandOutputSchema(BaseModel):
+    """Schema for expanding a condensed tool output tool."""
+    handle: str
+    start_line: int
+    end_line: int
+
+@tool(
+    "expand_output",
+    description=f"""Read a range of a condensed tool output. Outputs over ~{CONDENSE_TARGET_TOKENS} tokens are condensed (tables to column stats and first/last rows, docs pages to an outline of their sections with line ranges) and start with a handle like `[output_3]`: provide it with the 1-based, inclusive range of rows (tables) or lines (pages, text) to read. `end_line` 0 reads to the end.""",
+    args_schema=ExpandOutputSchema
+)
+def expand_output(handle: str, start_line: int = 1, end_line: int = 0) -> str:
+    return CONDENSER.expand(handle.strip("[]` "), start_line, end_line)
+
+
+TOOL_CALLS = ToolCallLog()
+
+_TOOLS = [
+    TOOL_CALLS.instrument(t)
+    for t in [
         list_files,
         write_file,
         read_file,
@@ -273,7 +817,20 @@ def get_tools():
         validate_sql,
         execute_sql,
         read_docs,
+        search_docs,
+        expand_output,
     ]
+]
+
+
+def get_tools():
+    """The agent tools, recording every call in `TOOL_CALLS`."""
+    return list(_TOOLS)
+
+
+def tool_calls() -> list[dict]:
+    """Per call records of the run's tools, for the `tool_calls` run output."""
+    return TOOL_CALLS.dump()
 
 
 def bind_tools(llm: BaseChatModel):